@@ -1,27 +1,64 @@
 import requests
 import pandas as pd
-from typing import Dict, List, Optional
+from typing import Dict, Iterator, List, Optional, Union
 from urllib.parse import urlencode
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import json
 
+from response_cache import CacheMiss, ResponseCache, cache_key
+
+
+# Years per unit for the "<n> <unit>" age strings used by the v2 API
+AGE_UNIT_YEARS = {
+    'year': 1.0,
+    'month': 1 / 12,
+    'week': 1 / 52,
+    'day': 1 / 365,
+    'hour': 1 / (365 * 24),
+    'minute': 1 / (365 * 24 * 60),
+}
+SEX_DTYPE = pd.CategoricalDtype(['ALL', 'FEMALE', 'MALE'])
+
 
 # Written by Mitchell Klusty
 class ClinicalTrialsFilterV2:
-    def __init__(self):
-        self.base_url = "https://clinicaltrials.gov/api/v2/studies"
-        
-    def search_trials(self,
-                     condition: Optional[str] = None,
-                     sex: Optional[str] = None,
-                     min_age: Optional[int] = None,
-                     max_age: Optional[int] = None,
-                     location: Optional[str] = None,
-                     status: str = "RECRUITING",
-                     sort_by_relevance: bool = False, # by default, results are unsorted although clinicaltrials has relevance as an internal system
-                     page_size: int = 100) -> pd.DataFrame: # maximum value is 1000, anything higher is coerced down
-        """
-        Search for clinical trials using ClinicalTrials.gov API v2 studies endpoint
-        """
+    def __init__(self,
+                 base_url: str = "https://clinicaltrials.gov/api/v2/studies",
+                 max_retries: int = 3,
+                 backoff_factor: float = 0.5,
+                 session: Optional[requests.Session] = None,
+                 cache: Optional[ResponseCache] = None, # responses are read from and written to this cache
+                 offline: bool = False): # only serve from the cache, never touch the network
+        if offline and cache is None:
+            raise ValueError("offline mode requires a cache")
+        self.base_url = base_url
+        self.session = session or self._create_session(max_retries, backoff_factor)
+        self.cache = cache
+        self.offline = offline
+
+    @staticmethod
+    def _create_session(max_retries: int, backoff_factor: float) -> requests.Session:
+        """Pooled session that retries rate limiting and server errors with exponential backoff"""
+        retry = Retry(
+            total=max_retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=[429, 500, 502, 503, 504],
+            allowed_methods=["GET"]
+        )
+        session = requests.Session()
+        session.mount("https://", HTTPAdapter(max_retries=retry))
+        session.mount("http://", HTTPAdapter(max_retries=retry))
+        session.headers.update({'Accept': 'application/json'})
+        return session
+
+    def _build_params(self,
+                      condition: Optional[str],
+                      sex: Optional[str],
+                      location: Optional[str],
+                      status: str,
+                      sort_by_relevance: bool,
+                      page_size: int) -> Dict:
         params = {
             'format': 'json',
             'pageSize': page_size,
@@ -43,20 +80,108 @@ class ClinicalTrialsFilterV2:
 
         if sort_by_relevance:
             params['sort'] = '@relevance'
-        
-        response = requests.get(
-            self.base_url,
-            params=params,
-            headers={'Accept': 'application/json'}
-        )
-        response.raise_for_status()
-        
-        data = response.json()
-        studies = data.get('studies', [])
-        
-        if not studies:
+
+        return params
+
+    def search_trials(self,
+                     condition: Optional[str] = None,
+                     sex: Optional[str] = None,
+                     min_age: Optional[int] = None,
+                     max_age: Optional[int] = None,
+                     location: Optional[str] = None,
+                     status: str = "RECRUITING",
+                     sort_by_relevance: bool = False, # by default, results are unsorted although clinicaltrials has relevance as an internal system
+                     page_size: int = 100, # maximum value is 1000, anything higher is coerced down
+                     max_results: Optional[int] = None) -> pd.DataFrame: # follow nextPageToken until this many studies are fetched
+        """
+        Search for clinical trials using ClinicalTrials.gov API v2 studies endpoint
+
+        Without max_results only the first page is fetched. With it, pages are followed
+        until max_results studies have been fetched or the results run out.
+        """
+        pages = list(self.iter_trial_pages(
+            condition=condition,
+            sex=sex,
+            min_age=min_age,
+            max_age=max_age,
+            location=location,
+            status=status,
+            sort_by_relevance=sort_by_relevance,
+            page_size=page_size,
+            max_results=max_results if max_results is not None else page_size
+        ))
+
+        if not pages:
             return pd.DataFrame()
 
+        return pd.concat(pages, ignore_index=True)
+
+    def iter_trial_pages(self,
+                         condition: Optional[str] = None,
+                         sex: Optional[str] = None,
+                         min_age: Optional[int] = None,
+                         max_age: Optional[int] = None,
+                         location: Optional[str] = None,
+                         status: str = "RECRUITING",
+                         sort_by_relevance: bool = False,
+                         page_size: int = 100,
+                         max_results: Optional[int] = None) -> Iterator[pd.DataFrame]:
+        """
+        Yield one DataFrame per page of results, following nextPageToken.
+
+        Only the current page is held in memory, so large condition searches can be
+        streamed. Stops after max_results studies (None means all of them).
+        """
+        params = self._build_params(condition, sex, location, status, sort_by_relevance, page_size)
+        fetched = 0
+
+        while max_results is None or fetched < max_results:
+            if max_results is not None:
+                params['pageSize'] = min(page_size, max_results - fetched)
+
+            data = self._get_page(params)
+            studies = data.get('studies', [])
+            if not studies:
+                break
+
+            fetched += len(studies)
+            df = self.normalize_trials(self._studies_to_frame(studies))
+
+            if min_age is not None or max_age is not None:
+                df = self._filter_by_age(df, min_age, max_age)
+
+            yield df
+
+            next_page_token = data.get('nextPageToken')
+            if not next_page_token:
+                break
+            params['pageToken'] = next_page_token
+
+    def _get_page(self, params: Dict) -> Dict:
+        """Fetch one page of results, going through the response cache when there is one"""
+        if self.cache is None:
+            return self._fetch_page(params)
+
+        key = cache_key(self.base_url, params)
+        # Offline, an expired entry is still better than no answer
+        data = self.cache.get(key, allow_stale=self.offline)
+        if data is not None:
+            return data
+        if self.offline:
+            raise CacheMiss(f"No cached response for {urlencode(sorted(params.items()))}")
+
+        data = self._fetch_page(params)
+        self.cache.set(key, data)
+        return data
+
+    def _fetch_page(self, params: Dict) -> Dict:
+        response = self.session.get(self.base_url, params=params)
+        response.raise_for_status()
+        return response.json()
+
+    @staticmethod
+    def _studies_to_frame(studies: List[Dict]) -> pd.DataFrame:
+        """Flatten the v2 study documents into one row per trial"""
         records = []
         for study in studies:
             protocol = study.get('protocolSection', {})
@@ -91,40 +216,54 @@ class ClinicalTrialsFilterV2:
             }
             records.append(record)
             
-        df = pd.DataFrame(records)
-        
-        if min_age is not None or max_age is not None:
-            df = self._filter_by_age(df, min_age, max_age)
-            
-        return df
+        return pd.DataFrame(records)
     
+    @staticmethod
+    def normalize_trials(df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Return a copy of `df` with the derived eligibility columns, once per fetched batch.
+
+        Ages are parsed into float years (min_age_years, max_age_years) and sex is made
+        categorical, so that filtering afterwards is plain boolean masks. The caller's
+        frame is left as it was, so a cached raw batch can be normalized again.
+        """
+        if df.empty:
+            return df.copy()
+        return df.assign(min_age_years=parse_ages(df["minimum_age"]),
+                         max_age_years=parse_ages(df["maximum_age"]),
+                         sex=df["sex"].astype(SEX_DTYPE))
+
+    @staticmethod
+    def condition_lookup(df: pd.DataFrame) -> pd.Series:
+        """One lowercased condition per row, indexed by the trial's row label"""
+        return df["conditions"].explode().dropna().astype(str).str.strip().str.lower()
+
     def _filter_by_age(self, df: pd.DataFrame, 
                       min_age: Optional[int], 
                       max_age: Optional[int]) -> pd.DataFrame:
         """Filter trials by age criteria"""
-        def parse_age(age_str: str) -> Optional[float]:
-            if pd.isna(age_str) or not isinstance(age_str, str):
-                return None
-            try:
-                value = int(''.join(filter(str.isdigit, age_str)))
-                if 'Month' in age_str:
-                    value = value / 12
-                elif 'Week' in age_str:
-                    value = value / 52
-                return value
-            except:
-                return None
-        
-        df["min_age_years"] = df["minimum_age"].apply(parse_age)
-        df["max_age_years"] = df["maximum_age"].apply(parse_age)
-        
+        if "min_age_years" not in df:
+            df = self.normalize_trials(df)
+        if df.empty:
+            return df
+
+        mask = pd.Series(True, index=df.index)
         if min_age is not None:
-            df = df[df["max_age_years"].isna() | (df["max_age_years"] >= min_age)]
+            mask &= df["max_age_years"].isna() | (df["max_age_years"] >= min_age)
             
         if max_age is not None:
-            df = df[df["min_age_years"].isna() | (df["min_age_years"] <= max_age)]
+            mask &= df["min_age_years"].isna() | (df["min_age_years"] <= max_age)
             
-        return df
+        return df[mask]
+
+
+def parse_ages(ages: pd.Series) -> pd.Series:
+    """Parse age strings such as '18 Years' or '6 Months' into float years, NaN if missing"""
+    parts = ages.astype(object).where(ages.notna(), '').astype(str).str.extract(
+        r'(?P<value>\d+(?:\.\d+)?)\s*(?P<unit>[A-Za-z]*)')
+    values = pd.to_numeric(parts["value"], errors='coerce')
+    units = parts["unit"].fillna('').str.lower().str.rstrip('s').map(AGE_UNIT_YEARS).fillna(1.0)
+    return (values * units).astype(float)
 
 def display_trial_details(trial: pd.Series, patient_info: Dict):
     """
@@ -176,9 +315,11 @@ def display_trial_details(trial: pd.Series, patient_info: Dict):
     print(f"Accepts healthy volunteers: {trial['healthy_volunteers']}")
     print("="*80 + "\n")
 
-def find_trials_for_patient(patient_info: Dict) -> pd.DataFrame:
-    """Find clinical trials matching patient criteria"""
-    ct_filter = ClinicalTrialsFilterV2()
+def find_trials_for_patient(patient_info: Dict,
+                            cache: Optional[ResponseCache] = None,
+                            offline: bool = False) -> pd.DataFrame:
+    """Find clinical trials matching patient criteria, optionally through a response cache"""
+    ct_filter = ClinicalTrialsFilterV2(cache=cache, offline=offline)
     
     trials = ct_filter.search_trials(
         condition=patient_info['condition'],
@@ -189,12 +330,12 @@ def find_trials_for_patient(patient_info: Dict) -> pd.DataFrame:
     )
     
     return trials
-def get_trial_details(trial: pd.Series, patient_info: Dict) -> Dict:
+def get_trial_details(trial: Union[pd.Series, Dict], patient_info: Dict) -> Dict:
     """
     Get detailed information about a trial and matching criteria as a dictionary.
     
     Args:
-        trial: Series containing trial information
+        trial: Series or record dict containing trial information
         patient_info: Dictionary containing patient criteria
     
     Returns:
@@ -211,7 +352,7 @@ def get_trial_details(trial: pd.Series, patient_info: Dict) -> Dict:
             "country": trial['country']
         },
         "patient_location": patient_info['location'],
-        "sex": trial['sex'],
+        "sex": trial['sex'] if pd.notna(trial['sex']) else None,
         "patient_sex": patient_info['sex'],
         "age_range": {
             "minimum_age": trial['minimum_age'],
@@ -229,6 +370,10 @@ def get_trial_details(trial: pd.Series, patient_info: Dict) -> Dict:
         }
     }
 
+def get_trials_details(trials: pd.DataFrame, patient_info: Dict) -> List[Dict]:
+    """Get the details dictionary for every trial in a result frame"""
+    return [get_trial_details(trial, patient_info) for trial in trials.to_dict('records')]
+
 # Example usage
 if __name__ == "__main__":
     patient = {
@@ -238,15 +383,19 @@ if __name__ == "__main__":
         'location': 'Boston Massachusetts'
     }
 
-    matching_trials = find_trials_for_patient(patient)
+    matching_trials = find_trials_for_patient(patient, cache=ResponseCache())
 
     if not matching_trials.empty:
         print(f"\nFound {len(matching_trials)} matching trials.")
-        
-        # Convert all trials to JSON format
-        trials_data = [get_trial_details(trial, patient) for _, trial in matching_trials.iterrows()]
-        
-        # Write to a JSON file
+
+        from trial_snapshot import DEFAULT_SNAPSHOT_PATH, write_snapshot
+
+        # Columnar snapshot read by the trials index and cohort matching
+        write_snapshot(matching_trials, DEFAULT_SNAPSHOT_PATH)
+        print(f"Trial snapshot saved to {DEFAULT_SNAPSHOT_PATH}")
+
+        # Legacy JSON export of the per-trial details
+        trials_data = get_trials_details(matching_trials, patient)
         with open("clinical_trials_results.json", "w") as f:
             json.dump(trials_data, f, indent=4)
         
@@ -20,6 +20,13 @@ function LLMChat() {
         setMessages(prevMessages => [...prevMessages, { role: role,content: message }]);
     };
 
+    const appendToLastMessage = (text) => {
+        setMessages(prevMessages => {
+            const last = prevMessages[prevMessages.length - 1];
+            return [...prevMessages.slice(0, -1), { ...last, content: last.content + text }];
+        });
+    };
+
     const handleInput = () => {
         if (input !== '') {
             addMessage(input, 'user');
@@ -47,31 +54,61 @@ function LLMChat() {
             temperature: 0.7,
         });
 
-        //const result = await fetch('https://data.ai.uky.edu/llm-upload/openai/v1/chat/completions', {
-        const result = await fetch('http://localhost:5000/check-database', {
-            method: 'POST',
-            headers: {
-                'Access-Control-Allow-Origin':'*',
-                'Content-Type': 'application/json',
-                'Authorization': `Bearer ${import.meta.env.VITE_LLMF_API_KEY}`,
-            },
-            body: req
-        })
-            .then(response => response.json())
-            .then(data => {
-                //setResults([]); // clean slate before getting new results
-                console.log(data);
-                if (data.error) {
-                    addMessage(data.error_message || 'Failed to submit query. Try reloading...', 'system');
-                } else {
-                    //addMessage(data.choices[0].message.content, 'system');
-                    addMessage(data.response.explanation, 'system');
-                    setResults(data.response.papers);
-                }
-            })
-            .catch(error => {
-                console.error('Error:', error);
+        try {
+            const response = await fetch('http://localhost:5000/check-database/stream', {
+                method: 'POST',
+                headers: {
+                    'Access-Control-Allow-Origin':'*',
+                    'Content-Type': 'application/json',
+                    'Accept': 'text/event-stream',
+                    'Authorization': `Bearer ${import.meta.env.VITE_LLMF_API_KEY}`,
+                },
+                body: req
             });
+
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = '';
+            let started = false;
+
+            const handleEvent = (event, data) => {
+                if (event === 'papers') {
+                    setResults(data.papers);
+                } else if (event === 'token') {
+                    if (!started) {
+                        started = true;
+                        addMessage(data.content, 'system');
+                    } else {
+                        appendToLastMessage(data.content);
+                    }
+                } else if (event === 'error') {
+                    addMessage(data.response || 'Failed to submit query. Try reloading...', 'system');
+                }
+            };
+
+            // Server-Sent Events arrive as "event: <name>\ndata: <json>\n\n" frames
+            while (true) {
+                const { done, value } = await reader.read();
+                if (done) break;
+                buffer += decoder.decode(value, { stream: true });
+
+                let boundary;
+                while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                    const frame = buffer.slice(0, boundary);
+                    buffer = buffer.slice(boundary + 2);
+
+                    let event = 'message';
+                    let data = '';
+                    for (const line of frame.split('\n')) {
+                        if (line.startsWith('event: ')) event = line.slice(7);
+                        else if (line.startsWith('data: ')) data += line.slice(6);
+                    }
+                    handleEvent(event, data ? JSON.parse(data) : {});
+                }
+            }
+        } catch (error) {
+            console.error('Error:', error);
+        }
     };
 
     const resetChat = () => {
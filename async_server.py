@@ -0,0 +1,308 @@
+import asyncio
+import argparse
+import time
+
+import uvicorn
+from neo4j.exceptions import ClientError
+from quart import Quart, Response, g, request, jsonify
+from quart_cors import cors
+
+import metrics
+import retrieval
+import server
+from clients import AsyncClientRegistry
+from server import (extract_search_terms, find_related_papers, format_explanation_prompt,
+                    format_paper, generate_search_query, generate_vector_query, sse_event)
+
+# ASGI version of server.py. Same /check-database and /check-database/stream contract, but every
+# request runs on the event loop, so a slow LLM call no longer ties up a worker for its full duration.
+#
+#   uvicorn async_server:app --workers 4
+app = cors(Quart(__name__))
+
+clients = AsyncClientRegistry('config.json')
+
+
+@app.before_serving
+async def startup():
+    server.trials_db = await asyncio.to_thread(server.load_trials_index, clients.config)
+    server.related_papers = await asyncio.to_thread(server.load_related_papers, clients.config)
+    server.explanation_cache = server.ExplanationCache.from_config(
+        clients.config, server.EXPLANATION_PROMPT_VERSION,
+        embed=lambda text: clients.embeddings.embed_query(text), embed_errors=server.EMBEDDING_API_ERRORS)
+
+
+@app.after_serving
+async def shutdown():
+    await clients.aclose()
+
+
+async def keyword_search(search_terms, candidates, timer):
+    with timer.stage('keyword'):
+        query, params = generate_search_query(search_terms, limit=candidates)
+        rows = await clients.query(query, params)
+    metrics.NEO4J_ROWS.observe(len(rows), query='keyword')
+    return rows
+
+
+async def vector_search(question, candidates, timer):
+    """Embedding similarity stage, skipped on the same expected failures as server.vector_search."""
+    with timer.stage('vector'):
+        try:
+            vector = await asyncio.to_thread(clients.embeddings.embed_query, question)
+        except server.EMBEDDING_API_ERRORS as e:
+            return server.skip_vector_search('embedding_api', e)
+        if vector is None:
+            return server.skip_vector_search('embedding_api', 'no embedding returned')
+
+        query, params = generate_vector_query(vector, limit=candidates)
+        try:
+            rows = await clients.query(query, params)
+        except ClientError as e:
+            if not server.missing_vector_index(e):
+                raise
+            return server.skip_vector_search('no_vector_index', e.message)
+    metrics.NEO4J_ROWS.observe(len(rows), query='vector')
+    return rows
+
+
+async def search_papers(search_terms, question, k=5):
+    """Hybrid article search on the async driver, see server.search_papers."""
+    config = clients.config
+    candidates = config.get('retrieval_candidates', retrieval.DEFAULT_CANDIDATES)
+    timer = retrieval.StageTimer()
+
+    with timer.stage('retrieval'):
+        keyword, vector = await asyncio.gather(
+            keyword_search(search_terms, candidates, timer),
+            vector_search(question, candidates, timer)
+        )
+
+    with timer.stage('fusion'):
+        fused = retrieval.fuse({'keyword': keyword, 'vector': vector}, retrieval.fusion_weights(config), k)
+
+    return [format_paper(result) for result in fused], timer.timings
+
+
+async def search_trials(question):
+    """Look up related clinical trials in the prebuilt index, see server.search_trials."""
+    if server.trials_db is None:
+        return []
+    return await asyncio.to_thread(server.search_trials, question)
+
+
+async def generate_result_explanation(question, results):
+    """Generate an LLM explanation of the search results, bounded by the LLM semaphore."""
+    if not results:
+        return "No relevant papers were found matching your query."
+
+    cache = server.explanation_cache
+    pmids = [paper['pmid'] for paper in results]
+    if cache is not None:
+        # SQLite and the optional question embedding block, keep them off the event loop
+        cached = await asyncio.to_thread(cache.get, question, pmids)
+        if cached is not None:
+            return cached
+
+    response = await clients.invoke_llm(format_explanation_prompt(question, results))
+    metrics.record_llm_usage(response)
+    explanation = response.content
+    if cache is not None:
+        await asyncio.to_thread(cache.put, question, pmids, explanation)
+    return explanation
+
+
+async def stream_result_explanation(question, results):
+    """
+    Yield the LLM explanation of the search results token by token, see
+    server.stream_result_explanation. The stream holds an LLM semaphore slot until it ends.
+    """
+    if not results:
+        yield "No relevant papers were found matching your query."
+        return
+
+    cache = server.explanation_cache
+    pmids = [paper['pmid'] for paper in results]
+    if cache is not None:
+        cached = await asyncio.to_thread(cache.get, question, pmids)
+        if cached is not None:
+            yield cached
+            return
+
+    tokens = []
+    async for chunk in clients.stream_llm(format_explanation_prompt(question, results)):
+        metrics.record_llm_usage(chunk)
+        if chunk.content:
+            tokens.append(chunk.content)
+            yield chunk.content
+    if cache is not None:
+        await asyncio.to_thread(cache.put, question, pmids, ''.join(tokens))
+
+
+def request_endpoint():
+    return request.url_rule.rule if request.url_rule else 'unmatched'
+
+
+# No cProfile here: requests interleave on the event loop, so a profile can't be pinned to one
+@app.before_request
+async def start_request():
+    g.start = time.perf_counter()
+    # Keeps this request's clients open if a config reload replaces them mid-request
+    g.clients_generation = clients.acquire()
+
+
+@app.after_request
+async def finish_request(response):
+    """Record the request's stage timings and duration, and send the timings as Server-Timing."""
+    timings = g.get('timings')
+    if timings:
+        metrics.record_timings(timings)
+        response.headers['Server-Timing'] = metrics.server_timing(timings)
+    # A streamed body is still to come, the stream records its own duration
+    if not g.get('streamed'):
+        metrics.REQUEST_SECONDS.observe(time.perf_counter() - g.start, endpoint=request_endpoint())
+    # The stream's own queries and LLM call hold their clients open while it runs
+    generation = g.get('clients_generation')
+    if generation is not None:
+        clients.release(generation)
+    return response
+
+
+@app.route('/check-database', methods=['POST'])
+async def handle_database_request():
+    try:
+        # Validate request
+        params = await request.get_json()
+        if not params or "messages" not in params:
+            return jsonify({'status': "error", 'response': "Must include messages in request"})
+
+        # Get the user's question
+        question = params["messages"][-1]['content']
+
+        # Stage timings in ms, reported in the response, the Server-Timing header and /metrics
+        timer = retrieval.StageTimer()
+        g.timings = timer.timings
+
+        # Extract search terms from question
+        with timer.stage('terms'):
+            search_terms = extract_search_terms(question)
+        if not search_terms:
+            return jsonify({
+                'status': "error",
+                'response': "Could not extract meaningful search terms from the question"
+            })
+
+        # Independent retrieval steps run concurrently
+        (formatted_results, search_timings), trials = await asyncio.gather(
+            search_papers(search_terms, question),
+            search_trials(question)
+        )
+        timer.timings.update(search_timings)
+
+        if not formatted_results:
+            return jsonify({
+                'status': "success",
+                'response': f"No papers found matching the terms: {', '.join(search_terms)}"
+            })
+
+        # Generate explanation of results
+        with timer.stage('explanation'):
+            explanation = await generate_result_explanation(question, formatted_results)
+
+        response = {
+            'explanation': explanation,
+            'papers': formatted_results,
+            'timings': timer.timings
+        }
+        if trials:
+            response['trials'] = trials
+
+        return jsonify({
+            'status': "success",
+            'response': response
+        })
+
+    except Exception as e:
+        metrics.REQUEST_ERRORS.inc(endpoint=request_endpoint(), error=type(e).__name__)
+        return jsonify({
+            'status': "error",
+            'response': f"An error occurred: {str(e)}"
+        }), 500
+
+
+@app.route('/check-database/stream', methods=['POST'])
+async def handle_database_stream_request():
+    """Streaming variant of /check-database, with the same events as server.py's."""
+    params = await request.get_json(silent=True)
+    if not params or not params.get("messages"):
+        return Response(sse_event('error', {'response': "Must include messages in request"}), status=400,
+                        mimetype='text/event-stream')
+
+    question = params["messages"][-1]['content']
+    endpoint = request_endpoint()
+    start = g.start
+    g.streamed = True
+
+    async def generate():
+        timer = retrieval.StageTimer()
+        try:
+            with timer.stage('terms'):
+                search_terms = extract_search_terms(question)
+            if not search_terms:
+                yield sse_event('error', {'response': "Could not extract meaningful search terms from the question"})
+                return
+
+            formatted_results, search_timings = await search_papers(search_terms, question)
+            timer.timings.update(search_timings)
+            yield sse_event('papers', {'papers': formatted_results, 'timings': timer.timings})
+
+            if not formatted_results:
+                yield sse_event('token', {'content': f"No papers found matching the terms: {', '.join(search_terms)}"})
+            else:
+                with timer.stage('explanation'):
+                    async for token in stream_result_explanation(question, formatted_results):
+                        yield sse_event('token', {'content': token})
+
+            yield sse_event('done', {})
+        except Exception as e:
+            metrics.REQUEST_ERRORS.inc(endpoint=endpoint, error=type(e).__name__)
+            yield sse_event('error', {'response': f"An error occurred: {str(e)}"})
+        finally:
+            metrics.record_timings(timer.timings)
+            metrics.REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint=endpoint)
+
+    response = Response(generate(), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    # A long explanation can take longer than Quart's default response timeout to stream
+    response.timeout = None
+    return response
+
+
+@app.route('/related/<pmid>', methods=['GET'])
+async def handle_related_request(pmid):
+    # Sub-millisecond in-process lookup, no need to leave the event loop
+    body, status = find_related_papers(pmid, request.args.get('k', default=10, type=int))
+    return jsonify(body), status
+
+
+@app.route('/metrics', methods=['GET'])
+async def handle_metrics_request():
+    return Response(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
+
+
+@app.route('/health', methods=['GET'])
+async def health():
+    report = await clients.health()
+    if server.explanation_cache is not None:
+        report['explanation_cache'] = server.explanation_cache.stats()
+    return jsonify(report)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the async PubMed search server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--workers', type=int, default=4, help='Number of worker processes')
+    args = parser.parse_args()
+
+    uvicorn.run('async_server:app', host=args.host, port=args.port, workers=args.workers)
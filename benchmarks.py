@@ -0,0 +1,269 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+import stand_ins
+
+
+DEFAULT_SIZES = [1000, 10000, 100000]
+DEFAULT_REPEAT = 3
+DEFAULT_TOLERANCE = 0.2
+DEFAULT_WORK_DIR = '.benchmarks'
+# Articles in the fake graph behind /check-database, kept fixed so the size only scales the request count
+CHECK_DATABASE_ARTICLES = 2000
+# Files the ingest benchmark splits its articles over, parsed in parallel
+INGEST_FILES = 4
+
+
+class Workload:
+    """
+    One benchmark at one size. Either `step` is timed once per item of `inputs`
+    (latency per item), or `run` is timed as a whole over `items` items (latency per run).
+    """
+
+    def __init__(self, items, run=None, step=None, inputs=None):
+        self.items = items
+        self.run = run
+        self.step = step
+        self.inputs = inputs
+
+    def execute(self):
+        """Do the work once, returning the per-item or per-run latencies in seconds."""
+        if self.step is None:
+            start = time.perf_counter()
+            self.run()
+            return [time.perf_counter() - start]
+        latencies = []
+        for item in self.inputs:
+            start = time.perf_counter()
+            self.step(item)
+            latencies.append(time.perf_counter() - start)
+        return latencies
+
+
+@contextlib.contextmanager
+def bench_extract_search_terms(size, work_dir):
+    import server
+    yield Workload(size, step=server.extract_search_terms, inputs=stand_ins.synthetic_questions(size))
+
+
+@contextlib.contextmanager
+def bench_generate_search_query(size, work_dir):
+    import server
+    terms = [server.extract_search_terms(question) for question in stand_ins.synthetic_questions(size)]
+    yield Workload(size, step=server.generate_search_query, inputs=terms)
+
+
+@contextlib.contextmanager
+def bench_filter_by_age(size, work_dir):
+    from ClinicalTrialsTool import ClinicalTrialsFilterV2
+    trials = ClinicalTrialsFilterV2(session=object())
+    df = trials.normalize_trials(trials._studies_to_frame([stand_ins.synthetic_study(i) for i in range(size)]))
+    yield Workload(size, run=lambda: trials._filter_by_age(df, 30, 60))
+
+
+@contextlib.contextmanager
+def bench_ingest_citations(size, work_dir):
+    """The citations stage of one file on one parse worker, into a graph already holding its articles."""
+    from create_neo4j import ingest
+    path = Path(work_dir) / f"pubmed_{size}.xml"
+    if not path.exists():
+        stand_ins.write_pubmed_xml(path, size)
+    driver = stand_ins.FakeGraphDriver(stand_ins.synthetic_articles(size))
+
+    def run():
+        driver.citations.clear()
+        with contextlib.redirect_stdout(io.StringIO()):
+            ingest([str(path)], driver, stages=('citations',), manifest_path=None, workers=1)
+
+    yield Workload(size, run=run)
+
+
+@contextlib.contextmanager
+def bench_ingest(size, work_dir):
+    from create_neo4j import ingest
+    files = []
+    for i in range(INGEST_FILES):
+        path = Path(work_dir) / f"pubmed_{size}_{i + 1}of{INGEST_FILES}.xml"
+        per_file = size // INGEST_FILES
+        if not path.exists():
+            stand_ins.write_pubmed_xml(path, per_file, first_pmid=i * per_file + 1, seed=i)
+        files.append(str(path))
+
+    def run():
+        with contextlib.redirect_stdout(io.StringIO()):
+            ingest(files, stand_ins.FakeGraphDriver(), manifest_path=None)
+
+    yield Workload(size, run=run)
+
+
+@contextlib.contextmanager
+def bench_search_trials(size, work_dir):
+    from ClinicalTrialsTool import ClinicalTrialsFilterV2
+    server = stand_ins.ClinicalTrialsStandIn(studies=size)
+    server.start()
+    try:
+        trials = ClinicalTrialsFilterV2(base_url=server.studies_url)
+        yield Workload(size, run=lambda: trials.search_trials(page_size=1000, max_results=size, min_age=30))
+    finally:
+        server.stop()
+
+
+@contextlib.contextmanager
+def bench_check_database(size, work_dir):
+    import server
+    clients = server.clients
+    # Read the config first, a config load drops any clients already set
+    clients.config
+    clients._driver = stand_ins.FakeGraphDriver(stand_ins.synthetic_articles(CHECK_DATABASE_ARTICLES))
+    clients._llm = stand_ins.CannedLLM()
+    clients._embeddings = stand_ins.FakeEmbeddings()
+    app = server.app.test_client()
+
+    def step(question):
+        response = app.post('/check-database', json={'messages': [{'role': 'user', 'content': question}]})
+        if response.json['status'] != 'success':
+            raise RuntimeError(response.json['response'])
+
+    try:
+        yield Workload(size, step=step, inputs=stand_ins.synthetic_questions(size))
+    finally:
+        clients._driver = clients._llm = clients._embeddings = None
+
+
+# name -> (workload factory, largest size worth running)
+BENCHMARKS = {
+    'extract_search_terms': (bench_extract_search_terms, None),
+    'generate_search_query': (bench_generate_search_query, None),
+    'filter_by_age': (bench_filter_by_age, None),
+    'ingest_citations': (bench_ingest_citations, None),
+    'ingest': (bench_ingest, None),
+    'search_trials': (bench_search_trials, None),
+    'check_database': (bench_check_database, 10000),
+}
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))]
+
+
+def measure(workload, repeat=DEFAULT_REPEAT):
+    """Warm up, time `repeat` executions, then one more under tracemalloc for the peak memory."""
+    workload.execute()
+    latencies, totals = [], []
+    for _ in range(repeat):
+        run_latencies = workload.execute()
+        latencies.extend(run_latencies)
+        totals.append(sum(run_latencies))
+
+    tracemalloc.start()
+    try:
+        workload.execute()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    seconds = statistics.median(totals)
+    return {
+        'items': workload.items,
+        'repeat': repeat,
+        'seconds': seconds,
+        'throughput': workload.items / seconds if seconds else None,
+        'latency_of': 'run' if workload.step is None else 'item',
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'peak_memory_mb': peak / 2 ** 20,
+    }
+
+
+def run_benchmarks(names, sizes, repeat=DEFAULT_REPEAT, work_dir=DEFAULT_WORK_DIR):
+    os.makedirs(work_dir, exist_ok=True)
+    results = []
+    for name in names:
+        factory, max_size = BENCHMARKS[name]
+        for size in sizes:
+            if max_size is not None and size > max_size:
+                print(f"{name:<28} {size:>9}  skipped (capped at {max_size})", file=sys.stderr)
+                continue
+            with factory(size, work_dir) as workload:
+                result = {'benchmark': name, 'size': size, **measure(workload, repeat)}
+            results.append(result)
+            print(f"{name:<28} {size:>9}  {result['throughput']:>12.0f}/s  p50 {result['p50_ms']:9.3f}ms  "
+                  f"p99 {result['p99_ms']:9.3f}ms  peak {result['peak_memory_mb']:8.1f}MB", file=sys.stderr)
+    return results
+
+
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """
+    Regressions against a baseline run: throughput down or p99 latency up by more than
+    `tolerance` (a fraction) for the same benchmark and size.
+    """
+    previous = {(r['benchmark'], r['size']): r for r in baseline['results']}
+    regressions = []
+    for result in results:
+        before = previous.get((result['benchmark'], result['size']))
+        if before is None:
+            continue
+        if result['throughput'] < before['throughput'] * (1 - tolerance):
+            regressions.append({'benchmark': result['benchmark'], 'size': result['size'], 'metric': 'throughput',
+                                'baseline': before['throughput'], 'current': result['throughput']})
+        if result['p99_ms'] > before['p99_ms'] * (1 + tolerance):
+            regressions.append({'benchmark': result['benchmark'], 'size': result['size'], 'metric': 'p99_ms',
+                                'baseline': before['p99_ms'], 'current': result['p99_ms']})
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the hot paths against local stand-ins')
+    parser.add_argument('benchmarks', nargs='*', help=f"Benchmarks to run (default all: {', '.join(BENCHMARKS)})")
+    parser.add_argument('--sizes', default=','.join(map(str, DEFAULT_SIZES)),
+                        help='Comma separated record counts, e.g. 1000,10000,100000,1000000')
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT, help='Timed executions per size')
+    parser.add_argument('--output', help='Write the results as JSON to this file (stdout by default)')
+    parser.add_argument('--baseline', help='Results JSON from an earlier run to check for regressions')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help='Allowed fractional slowdown before a result counts as a regression')
+    parser.add_argument('--work-dir', default=DEFAULT_WORK_DIR, help='Where generated input files are kept')
+    args = parser.parse_args()
+
+    unknown = set(args.benchmarks) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"Unknown benchmarks: {', '.join(sorted(unknown))}")
+    sizes = [int(size) for size in args.sizes.split(',')]
+
+    results = run_benchmarks(args.benchmarks or list(BENCHMARKS), sizes, args.repeat, args.work_dir)
+    report = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'results': results,
+    }
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            report['regressions'] = compare(results, json.load(f), args.tolerance)
+        for regression in report['regressions']:
+            print(f"REGRESSION {regression['benchmark']} {regression['size']} {regression['metric']}: "
+                  f"{regression['baseline']:.3f} -> {regression['current']:.3f}", file=sys.stderr)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+    if report.get('regressions'):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+import argparse
+import json
+import time
+from pathlib import Path
+from typing import Iterable, Tuple
+
+import numpy as np
+from neo4j import GraphDatabase
+from scipy import sparse
+from scipy.stats import rankdata
+
+import pubmed_diabetes
+
+
+DEFAULT_DAMPING = 0.85
+DEFAULT_TOLERANCE = 1e-10
+DEFAULT_MAX_ITER = 100
+DEFAULT_WRITE_BATCH = 10000
+
+
+def build_adjacency(edges: Iterable[Tuple[str, str]]) -> Tuple[np.ndarray, sparse.csr_matrix]:
+    """
+    Turn (citing, cited) pairs into (pmids, adjacency), where adjacency[i, j] is 1 when
+    pmids[i] cites pmids[j]. Repeated edges and self-citations are dropped.
+    """
+    edges = np.array(list(edges), dtype=object).reshape(-1, 2)
+    pmids, positions = np.unique(edges, return_inverse=True)
+    positions = positions.reshape(-1, 2)
+    positions = positions[positions[:, 0] != positions[:, 1]]
+    adjacency = sparse.csr_matrix((np.ones(len(positions), dtype=np.float64),
+                                   (positions[:, 0], positions[:, 1])), shape=(len(pmids), len(pmids)))
+    adjacency.data[:] = 1
+    return pmids.astype(str), adjacency
+
+
+def in_degree(adjacency: sparse.csr_matrix) -> np.ndarray:
+    return np.asarray(adjacency.sum(axis=0)).ravel().astype(np.int64)
+
+
+def pagerank(adjacency: sparse.csr_matrix,
+             damping: float = DEFAULT_DAMPING,
+             tol: float = DEFAULT_TOLERANCE,
+             max_iter: int = DEFAULT_MAX_ITER) -> np.ndarray:
+    """
+    PageRank by power iteration over a row-normalized sparse adjacency matrix.
+
+    Papers that cite nothing in the graph (dangling nodes) spread their rank evenly
+    over all papers each step, so the scores keep summing to 1. Iteration stops once
+    the L1 change drops below `tol`.
+    """
+    n = adjacency.shape[0]
+    if n == 0:
+        return np.empty(0)
+    out_degree = np.asarray(adjacency.sum(axis=1)).ravel()
+    dangling = out_degree == 0
+    inverse = np.divide(1, out_degree, out=np.zeros(n), where=~dangling)
+    # transition.T @ rank moves every paper's rank along its outgoing citations
+    transition_t = (sparse.diags(inverse) @ adjacency).T.tocsr()
+
+    rank = np.full(n, 1 / n)
+    for _ in range(max_iter):
+        updated = damping * (transition_t @ rank + rank[dangling].sum() / n) + (1 - damping) / n
+        change = np.abs(updated - rank).sum()
+        rank = updated
+        if change < tol:
+            break
+    return rank
+
+
+def percentile(values: np.ndarray) -> np.ndarray:
+    """Rank-normalize to [0, 1] (ties share their average rank) so the prior doesn't depend on the graph size."""
+    if len(values) < 2:
+        return np.zeros(len(values))
+    return (rankdata(values) - 1) / (len(values) - 1)
+
+
+def neo4j_citations(driver) -> Iterable[Tuple[str, str]]:
+    """Stream every CITES edge out of Neo4j as (citing_pmid, cited_pmid)."""
+    with driver.session() as session:
+        result = session.run("""
+        MATCH (citing:Article)-[:CITES]->(cited:Article)
+        RETURN citing.pmid AS citing, cited.pmid AS cited
+        """)
+        for record in result:
+            yield record['citing'], record['cited']
+
+
+def write_scores(tx, rows):
+    tx.run("""
+    UNWIND $rows AS row
+    MATCH (a:Article {pmid: row.pmid})
+    SET a.pagerank = row.pagerank, a.in_degree = row.in_degree, a.centrality = row.centrality
+    """, rows=rows)
+
+
+def write_to_neo4j(driver, scores, batch_size=DEFAULT_WRITE_BATCH):
+    """Store the scores as Article properties, one UNWIND transaction per batch."""
+    with driver.session() as session:
+        for start in range(0, len(scores), batch_size):
+            session.execute_write(write_scores, scores[start:start + batch_size])
+
+
+def score_rows(pmids, adjacency, damping=DEFAULT_DAMPING):
+    ranks = pagerank(adjacency, damping=damping)
+    degrees = in_degree(adjacency)
+    centrality = percentile(ranks)
+    return [{'pmid': pmid, 'pagerank': float(rank), 'in_degree': int(degree), 'centrality': float(c)}
+            for pmid, rank, degree, c in zip(pmids.tolist(), ranks, degrees, centrality)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compute citation PageRank and in-degree for articles')
+    parser.add_argument('--source', choices=['neo4j', 'pubmed-diabetes'], default='neo4j',
+                        help='Read citations from the Neo4j CITES edges or the Pubmed-Diabetes cites file')
+    parser.add_argument('--cites-file', default=str(Path(pubmed_diabetes.DEFAULT_DATA_DIR) / pubmed_diabetes.CITES_FILE))
+    parser.add_argument('--damping', type=float, default=DEFAULT_DAMPING)
+    parser.add_argument('--output', help='Also write the scores to this JSON file')
+    parser.add_argument('--no-write', action='store_true', help="Don't write the scores back to Neo4j")
+    parser.add_argument('--config', default='config.json', help='Path to config file')
+    args = parser.parse_args()
+
+    with open(args.config) as f:
+        config = json.load(f)
+    driver = GraphDatabase.driver(config['neo4j_uri'], auth=(config['neo4j_username'], config['neo4j_password']))
+
+    try:
+        start = time.perf_counter()
+        if args.source == 'neo4j':
+            edges = neo4j_citations(driver)
+        else:
+            edges = pubmed_diabetes.iter_citations(args.cites_file)
+        pmids, adjacency = build_adjacency(edges)
+        print(f"Built {len(pmids)} x {len(pmids)} adjacency with {adjacency.nnz} citations "
+              f"in {time.perf_counter() - start:.2f}s")
+
+        start = time.perf_counter()
+        scores = score_rows(pmids, adjacency, args.damping)
+        print(f"Scored {len(scores)} articles in {time.perf_counter() - start:.2f}s")
+
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(scores, f)
+        if not args.no_write:
+            write_to_neo4j(driver, scores)
+            print("Wrote pagerank, in_degree and centrality to Article nodes")
+    finally:
+        driver.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,376 @@
+import asyncio
+import contextlib
+import json
+import os
+import threading
+import time
+
+import httpx
+from neo4j import AsyncGraphDatabase, GraphDatabase, READ_ACCESS
+
+
+DEFAULT_POOL_SIZE = 50
+DEFAULT_ACQUISITION_TIMEOUT = 60
+DEFAULT_LLM_KEEPALIVE = 20
+DEFAULT_LLM_CONCURRENCY = 8
+
+
+def get_llm(config, http_client=None, http_async_client=None):
+    """Initialize the LLM with configuration."""
+    # langchain takes over a second to import, so only pay for it once a client is needed
+    from langchain_openai import ChatOpenAI
+
+    return ChatOpenAI(
+        model_name='',
+        openai_api_key=config['llm_api_key'],
+        openai_api_base=config.get('llm_api_base'),
+        temperature=0.2,
+        http_client=http_client,
+        http_async_client=http_async_client
+    )
+
+
+def get_embeddings(config):
+    """Initialize the embedding client with configuration."""
+    from langchain_caai.caai_emb_client import caai_emb_client
+
+    return caai_emb_client(
+        model="",
+        api_key=config['llm_api_key'],
+        api_url=config.get('llm_api_base'),
+        max_batch_size=100,
+        num_workers=10
+    )
+
+
+def get_openai_embeddings(config, api_base=None):
+    """Embedding client for any OpenAI-compatible endpoint, `api_base` overriding the configured one."""
+    from langchain_openai import OpenAIEmbeddings
+
+    return OpenAIEmbeddings(
+        openai_api_key=config['llm_api_key'],
+        openai_api_base=api_base or config.get('llm_api_base'),
+        # Send raw strings rather than tiktoken ids, which non-OpenAI servers may not accept
+        check_embedding_ctx_length=False
+    )
+
+
+def get_driver(config, graph_database=GraphDatabase):
+    """Create a pooled Neo4j driver using config parameters."""
+    return graph_database.driver(
+        config['neo4j_uri'],
+        auth=(config['neo4j_username'], config['neo4j_password']),
+        max_connection_pool_size=config.get('neo4j_max_connection_pool_size', DEFAULT_POOL_SIZE),
+        connection_acquisition_timeout=config.get('neo4j_connection_acquisition_timeout',
+                                                  DEFAULT_ACQUISITION_TIMEOUT)
+    )
+
+
+def http_limits(config):
+    """Keep-alive limits for the HTTP client underneath the LLM."""
+    return httpx.Limits(max_keepalive_connections=config.get('llm_max_keepalive_connections',
+                                                             DEFAULT_LLM_KEEPALIVE))
+
+
+class ClientRegistry:
+    """
+    Process-wide holder for the config, the Neo4j driver and the LLM client.
+
+    Clients are created on first use and shared by every request. The config file
+    is only re-read when its modification time changes, at which point new clients
+    are built against the new settings and swapped in. The replaced clients are
+    closed once the last request leasing them (see `lease`) has finished.
+    """
+
+    def __init__(self, config_path='config.json'):
+        self.config_path = config_path
+        self._lock = threading.Lock()
+        self._config = None
+        self._config_mtime = None
+        self._loaded_at = None
+        self._driver = None
+        self._llm = None
+        self._embeddings = None
+        self._http_client = None
+        self._in_use = 0
+        self._queries = 0
+        # Clients are versioned by config load: generation -> requests using it,
+        # and generation -> clients replaced by a reload but still in use
+        self._generation = 0
+        self._users = {}
+        self._retired = {}
+
+    @property
+    def config(self):
+        """Return the current config, reloading it if the file changed on disk."""
+        mtime = os.stat(self.config_path).st_mtime
+        if mtime != self._config_mtime:
+            with self._lock:
+                if mtime != self._config_mtime:
+                    with open(self.config_path) as config_file:
+                        config = json.load(config_file)
+                    self._swap_clients(config)
+                    self._config = config
+                    self._config_mtime = mtime
+                    self._loaded_at = time.time()
+        return self._config
+
+    def _swap_clients(self, config):
+        """Replace the clients in use with ones built from `config`, retiring the old ones."""
+        old = self._clients()
+        if self._config is not None:
+            # Only rebuild what was in use, the rest stays lazy
+            self._driver = self._create_driver(config) if self._driver is not None else None
+            self._llm, self._http_client = \
+                self._create_llm(config) if self._llm is not None else (None, None)
+            self._embeddings = get_embeddings(config) if self._embeddings is not None else None
+        retired, self._generation = self._generation, self._generation + 1
+        if not self._users.get(retired):
+            self._close(old)
+        else:
+            self._retired[retired] = old
+
+    def acquire(self):
+        """
+        Mark the current clients as in use, so a config reload doesn't close them under
+        the caller. Returns the generation to hand back to `release`.
+        """
+        self.config
+        with self._lock:
+            generation = self._generation
+            self._users[generation] = self._users.get(generation, 0) + 1
+        return generation
+
+    def release(self, generation):
+        """Release a lease taken with `acquire`, closing its clients if a reload replaced them."""
+        with self._lock:
+            self._users[generation] -= 1
+            if self._users[generation]:
+                return
+            del self._users[generation]
+            retired = self._retired.pop(generation, None)
+        if retired is not None:
+            self._close(retired)
+
+    @contextlib.contextmanager
+    def lease(self):
+        """Keep the current clients open for the duration of the block."""
+        generation = self.acquire()
+        try:
+            yield
+        finally:
+            self.release(generation)
+
+    @property
+    def driver(self):
+        config = self.config
+        if self._driver is None:
+            with self._lock:
+                if self._driver is None:
+                    self._driver = self._create_driver(config)
+        return self._driver
+
+    @property
+    def llm(self):
+        config = self.config
+        if self._llm is None:
+            with self._lock:
+                if self._llm is None:
+                    self._llm, self._http_client = self._create_llm(config)
+        return self._llm
+
+    @property
+    def embeddings(self):
+        config = self.config
+        if self._embeddings is None:
+            with self._lock:
+                if self._embeddings is None:
+                    self._embeddings = get_embeddings(config)
+        return self._embeddings
+
+    def _create_driver(self, config):
+        return get_driver(config)
+
+    def _create_llm(self, config):
+        """Returns the LLM and the HTTP client underneath it."""
+        http_client = httpx.Client(limits=http_limits(config), timeout=config.get('llm_timeout', 120))
+        return get_llm(config, http_client=http_client), http_client
+
+    def query(self, cypher, params=None):
+        """Run a read query on a pooled connection and return the records as dicts."""
+        with self.lease():
+            driver = self.driver
+            self._track(1)
+            try:
+                records, _, _ = driver.execute_query(cypher, params or {}, routing_=READ_ACCESS)
+                return [record.data() for record in records]
+            finally:
+                self._track(-1)
+
+    def _track(self, delta):
+        with self._lock:
+            self._in_use += delta
+            if delta > 0:
+                self._queries += 1
+
+    def pool_status(self):
+        """
+        The pool settings and the queries this registry has in flight. That count is kept
+        here around `query`, not read from the driver, so it's an estimate of pool use.
+        """
+        config = self.config
+        pool_size = config.get('neo4j_max_connection_pool_size', DEFAULT_POOL_SIZE)
+        return {
+            'pool_size': pool_size,
+            'queries_in_flight': self._in_use,
+            'queries_in_flight_per_connection': self._in_use / pool_size if pool_size else 0,
+            'acquisition_timeout': config.get('neo4j_connection_acquisition_timeout',
+                                              DEFAULT_ACQUISITION_TIMEOUT),
+            'queries': self._queries
+        }
+
+    def health(self):
+        """Report connectivity and queries in flight for the health endpoint."""
+        neo4j_status = self.pool_status()
+        try:
+            self.driver.verify_connectivity()
+            neo4j_status['status'] = 'ok'
+        except Exception as e:
+            neo4j_status['status'] = f"error: {e}"
+        return self._health_report(neo4j_status)
+
+    def _health_report(self, neo4j_status):
+        return {
+            'status': 'ok' if neo4j_status['status'] == 'ok' else 'degraded',
+            'config_loaded_at': self._loaded_at,
+            'neo4j': neo4j_status,
+            'llm': {'initialized': self._llm is not None}
+        }
+
+    def close(self):
+        with self._lock:
+            clients = [self._clients(), *self._retired.values()]
+            self._retired.clear()
+            self._driver = None
+            self._llm = None
+            self._embeddings = None
+            self._http_client = None
+        for old in clients:
+            self._close(old)
+
+    def _clients(self):
+        """The clients that hold connections and need closing: (driver, http client)."""
+        return self._driver, self._http_client
+
+    def _close(self, clients):
+        driver, http_client = clients
+        if driver is not None:
+            driver.close()
+        if http_client is not None:
+            http_client.close()
+
+
+class AsyncClientRegistry(ClientRegistry):
+    """
+    Async counterpart of ClientRegistry for the ASGI server.
+
+    Holds an async Neo4j driver and an LLM backed by an async HTTP client, and caps
+    the number of in-flight LLM calls in this process with a semaphore.
+    """
+
+    def __init__(self, config_path='config.json'):
+        super().__init__(config_path)
+        self._llm_semaphore = None
+        self._llm_in_flight = 0
+
+    def _create_driver(self, config):
+        return get_driver(config, graph_database=AsyncGraphDatabase)
+
+    def _create_llm(self, config):
+        http_client = httpx.AsyncClient(limits=http_limits(config), timeout=config.get('llm_timeout', 120))
+        return get_llm(config, http_async_client=http_client), http_client
+
+    def _swap_clients(self, config):
+        super()._swap_clients(config)
+        # Sized from the new config on next use; calls already holding the old one finish on it
+        self._llm_semaphore = None
+
+    @property
+    def llm_semaphore(self):
+        if self._llm_semaphore is None:
+            self._llm_semaphore = asyncio.Semaphore(self.config.get('llm_max_concurrency',
+                                                                    DEFAULT_LLM_CONCURRENCY))
+        return self._llm_semaphore
+
+    async def query(self, cypher, params=None):
+        """Run a read query on a pooled connection and return the records as dicts."""
+        with self.lease():
+            driver = self.driver
+            self._track(1)
+            try:
+                records, _, _ = await driver.execute_query(cypher, params or {}, routing_=READ_ACCESS)
+                return [record.data() for record in records]
+            finally:
+                self._track(-1)
+
+    async def invoke_llm(self, prompt):
+        """Invoke the LLM, waiting for a free slot if the concurrency cap is reached."""
+        with self.lease():
+            async with self.llm_semaphore:
+                self._llm_in_flight += 1
+                try:
+                    return await self.llm.ainvoke(prompt)
+                finally:
+                    self._llm_in_flight -= 1
+
+    async def stream_llm(self, prompt):
+        """Stream the LLM's response chunks, holding a concurrency slot until the last one."""
+        with self.lease():
+            async with self.llm_semaphore:
+                self._llm_in_flight += 1
+                try:
+                    async for chunk in self.llm.astream(prompt):
+                        yield chunk
+                finally:
+                    self._llm_in_flight -= 1
+
+    async def health(self):
+        neo4j_status = self.pool_status()
+        try:
+            await self.driver.verify_connectivity()
+            neo4j_status['status'] = 'ok'
+        except Exception as e:
+            neo4j_status['status'] = f"error: {e}"
+
+        report = self._health_report(neo4j_status)
+        report['llm'].update({
+            'in_flight': self._llm_in_flight,
+            'max_concurrency': self.config.get('llm_max_concurrency', DEFAULT_LLM_CONCURRENCY)
+        })
+        return report
+
+    async def aclose(self):
+        with self._lock:
+            clients = [self._clients(), *self._retired.values()]
+            self._retired.clear()
+            self._driver = None
+            self._llm = None
+            self._embeddings = None
+            self._http_client = None
+        for driver, http_client in clients:
+            if driver is not None:
+                await driver.close()
+            if http_client is not None:
+                await http_client.aclose()
+
+    def _close(self, clients):
+        # Called from sync code (a config reload or the end of a lease), so hand the async close off to the loop
+        driver, http_client = clients
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        if driver is not None:
+            loop.create_task(driver.close())
+        if http_client is not None:
+            loop.create_task(http_client.aclose())
@@ -0,0 +1,215 @@
+import argparse
+import re
+import time
+from typing import Dict, Optional
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from ClinicalTrialsTool import SEX_DTYPE, ClinicalTrialsFilterV2
+
+
+TOKEN_PATTERN = r'[a-z0-9]+'
+DEFAULT_BLOCK_SIZE = 4_000_000  # patient x candidate cells evaluated per vectorized step
+ALL_SEX = SEX_DTYPE.categories.get_loc('ALL')
+# Columns the index reads, given to an empty search result that has none
+INDEX_COLUMNS = {
+    'nct_id': object, 'conditions': object, 'min_age_years': float, 'max_age_years': float, 'sex': SEX_DTYPE,
+    'city': object, 'state': object, 'country': object,
+}
+
+
+def tokenize(text: Optional[str]) -> frozenset:
+    """Lowercased alphanumeric tokens of a condition or location string."""
+    if not isinstance(text, str):
+        return frozenset()
+    return frozenset(re.findall(TOKEN_PATTERN, text.lower()))
+
+
+def _postings(labels: pd.Series) -> Dict[str, np.ndarray]:
+    """Map each token in `labels` (row position -> text) to the sorted positions containing it."""
+    tokens = labels.str.lower().str.findall(TOKEN_PATTERN).explode().dropna()
+    if tokens.empty:
+        return {}
+    pairs = pd.DataFrame({'token': tokens.to_numpy(dtype=object), 'pos': tokens.index.to_numpy()})
+    pairs = pairs.drop_duplicates().sort_values(['token', 'pos'])
+    keys, starts = np.unique(pairs['token'].to_numpy(dtype=object), return_index=True)
+    return dict(zip(keys, np.split(pairs['pos'].to_numpy(dtype=np.int64), starts[1:])))
+
+
+def _sex_codes(sex: pd.Series) -> np.ndarray:
+    """Category codes for sex, -1 where it is missing or unrecognised."""
+    return sex.astype(str).str.upper().astype(SEX_DTYPE).cat.codes.to_numpy()
+
+
+class TrialIndex:
+    """
+    In-memory index over a local snapshot of trials for matching whole cohorts at once.
+
+    Conditions and facility locations are indexed as token posting lists, and ages and
+    sex are held as flat arrays, so a cohort is matched with set intersections and
+    vectorized interval tests instead of one remote search per patient.
+    """
+
+    def __init__(self, trials: pd.DataFrame):
+        if trials.empty:
+            trials = pd.DataFrame({column: pd.Series(dtype=dtype) for column, dtype in INDEX_COLUMNS.items()})
+        elif "min_age_years" not in trials:
+            trials = ClinicalTrialsFilterV2.normalize_trials(trials)
+        self.trials = trials.reset_index(drop=True)
+        self.nct_ids = self.trials["nct_id"].to_numpy()
+        # Missing bounds are open-ended
+        self.min_age = self.trials["min_age_years"].fillna(-np.inf).to_numpy(dtype=float)
+        self.max_age = self.trials["max_age_years"].fillna(np.inf).to_numpy(dtype=float)
+        self.sex = self.trials["sex"].cat.codes.to_numpy()
+
+        self.condition_postings = _postings(ClinicalTrialsFilterV2.condition_lookup(self.trials))
+        location = self.trials[["city", "state", "country"]].fillna('').astype(str)
+        self.location_postings = _postings(location["city"] + ' ' + location["state"] + ' ' + location["country"])
+        self._sited = {}
+
+    @classmethod
+    def from_search(cls, ct_filter: ClinicalTrialsFilterV2, **search_kwargs) -> 'TrialIndex':
+        """Build the index from every page of a ClinicalTrialsFilterV2 search."""
+        pages = list(ct_filter.iter_trial_pages(**search_kwargs))
+        return cls(pd.concat(pages, ignore_index=True) if pages else pd.DataFrame())
+
+    def __len__(self):
+        return len(self.nct_ids)
+
+    def candidates(self, condition: Optional[str], location: Optional[str] = None) -> np.ndarray:
+        """
+        Positions of trials listing every token of `condition` among their conditions,
+        restricted to trials sited at any token of `location` when one is given.
+        A missing or empty condition doesn't filter, as with a search without one.
+        """
+        result = np.arange(len(self))
+        # With no condition tokens this applies no condition filter, every trial stays a candidate
+        for token in tokenize(condition):
+            result = np.intersect1d(result, self.condition_postings.get(token, result[:0]),
+                                    assume_unique=True)
+            if not len(result):
+                return result
+
+        if location:
+            result = np.intersect1d(result, self.sited_at(location), assume_unique=True)
+        return result
+
+    def sited_at(self, location: str) -> np.ndarray:
+        """Positions of trials with a facility matching any token of `location`, memoized per string."""
+        if location not in self._sited:
+            sited = [self.location_postings[token] for token in tokenize(location)
+                     if token in self.location_postings]
+            self._sited[location] = np.unique(np.concatenate(sited)) if sited else np.empty(0, dtype=np.int64)
+        return self._sited[location]
+
+    def match(self, cohort: pd.DataFrame,
+              match_location: bool = False,
+              block_size: int = DEFAULT_BLOCK_SIZE) -> sparse.csr_matrix:
+        """
+        Match a cohort of patients against every indexed trial.
+
+        `cohort` has condition, age and sex columns (and location when `match_location`
+        is set). Patients with no condition are matched on age and sex (and location) alone. Returns a boolean patients x trials CSR matrix in cohort row order;
+        column j is the trial at `nct_ids[j]`.
+        """
+        n_patients = len(cohort)
+        ages = pd.to_numeric(cohort["age"], errors='coerce').to_numpy(dtype=float)
+        sexes = _sex_codes(cohort["sex"])
+
+        # Patients sharing a condition (and location) share one candidate lookup
+        keys = pd.DataFrame({
+            'condition': cohort["condition"].fillna('').astype(str).str.strip().str.lower().to_numpy(),
+            'location': (cohort["location"].fillna('').astype(str).str.strip().str.lower().to_numpy()
+                         if match_location else ''),
+        })
+
+        rows, cols = [], []
+        for (condition, location), members in keys.groupby(['condition', 'location'], sort=False).indices.items():
+            candidates = self.candidates(condition, location or None)
+            if not len(candidates):
+                continue
+
+            cand_min, cand_max = self.min_age[candidates], self.max_age[candidates]
+            cand_sex = self.sex[candidates]
+            cand_any_sex = (cand_sex < 0) | (cand_sex == ALL_SEX)
+            step = max(1, block_size // len(candidates))
+
+            for start in range(0, len(members), step):
+                patients = members[start:start + step]
+                age = ages[patients][:, None]
+                sex = sexes[patients][:, None]
+                eligible = (np.isnan(age) | ((cand_min <= age) & (age <= cand_max)))
+                eligible &= (sex < 0) | (sex == ALL_SEX) | cand_any_sex | (cand_sex == sex)
+                patient_pos, candidate_pos = np.nonzero(eligible)
+                rows.append(patients[patient_pos])
+                cols.append(candidates[candidate_pos])
+
+        rows = np.concatenate(rows) if rows else np.empty(0, dtype=np.int64)
+        cols = np.concatenate(cols) if cols else np.empty(0, dtype=np.int64)
+        return sparse.csr_matrix((np.ones(len(rows), dtype=bool), (rows, cols)),
+                                 shape=(n_patients, len(self)))
+
+    def match_pairs(self, cohort: pd.DataFrame, match_location: bool = False) -> pd.DataFrame:
+        """Long-form (patient, nct_id) table of the matches, patient being the cohort's index label."""
+        matrix = self.match(cohort, match_location=match_location).tocoo()
+        return pd.DataFrame({
+            'patient': cohort.index.to_numpy()[matrix.row],
+            'nct_id': self.nct_ids[matrix.col]
+        })
+
+
+def synthetic_snapshot(n_trials: int, n_conditions: int = 500, seed: int = 0) -> pd.DataFrame:
+    """Random but realistically shaped normalized trials for benchmarking."""
+    rng = np.random.default_rng(seed)
+    conditions = np.array([f"condition{i} disease{i % 37}" for i in range(n_conditions)], dtype=object)
+    per_trial = rng.integers(1, 4, n_trials)
+    picks = np.split(rng.integers(0, n_conditions, per_trial.sum()), np.cumsum(per_trial)[:-1])
+    min_age = rng.choice([np.nan, 0, 18, 40, 65], n_trials)
+    max_age = rng.choice([np.nan, 17, 50, 75, 99], n_trials)
+    return pd.DataFrame({
+        'nct_id': [f"NCT{i:08d}" for i in range(n_trials)],
+        'conditions': [list(conditions[p]) for p in picks],
+        'minimum_age': [None if np.isnan(a) else f"{int(a)} Years" for a in min_age],
+        'maximum_age': [None if np.isnan(a) else f"{int(a)} Years" for a in max_age],
+        'sex': rng.choice(['ALL', 'FEMALE', 'MALE'], n_trials, p=[0.8, 0.1, 0.1]),
+        'city': rng.choice(['Boston', 'Lexington', 'Chicago', 'Houston'], n_trials),
+        'state': rng.choice(['Massachusetts', 'Kentucky', 'Illinois', 'Texas'], n_trials),
+        'country': 'United States',
+    })
+
+
+def synthetic_cohort(n_patients: int, n_conditions: int = 500, seed: int = 1) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'condition': [f"condition{i} disease{i % 37}" for i in rng.integers(0, n_conditions, n_patients)],
+        'age': rng.integers(1, 95, n_patients),
+        'sex': rng.choice(['FEMALE', 'MALE'], n_patients),
+        'location': rng.choice(['Boston Massachusetts', 'Lexington Kentucky'], n_patients),
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark cohort-to-trial matching on synthetic data')
+    parser.add_argument('--patients', type=int, default=10000)
+    parser.add_argument('--trials', type=int, default=50000)
+    parser.add_argument('--match-location', action='store_true')
+    args = parser.parse_args()
+
+    trials = synthetic_snapshot(args.trials)
+    cohort = synthetic_cohort(args.patients)
+
+    start = time.perf_counter()
+    index = TrialIndex(trials)
+    built = time.perf_counter()
+    matrix = index.match(cohort, match_location=args.match_location)
+    matched = time.perf_counter()
+
+    print(f"Indexed {len(index)} trials in {built - start:.2f}s")
+    print(f"Matched {args.patients} patients in {matched - built:.2f}s: "
+          f"{matrix.nnz} matches, {matrix.getnnz(axis=1).astype(bool).sum()} patients with at least one")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,80 +1,547 @@
+import argparse
+import glob
+import gzip
+import json
+import multiprocessing
+import os
+import queue
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
 from neo4j import GraphDatabase
 from lxml import etree
 
 
-def create_citation(tx, citing_pmid, cited_pmid):
+DEFAULT_BATCH_SIZE = 10000
+# Rows a parse worker hands the writer at a time
+DEFAULT_CHUNK_SIZE = 1000
+DEFAULT_MANIFEST = 'ingest_manifest.json'
+# Every file's articles are loaded before any citations, so references across files find their target
+STAGES = ('articles', 'citations')
+PROGRESS_INTERVAL = 5.0
+ARTICLE_FULLTEXT_INDEX = 'article_text'
+# Vector index over Article.embedding, queried by the hybrid search
+ARTICLE_VECTOR_INDEX = 'article_embedding'
+
+
+def create_indexes(tx):
     """
-    Creates a CITES relationship between two articles and updates the citation count
+    Creates the pmid, author and keyword lookup indexes used by the ingest MATCHes and
+    MERGEs and the full-text index over article titles and abstracts used by the search endpoint
     """
     tx.run("""
-    MATCH (citing:Article {pmid: $citing_pmid})
-    MATCH (cited:Article {pmid: $cited_pmid})
-    MERGE (citing)-[:CITES]->(cited)
-    WITH cited
-    SET cited.citation_count = COALESCE(cited.citation_count, 0) + 1
-    """, citing_pmid=citing_pmid, cited_pmid=cited_pmid)
+    CREATE INDEX article_pmid IF NOT EXISTS
+    FOR (a:Article) ON (a.pmid)
+    """)
+    tx.run("""
+    CREATE INDEX author_name IF NOT EXISTS
+    FOR (a:Author) ON (a.last_name, a.first_name)
+    """)
+    tx.run("""
+    CREATE INDEX keyword_name IF NOT EXISTS
+    FOR (k:Keyword) ON (k.name)
+    """)
+    tx.run(f"""
+    CREATE FULLTEXT INDEX {ARTICLE_FULLTEXT_INDEX} IF NOT EXISTS
+    FOR (a:Article) ON EACH [a.title, a.abstract]
+    """)
 
 
-def update_citation_counts(tx):
+def create_vector_index(tx, dimensions):
     """
-    Updates the citation_count property for all articles based on incoming CITES relationships
+    Creates the cosine vector index over Article embeddings used by the hybrid search.
+    Its size depends on the embedding model, so embed_articles.py creates it once the
+    first vector is known
     """
-    tx.run("""
+    tx.run(f"""
+    CREATE VECTOR INDEX {ARTICLE_VECTOR_INDEX} IF NOT EXISTS
+    FOR (a:Article) ON (a.embedding)
+    OPTIONS {{indexConfig: {{
+        `vector.dimensions`: $dimensions,
+        `vector.similarity_function`: 'cosine'
+    }}}}
+    """, dimensions=dimensions)
+
+
+def create_articles(tx, rows):
+    """
+    Creates or updates the Article nodes for a batch of extract_article rows, merging in
+    their Authors and Keywords. Returns the number of rows written.
+
+    Each row carries the name of its `source_file`, and PubMed file names sort in release order.
+    A row from a file older than the one an article was last written from is skipped, so a revised
+    citation isn't overwritten by its earlier version whatever order the files finish in. When a
+    newer file replaces an article, the AUTHORED, HAS_KEYWORD and CITES edges of the older version
+    are removed first; its citations stage adds the new CITES edges back.
+    """
+    result = tx.run("""
+    UNWIND $rows AS row
+    MERGE (a:Article {pmid: row.pmid})
+    WITH a, row, a.source_file < row.source_file AS replaced
+    WHERE a.source_file IS NULL OR a.source_file <= row.source_file
+    SET a.title = row.title, a.abstract = row.abstract, a.source_file = row.source_file
+    WITH a, row, replaced
+    CALL {
+        WITH a, replaced
+        WITH a WHERE replaced
+        MATCH (a)<-[old:AUTHORED]-(:Author)
+        DELETE old
+        RETURN count(*) AS unauthored
+    }
+    CALL {
+        WITH a, replaced
+        WITH a WHERE replaced
+        MATCH (a)-[old:HAS_KEYWORD]->(:Keyword)
+        DELETE old
+        RETURN count(*) AS untagged
+    }
+    CALL {
+        WITH a, replaced
+        WITH a WHERE replaced
+        MATCH (a)-[old:CITES]->(cited:Article)
+        DELETE old
+        WITH cited, count(*) AS removed
+        SET cited.citation_count = cited.citation_count - removed
+        RETURN count(*) AS uncited
+    }
+    CALL {
+        WITH a, row
+        UNWIND row.authors AS author
+        MERGE (auth:Author {first_name: author.first_name, last_name: author.last_name})
+        MERGE (auth)-[:AUTHORED]->(a)
+        RETURN count(*) AS authored
+    }
+    CALL {
+        WITH a, row
+        UNWIND row.keywords AS keyword
+        MERGE (k:Keyword {name: keyword})
+        MERGE (a)-[:HAS_KEYWORD]->(k)
+        RETURN count(*) AS tagged
+    }
+    RETURN count(a) AS written
+    """, rows=rows)
+    record = result.single()
+    return record['written'] if record and record['written'] else 0
+
+
+def create_citations(tx, rows):
+    """
+    Creates the CITES relationships that don't exist yet for a batch of unique {citing, cited}
+    rows, and raises each cited article's citation_count by the number of edges created for it.
+    Rows whose edge already exists are skipped, so re-running a batch changes nothing, and so
+    are rows from an older `source_file` than the citing article's (see create_articles).
+    Returns the number of relationships created.
+    """
+    result = tx.run("""
+    UNWIND $rows AS row
+    MATCH (citing:Article {pmid: row.citing})
+    WHERE citing.source_file IS NULL OR citing.source_file <= row.source_file
+    MATCH (cited:Article {pmid: row.cited})
+    WHERE NOT (citing)-[:CITES]->(cited)
+    CREATE (citing)-[:CITES]->(cited)
+    WITH cited, count(*) AS added
+    SET cited.citation_count = COALESCE(cited.citation_count, 0) + added
+    RETURN sum(added) AS created
+    """, rows=rows)
+    record = result.single()
+    return record['created'] if record and record['created'] else 0
+
+
+def update_citation_counts(session, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Recomputes citation_count for every article from its incoming CITES relationships,
+    committing every `batch_size` articles. Only needed to repair counts written by
+    older, non-idempotent ingests; create_citations keeps them current otherwise.
+    """
+    session.run("""
     MATCH (a:Article)
-    SET a.citation_count = size((a)<-[:CITES]-())
-    """)
+    CALL {
+        WITH a
+        SET a.citation_count = COUNT { (a)<-[:CITES]-() }
+    } IN TRANSACTIONS OF $batch_size ROWS
+    """, batch_size=batch_size).consume()
+
+
+def open_baseline(file_path):
+    """Open a baseline file for parsing, decompressing .gz files as they are read."""
+    return gzip.open(file_path, 'rb') if file_path.endswith('.gz') else open(file_path, 'rb')
+
+
+def iter_pubmed_articles(file_path):
+    """
+    Stream PubmedArticle elements out of a baseline file (.xml or .xml.gz) one at a time.
+
+    Each element is cleared (along with any already-processed siblings) once the
+    caller moves on, so memory stays flat regardless of file size.
+    """
+    with open_baseline(file_path) as f:
+        for _, article in etree.iterparse(f, events=('end',), tag='PubmedArticle'):
+            yield article
+
+            article.clear()
+            while article.getprevious() is not None:
+                del article.getparent()[0]
+
+
+def element_text(element):
+    """
+    All the text inside an element, including any inline markup like <i> or <sub>, with
+    runs of whitespace (line breaks included) collapsed to single spaces.
+    """
+    return ' '.join(''.join(element.itertext()).split())
+
+
+def extract_authors(article):
+    """
+    The {first_name, last_name} of each named author of a PubmedArticle element, in order and
+    without repeats. Group authors (a CollectiveName with no LastName) are left out, and a
+    missing ForeName falls back to the Initials, then to '' so the pair can always be merged on.
+    """
+    authors = {}
+    for author in article.xpath('.//AuthorList/Author'):
+        last_name = author.findtext('LastName')
+        if not last_name:
+            continue
+        first_name = author.findtext('ForeName') or author.findtext('Initials') or ''
+        authors[(first_name.strip(), last_name.strip())] = None
+    return [{'first_name': first_name, 'last_name': last_name} for first_name, last_name in authors]
+
+
+def extract_keywords(article):
+    """The distinct, non-empty keywords of a PubmedArticle element, in order."""
+    keywords = (element_text(keyword) for keyword in article.xpath('.//KeywordList/Keyword'))
+    return list(dict.fromkeys(keyword for keyword in keywords if keyword))
+
+
+def extract_article(article):
+    """
+    Return the {pmid, title, abstract, authors, keywords} row for a single PubmedArticle element.
+    Both the transactional ingest and the bulk import CSVs (prepare_xml_data.py) are built from it.
+    """
+    titles = article.xpath('.//ArticleTitle')
+    # Structured abstracts are split into labelled sections
+    sections = [element_text(section) for section in article.xpath('.//Abstract/AbstractText')]
+    return {
+        'pmid': article.xpath('.//PMID')[0].text,
+        'title': element_text(titles[0]) if titles else None,
+        # '' rather than None for articles without one, as the prompt and the bulk CSVs expect
+        'abstract': ' '.join(section for section in sections if section),
+        'authors': extract_authors(article),
+        'keywords': extract_keywords(article),
+    }
+
+
+REFERENCE_PATHS = (etree.XPath('.//ReferenceList/Reference'), etree.XPath('.//CitationList/Citation'))
 
 
-def process_citations_from_xml(file_path, driver):
-    # Parse the XML file
-    with open(file_path, 'rb') as f:
-        tree = etree.parse(f)
+def extract_citations(article):
+    """Return (citing_pmid, [cited_pmid, ...]) for a single PubmedArticle element."""
+    citing_pmid = article.xpath('.//PMID')[0].text
 
-    root = tree.getroot()
+    # Look for citations in different possible XML locations
+    reference_lists = REFERENCE_PATHS[0](article) + REFERENCE_PATHS[1](article)
 
-    # Iterate through PubMed articles
-    for article in root.xpath('//PubmedArticle'):
-        citing_pmid = article.xpath('.//PMID')[0].text
+    cited_pmids = []
+    for reference in reference_lists:
+        # find() rather than an xpath() per reference, which was most of the parse time
+        cited_pmid_element = reference.find('.//ArticleId[@IdType="pubmed"]')
+        if cited_pmid_element is not None and cited_pmid_element.text:
+            cited_pmids.append(cited_pmid_element.text)
 
-        # Find references in the article
-        # Look for citations in different possible XML locations
-        reference_lists = article.xpath('.//ReferenceList/Reference') + \
-                          article.xpath('.//CitationList/Citation')
+    return citing_pmid, cited_pmids
 
-        print(f"Processing citations for PMID: {citing_pmid}")
 
-        for reference in reference_lists:
-            # Extract cited PMID if available
-            cited_pmid_elements = reference.xpath('.//ArticleId[@IdType="pubmed"]/text()')
-            if cited_pmid_elements:
-                cited_pmid = cited_pmid_elements[0]
-                print(f"Found citation: {citing_pmid} -> {cited_pmid}")
+def article_rows(article):
+    return [extract_article(article)]
 
-                # Create citation relationship
-                with driver.session() as session:
-                    try:
-                        session.execute_write(create_citation, citing_pmid, cited_pmid)
-                    except Exception as e:
-                        print(f"Error processing citation {citing_pmid} -> {cited_pmid}: {e}")
+
+def citation_rows(article):
+    citing_pmid, cited_pmids = extract_citations(article)
+    return [{'citing': citing_pmid, 'cited': cited_pmid} for cited_pmid in cited_pmids]
+
+
+# stage -> (rows of one PubmedArticle, transaction writing a batch of them)
+STAGE_ROWS = {
+    'articles': (article_rows, create_articles),
+    'citations': (citation_rows, create_citations),
+}
+
+
+def resolve_inputs(paths):
+    """Expand directories and glob patterns into a sorted, de-duplicated list of .xml/.xml.gz files."""
+    files = set()
+    for path in paths:
+        if os.path.isdir(path):
+            files.update(glob.glob(os.path.join(path, '*.xml')))
+            files.update(glob.glob(os.path.join(path, '*.xml.gz')))
+        elif glob.has_magic(path):
+            files.update(f for f in glob.glob(path) if f.endswith(('.xml', '.xml.gz')))
+        else:
+            files.add(path)
+    return sorted(files)
+
+
+class IngestManifest:
+    """
+    Checkpoint of which stages each baseline file has completed, saved after every file so
+    an interrupted ingest resumes where it stopped. Files are keyed by name; a file whose size
+    has changed since it was recorded is ingested again. With no path nothing is kept.
+    """
+
+    def __init__(self, path=DEFAULT_MANIFEST):
+        self.path = path
+        self.files = {}
+        if path and os.path.exists(path):
+            with open(path) as f:
+                self.files = json.load(f)['files']
+
+    def is_done(self, file_path, stage):
+        entry = self.files.get(os.path.basename(file_path))
+        return bool(entry) and entry['size'] == os.path.getsize(file_path) and stage in entry['stages']
+
+    def mark_done(self, file_path, stage, articles, rows):
+        name = os.path.basename(file_path)
+        size = os.path.getsize(file_path)
+        entry = self.files.get(name)
+        if not entry or entry['size'] != size:
+            entry = self.files[name] = {'size': size, 'stages': {}}
+        entry['stages'][stage] = {'articles': articles, 'rows': rows, 'completed': time.strftime('%Y-%m-%dT%H:%M:%S')}
+        self.save()
+
+    def save(self):
+        if not self.path:
+            return
+        # Write then rename, so a crash mid-save can't leave a truncated manifest
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, 'w') as f:
+            json.dump({'files': self.files}, f, indent=1)
+        os.replace(temp_path, self.path)
+
+
+# The parse workers' end of the queue to the writer, set when each worker starts
+_rows_queue = None
+
+
+def _init_parse_worker(rows_queue):
+    global _rows_queue
+    _rows_queue = rows_queue
+
+
+def parse_file(file_path, rows_of, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Parse one baseline file in a worker process, streaming the rows `rows_of` makes from each
+    PubmedArticle to the writer in chunks, then a ('done', file, articles) message, or
+    ('error', file, message) if the file can't be parsed.
+    """
+    articles = 0
+    rows = []
+    try:
+        for article in iter_pubmed_articles(file_path):
+            articles += 1
+            rows.extend(rows_of(article))
+            if len(rows) >= chunk_size:
+                _rows_queue.put(('rows', file_path, rows))
+                rows = []
+        if rows:
+            _rows_queue.put(('rows', file_path, rows))
+        _rows_queue.put(('done', file_path, articles))
+    except Exception as e:
+        _rows_queue.put(('error', file_path, f"{type(e).__name__}: {e}"))
+
+
+def parse_in_pool(files, rows_of, workers=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Parse `files` in a pool of `workers` processes (default one per CPU), yielding their
+    ('rows' | 'done' | 'error', file, payload) messages to the single consumer as they arrive.
+    (None, None, None) is yielded whenever nothing arrived for PROGRESS_INTERVAL seconds, so
+    the consumer can still report progress. `rows_of` must be a module-level function.
+
+    If a worker dies (killed for running out of memory, say) the pool is broken: every file
+    not finished by then gets an 'error' message and the generator ends.
+    """
+    workers = min(workers or os.cpu_count(), len(files))
+    # A manager queue, not a multiprocessing.Queue: a worker killed halfway through writing a chunk
+    # to a shared pipe would leave a partial message that blocks every later read. Bounded, so
+    # parsers block rather than pile rows up in memory when the consumer falls behind.
+    manager = multiprocessing.Manager()
+    rows_queue = manager.Queue(maxsize=workers * 8)
+    executor = ProcessPoolExecutor(workers, initializer=_init_parse_worker, initargs=(rows_queue,))
+    tasks = [executor.submit(parse_file, file_path, rows_of, chunk_size) for file_path in files]
+
+    outstanding = set(files)
+    try:
+        while outstanding:
+            try:
+                message = rows_queue.get(timeout=PROGRESS_INTERVAL)
+            except queue.Empty:
+                # Checked once the queue has gone quiet, so rows already sent by finished files are read first
+                if any(task.done() and isinstance(task.exception(), BrokenProcessPool) for task in tasks):
+                    for file_path in sorted(outstanding):
+                        yield 'error', file_path, 'a parse worker died'
+                    return
+                message = (None, None, None)
+            if message[0] in ('done', 'error'):
+                outstanding.discard(message[1])
+            yield message
+    finally:
+        # Workers may be blocked on the full queue if the consumer stopped early. ProcessPoolExecutor
+        # has no public way to kill its workers before Python 3.14, so reach for them directly.
+        for process in list((getattr(executor, '_processes', None) or {}).values()):
+            process.terminate()
+        executor.shutdown(wait=True, cancel_futures=True)
+        manager.shutdown()
+
+
+def ingest_stage(files, stage, driver, manifest, workers=None, batch_size=DEFAULT_BATCH_SIZE,
+                 chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Load one stage of `files` into Neo4j: a pool of `workers` processes parses the files and
+    this process, the only writer, batches their rows into `batch_size` row transactions.
+
+    A file is checkpointed in the manifest once all its rows are committed, and files already
+    checkpointed for this stage are skipped. Returns the files that failed.
+    """
+    rows_of, write = STAGE_ROWS[stage]
+    pending = [file_path for file_path in files if not manifest.is_done(file_path, stage)]
+    if len(pending) < len(files):
+        print(f"[{stage}] skipping {len(files) - len(pending)} files already loaded")
+    if not pending:
+        return []
+
+    start = last_report = time.perf_counter()
+    write_seconds = 0.0
+    buffer = []
+    # Files with rows in the buffer, and those with a batch that failed to write
+    buffered_files, failed = set(), set()
+    file_rows = dict.fromkeys(pending, 0)
+    finished = articles = written = failed_batches = 0
+
+    def flush():
+        nonlocal buffer, write_seconds, written, failed_batches
+        if not buffer:
+            return
+        if stage == 'citations':
+            # A reference list can cite the same article twice, and both rows would pass the existence check.
+            # Rows of different versions stay apart, only the one matching the article's version is written.
+            rows = list({(row['citing'], row['cited'], row['source_file']): row for row in buffer}.values())
+        else:
+            rows = buffer
+        write_start = time.perf_counter()
+        try:
+            with driver.session() as session:
+                session.execute_write(write, rows)
+            written += len(buffer)
+        except Exception as e:
+            print(f"[{stage}] error writing a batch of {len(buffer)} rows from "
+                  f"{', '.join(sorted(os.path.basename(f) for f in buffered_files))}: {e}")
+            failed_batches += 1
+            failed.update(buffered_files)
+        write_seconds += time.perf_counter() - write_start
+        buffer = []
+        buffered_files.clear()
+
+    for kind, file_path, payload in parse_in_pool(pending, rows_of, workers, chunk_size):
+        if kind == 'rows':
+            # Which version of an article a row belongs to, see create_articles
+            source_file = os.path.basename(file_path)
+            for row in payload:
+                row['source_file'] = source_file
+            buffer.extend(payload)
+            buffered_files.add(file_path)
+            file_rows[file_path] += len(payload)
+            if len(buffer) >= batch_size:
+                flush()
+        elif kind == 'done':
+            # Commit what's left of the file before it's checkpointed
+            flush()
+            finished += 1
+            articles += payload
+            if file_path not in failed:
+                manifest.mark_done(file_path, stage, payload, file_rows[file_path])
+        elif kind == 'error':
+            # It will be retried on the next run
+            print(f"[{stage}] could not parse {file_path}: {payload}")
+            finished += 1
+            failed.add(file_path)
+
+        now = time.perf_counter()
+        if now - last_report >= PROGRESS_INTERVAL or finished == len(pending):
+            last_report = now
+            elapsed = now - start
+            print(f"[{stage}] {finished}/{len(pending)} files, {articles} articles, "
+                  f"{written} rows written ({written / elapsed:.0f} rows/sec, "
+                  f"writer busy {write_seconds / elapsed:.0%})")
+
+    if failed_batches:
+        # Their rows aren't in the written count, and their files aren't checkpointed
+        print(f"[{stage}] {failed_batches} batches failed to write")
+    return sorted(failed)
+
+
+def ingest(files, driver, stages=STAGES, manifest_path=DEFAULT_MANIFEST, workers=None,
+           batch_size=DEFAULT_BATCH_SIZE, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Run each of `stages` over all of `files` in turn, returning the files that failed in any stage."""
+    manifest = IngestManifest(manifest_path)
+    failed = set()
+    for stage in STAGES:
+        if stage in stages:
+            failed.update(ingest_stage(files, stage, driver, manifest, workers, batch_size, chunk_size))
+    return sorted(failed)
 
 
 def main():
+    parser = argparse.ArgumentParser(description='Load PubMed baseline articles and citations into Neo4j')
+    parser.add_argument('paths', nargs='*', default=['pubmed24n0001.xml'],
+                        help='PubMed baseline .xml/.xml.gz files, directories of them, or glob patterns')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                        help='Number of rows written per transaction')
+    parser.add_argument('--workers', type=int, help='Parse processes (default one per CPU)')
+    parser.add_argument('--stages', default=','.join(STAGES),
+                        help='Comma separated stages to run: articles, citations or both')
+    parser.add_argument('--manifest', default=DEFAULT_MANIFEST,
+                        help='Checkpoint file recording which files each stage has loaded')
+    parser.add_argument('--restart', action='store_true',
+                        help='Ignore the checkpoint and load every file again')
+    parser.add_argument('--recount', action='store_true',
+                        help='Recompute every citation_count afterwards (repairs counts from older ingests)')
+    parser.add_argument('--after-bulk-import', action='store_true',
+                        help='Load no files; create the indexes and citation counts of a database built from '
+                             'the prepare_xml_data.py CSVs')
+    args = parser.parse_args()
+
+    stages = args.stages.split(',')
+    if set(stages) - set(STAGES):
+        parser.error(f"Unknown stages: {', '.join(sorted(set(stages) - set(STAGES)))}")
+    files = [] if args.after_bulk_import else resolve_inputs(args.paths)
+    if not files and not args.after_bulk_import:
+        parser.error('No .xml or .xml.gz files found')
+    if args.restart and os.path.exists(args.manifest):
+        os.remove(args.manifest)
+
     # Use the same Neo4j connection settings as your original code
     uri = "bolt://localhost:7687"
     driver = GraphDatabase.driver(uri, auth=("neo4j", "password"))
 
     try:
-        file_path = 'pubmed24n0001.xml'  # Update this to your file path
-        process_citations_from_xml(file_path, driver)
-
-        # Update all citation counts at the end
         with driver.session() as session:
-            session.execute_write(update_citation_counts)
+            session.execute_write(create_indexes)
+
+        failed = ingest(files, driver, stages, args.manifest, args.workers, args.batch_size) if files else []
+
+        # Counts are maintained per batch, a full recount is only needed to repair old data or after a bulk import
+        if args.recount or args.after_bulk_import:
+            with driver.session() as session:
+                update_citation_counts(session, batch_size=args.batch_size)
 
-        print("Citation update complete.")
+        if failed:
+            print(f"{len(failed)} files failed and will be retried on the next run: "
+                  f"{', '.join(os.path.basename(f) for f in failed)}")
+        else:
+            print("Ingest complete.")
     finally:
         driver.close()
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
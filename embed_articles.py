@@ -0,0 +1,229 @@
+import argparse
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+from neo4j import GraphDatabase, READ_ACCESS
+
+from clients import get_embeddings, get_openai_embeddings
+from create_neo4j import create_vector_index
+
+
+DEFAULT_STORE_PATH = 'article_embeddings.sqlite'
+DEFAULT_PAGE_SIZE = 1000
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_WORKERS = 4
+CHECKPOINT_KEY = 'last_pmid'
+
+
+def article_text(title, abstract):
+    return f"{title or ''}\n\n{abstract or ''}".strip()
+
+
+def content_hash(text, model=''):
+    """Key of the vector `model` gives `text`. Without a model name it's the hash of the text alone."""
+    payload = f"{model}\0{text}" if model else text
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def embedding_model(embeddings):
+    """The model name of an embedding client, '' if it doesn't name one."""
+    return getattr(embeddings, 'model', None) or ''
+
+
+class EmbeddingStore:
+    """
+    Content-addressed float16 vector store in a SQLite file.
+
+    Vectors are keyed by the hash of the text they embed and the model embedding it, so
+    an unchanged abstract is never embedded twice by the same model, whatever article it
+    belongs to. The file also holds the pipeline checkpoint.
+    """
+
+    def __init__(self, path=DEFAULT_STORE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS vectors (hash TEXT PRIMARY KEY, vector BLOB NOT NULL)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS checkpoint (key TEXT PRIMARY KEY, value TEXT)")
+        self._conn.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM vectors").fetchone()[0]
+
+    def _select(self, columns, hashes):
+        hashes = list(hashes)
+        rows = []
+        with self._lock:
+            # Stay under SQLite's bound parameter limit
+            for start in range(0, len(hashes), 500):
+                chunk = hashes[start:start + 500]
+                rows.extend(self._conn.execute(
+                    f"SELECT {columns} FROM vectors WHERE hash IN ({','.join('?' * len(chunk))})", chunk))
+        return rows
+
+    def existing(self, hashes):
+        """The subset of `hashes` that already have a vector."""
+        return {row[0] for row in self._select('hash', hashes)}
+
+    def get_many(self, hashes):
+        return {h: np.frombuffer(blob, dtype=np.float16) for h, blob in self._select('hash, vector', hashes)}
+
+    def put_many(self, vectors):
+        rows = [(h, np.asarray(vector, dtype=np.float16).tobytes()) for h, vector in vectors.items()]
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO vectors (hash, vector) VALUES (?, ?)", rows)
+            self._conn.commit()
+
+    def get_checkpoint(self):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM checkpoint WHERE key = ?", (CHECKPOINT_KEY,)).fetchone()
+        return row[0] if row else None
+
+    def set_checkpoint(self, value):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO checkpoint (key, value) VALUES (?, ?)", (CHECKPOINT_KEY, value))
+            self._conn.commit()
+
+    def clear_checkpoint(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM checkpoint WHERE key = ?", (CHECKPOINT_KEY,))
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def iter_article_pages(driver, page_size=DEFAULT_PAGE_SIZE, after=None):
+    """Yield pages of articles ordered by pmid, paging by the last pmid seen rather than SKIP."""
+    after = after or ''
+    while True:
+        records, _, _ = driver.execute_query("""
+        MATCH (a:Article)
+        WHERE a.pmid > $after
+        RETURN a.pmid AS pmid, a.title AS title, a.abstract AS abstract, a.embedding_hash AS embedding_hash
+        ORDER BY a.pmid
+        LIMIT $page_size
+        """, after=after, page_size=page_size, routing_=READ_ACCESS)
+        if not records:
+            return
+        yield [record.data() for record in records]
+        after = records[-1]['pmid']
+
+
+def write_embeddings(tx, rows):
+    tx.run("""
+    UNWIND $rows AS row
+    MATCH (a:Article {pmid: row.pmid})
+    SET a.embedding = row.vector, a.embedding_hash = row.hash
+    """, rows=rows)
+
+
+def embed_articles(driver, embeddings, store,
+                   page_size=DEFAULT_PAGE_SIZE,
+                   batch_size=DEFAULT_BATCH_SIZE,
+                   workers=DEFAULT_WORKERS,
+                   resume=True):
+    """
+    Bring every Article's embedding in line with its current title+abstract.
+
+    Articles whose embedding_hash already matches the hash of their text are skipped.
+    For the rest, texts without a vector in `store` are embedded `batch_size` at a time
+    on `workers` threads. The vectors are then stored and written back, and only after
+    that is the page's last pmid checkpointed. With `resume`, a run picks up after the
+    last checkpointed page. A batch the API answers with fewer vectors than texts stops
+    the run before its page is checkpointed; the batches that did come back are kept.
+    """
+    start = time.perf_counter()
+    stats = {'articles': 0, 'embedded': 0, 'written': 0}
+    index_ready = False
+    model = embedding_model(embeddings)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for page in iter_article_pages(driver, page_size, store.get_checkpoint() if resume else None):
+            texts = {}
+            for article in page:
+                text = article_text(article['title'], article['abstract'])
+                article['hash'] = content_hash(text, model) if text else None
+                if text:
+                    texts[article['hash']] = text
+
+            # Only articles whose node doesn't hold the embedding of its current text need work
+            stale = [a for a in page if a['hash'] and a['hash'] != a['embedding_hash']]
+            needed = list(dict.fromkeys(a['hash'] for a in stale))
+            stored = store.existing(needed)
+            missing = [h for h in needed if h not in stored]
+            batches = [missing[i:i + batch_size] for i in range(0, len(missing), batch_size)]
+            futures = {pool.submit(embeddings.embed_documents, [texts[h] for h in batch]): batch
+                       for batch in batches}
+            short = []
+            for future in as_completed(futures):
+                batch, vectors = futures[future], future.result()
+                # caai_emb_client prints and returns what it got when the reply has no data
+                if len(vectors) != len(batch):
+                    short.append(f"{len(vectors)} of {len(batch)}")
+                    continue
+                store.put_many(dict(zip(batch, vectors)))
+            if short:
+                raise RuntimeError(f"The embedding API returned too few vectors ({', '.join(short)}) for the page "
+                                   f"starting at pmid {page[0]['pmid']}; it isn't checkpointed, re-run to resume")
+
+            vectors = store.get_many(needed)
+            if stale and not index_ready:
+                with driver.session() as session:
+                    session.execute_write(create_vector_index, len(next(iter(vectors.values()))))
+                index_ready = True
+            rows = [{'pmid': a['pmid'], 'hash': a['hash'], 'vector': vectors[a['hash']].astype(float).tolist()}
+                    for a in stale]
+            if rows:
+                with driver.session() as session:
+                    session.execute_write(write_embeddings, rows)
+
+            store.set_checkpoint(page[-1]['pmid'])
+            stats['articles'] += len(page)
+            stats['embedded'] += len(missing)
+            stats['written'] += len(rows)
+            elapsed = time.perf_counter() - start
+            print(f"{stats['articles']} articles, {stats['embedded']} embedded, {stats['written']} written "
+                  f"({stats['articles'] / elapsed:.0f} articles/sec)")
+
+    store.clear_checkpoint()
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Precompute embeddings for Article titles and abstracts')
+    parser.add_argument('--config', default='config.json', help='Path to config file')
+    parser.add_argument('--store', default=DEFAULT_STORE_PATH, help='Local embedding store')
+    parser.add_argument('--page-size', type=int, default=DEFAULT_PAGE_SIZE, help='Articles read per page')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help='Texts per embedding request')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help='Concurrent embedding requests')
+    parser.add_argument('--restart', action='store_true', help='Ignore the checkpoint and scan every article')
+    parser.add_argument('--api-base', help='OpenAI-compatible embeddings endpoint to use instead of the '
+                                           'configured one, e.g. a stand_ins.py embeddings server')
+    args = parser.parse_args()
+
+    with open(args.config) as f:
+        config = json.load(f)
+    embeddings = get_openai_embeddings(config, args.api_base) if args.api_base else get_embeddings(config)
+    driver = GraphDatabase.driver(config['neo4j_uri'], auth=(config['neo4j_username'], config['neo4j_password']))
+    store = EmbeddingStore(args.store)
+
+    try:
+        stats = embed_articles(driver, embeddings, store, args.page_size, args.batch_size, args.workers,
+                               resume=not args.restart)
+        print(f"Done: {stats['articles']} articles scanned, {stats['embedded']} embedded, "
+              f"{stats['written']} written, {len(store)} vectors stored")
+    finally:
+        store.close()
+        driver.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+import hashlib
+import json
+import re
+import threading
+from collections import OrderedDict
+from typing import Callable, Iterable, List, Optional, Tuple, Type
+
+import numpy as np
+
+from response_cache import ResponseCache
+
+
+DEFAULT_MAX_ENTRIES = 1024
+DEFAULT_CACHE_PATH = 'explanation_cache.sqlite'
+DEFAULT_TTL = 24 * 60 * 60
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+DEFAULT_SIMILARITY_THRESHOLD = 0.95
+
+
+def normalize_question(question: str) -> str:
+    """Lowercase, collapse whitespace and drop trailing punctuation."""
+    return re.sub(r'\s+', ' ', question.lower()).strip().rstrip('?.!').strip()
+
+
+def pmid_key(pmids: Iterable[str]) -> str:
+    return ','.join(sorted(str(pmid) for pmid in pmids))
+
+
+class ExplanationCache:
+    """
+    Two-tier cache of LLM result explanations.
+
+    Entries are keyed on the normalized question, the sorted PMIDs of the papers being
+    explained and the prompt version. The first tier is an in-memory LRU of `max_entries`
+    and the second an optional on-disk ResponseCache with its own TTL and size cap.
+
+    With an `embed` function, a question that misses exactly can still hit an entry
+    for the same papers and prompt whose question embedding has cosine similarity of
+    at least `similarity_threshold` (only entries in the memory tier are compared).
+    When `embed` raises one of `embed_errors` or returns None, the question is only
+    cached and looked up by its exact key, and the failure is counted.
+    """
+
+    def __init__(self,
+                 prompt_version: str,
+                 max_entries: int = DEFAULT_MAX_ENTRIES,
+                 disk: Optional[ResponseCache] = None,
+                 embed: Optional[Callable[[str], List[float]]] = None,
+                 similarity_threshold: float = DEFAULT_SIMILARITY_THRESHOLD,
+                 embed_errors: Tuple[Type[BaseException], ...] = ()):
+        self.prompt_version = prompt_version
+        self.max_entries = max_entries
+        self.disk = disk
+        self.embed = embed
+        self.similarity_threshold = similarity_threshold
+        self.embed_errors = embed_errors
+        self._lock = threading.Lock()
+        # key -> (explanation, papers key, question vector or None)
+        self._memory = OrderedDict()
+        self.metrics = {'memory_hits': 0, 'disk_hits': 0, 'similar_hits': 0, 'misses': 0}
+        # Not a lookup outcome, so kept out of the hit rate
+        self.embedding_failures = 0
+
+    @classmethod
+    def from_config(cls, config, prompt_version, embed=None, embed_errors=()):
+        """Build the cache from the `explanation_cache` section of the config."""
+        settings = config.get('explanation_cache', {})
+        disk = None
+        if settings.get('path', DEFAULT_CACHE_PATH):
+            disk = ResponseCache(settings.get('path', DEFAULT_CACHE_PATH),
+                                 ttl=settings.get('ttl', DEFAULT_TTL),
+                                 max_bytes=settings.get('max_bytes', DEFAULT_MAX_BYTES))
+        threshold = settings.get('similarity_threshold')
+        return cls(prompt_version,
+                   max_entries=settings.get('max_entries', DEFAULT_MAX_ENTRIES),
+                   disk=disk,
+                   embed=embed if threshold else None,
+                   similarity_threshold=threshold or DEFAULT_SIMILARITY_THRESHOLD,
+                   embed_errors=embed_errors)
+
+    def key(self, question: str, pmids: Iterable[str]) -> str:
+        payload = json.dumps([normalize_question(question), pmid_key(pmids), self.prompt_version])
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _vector(self, question):
+        """The normalized question embedding, or None if the embedding API failed."""
+        try:
+            vector = self.embed(normalize_question(question))
+        except self.embed_errors:
+            vector = None
+        if vector is None:
+            with self._lock:
+                self.embedding_failures += 1
+            return None
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _remember(self, key, explanation, papers, vector):
+        with self._lock:
+            self._memory[key] = (explanation, papers, vector)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    def _count(self, metric):
+        with self._lock:
+            self.metrics[metric] += 1
+
+    def get(self, question: str, pmids: Iterable[str]) -> Optional[str]:
+        """Return the cached explanation for this question and set of papers, or None."""
+        pmids = list(pmids)
+        key = self.key(question, pmids)
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+                self.metrics['memory_hits'] += 1
+                return entry[0]
+
+        if self.disk is not None:
+            cached = self.disk.get(key)
+            if cached is not None:
+                self._remember(key, cached['explanation'], pmid_key(pmids), None)
+                self._count('disk_hits')
+                return cached['explanation']
+
+        if self.embed is not None:
+            explanation = self._similar(question, pmid_key(pmids))
+            if explanation is not None:
+                self._count('similar_hits')
+                return explanation
+
+        self._count('misses')
+        return None
+
+    def _similar(self, question, papers):
+        with self._lock:
+            candidates = [(key, entry) for key, entry in self._memory.items()
+                          if entry[1] == papers and entry[2] is not None]
+        if not candidates:
+            return None
+        vector = self._vector(question)
+        if vector is None:
+            return None
+        best_key, best_entry = max(candidates, key=lambda item: float(item[1][2] @ vector))
+        if float(best_entry[2] @ vector) < self.similarity_threshold:
+            return None
+        with self._lock:
+            if best_key in self._memory:
+                self._memory.move_to_end(best_key)
+        return best_entry[0]
+
+    def put(self, question: str, pmids: Iterable[str], explanation: str):
+        pmids = list(pmids)
+        key = self.key(question, pmids)
+        vector = self._vector(question) if self.embed is not None else None
+        self._remember(key, explanation, pmid_key(pmids), vector)
+        if self.disk is not None:
+            self.disk.set(key, {'explanation': explanation})
+
+    def stats(self):
+        with self._lock:
+            lookups = sum(self.metrics.values())
+            hits = lookups - self.metrics['misses']
+            report = {**self.metrics, 'embedding_failures': self.embedding_failures,
+                      'entries': len(self._memory), 'hit_rate': hits / lookups if lookups else 0}
+        if self.disk is not None:
+            report['disk'] = self.disk.stats()
+        return report
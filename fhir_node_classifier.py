@@ -0,0 +1,309 @@
+import argparse
+import json
+import re
+import statistics
+import time
+import zlib
+
+import numpy as np
+from langchain_core.prompts import PromptTemplate
+
+
+# Node types of the FHIR graph and when they are relevant to a question
+NODE_TYPES = {
+    'AllergyIntolerance': "questions related to allergies or their severity/causes",
+    'CarePlan': "relevant for care plans, self management plans, or exercise therapies",
+    'CareTeam': "relevant for people, practitioners, organizations, and health centers associated with care plans",
+    'Claim': "related to billing, insurance, and pricing for procedures and encounters",
+    'Condition': "relevant for conditions and diagnoses",
+    'Date': "any question involving a date or time period should involve this node type",
+    'Device': "relevant for medical devices",
+    'DiagnosticReport': "relevant for diagnostic reports",
+    'DocumentReference': "relevant for clinical notes",
+    'Encounter': "related to specific patient visits and what a patient was there for",
+    'ExplanationOfBenefit': "relevant for Medicaid and insurance payors",
+    'ImagingStudy': "related to imaging, such as X-rays and radiology",
+    'Immunization': "relevant for vaccines and innoculations",
+    'Location': "relevant for addresses and locations of businesses or hospitals, but not relevant for patients",
+    'Medication': "relevant for medications and dosages",
+    'MedicationAdministration': "relevant for a specific instance of usage of medication",
+    'MedicationRequest': "relevant for practitioner requests for medications for certain conditions",
+    'Observation': "relevant for a particular measurement of a patient at a given time, such as vital signs or BMI",
+    'Organization': "relevant for addresses, phone numbers, and other information for organizations, "
+                    "such as healthcare providers",
+    'Patient': "relevant for questions relating to specific patients, including demographic info such as "
+               "locations, DOBs, and other statuses",
+    'Practitioner': "related to specific practictioners and their location, name, and contact info",
+    'PractionerRole': "related to roles of practitioners at their given hospitals",
+    'Procedure': "relevant for specific procedures and when they were performed",
+    'SupplyDelivery': "relevant for the shipping of specific items and equipment",
+}
+
+# Phrases that on their own make a node type relevant
+KEYWORDS = {
+    'AllergyIntolerance': r"allerg\w*|intoleran\w*|anaphyla\w*",
+    'CarePlan': r"care ?plans?|self[- ]management|exercise therap\w*|therapy plans?",
+    'CareTeam': r"care ?teams?",
+    'Claim': r"claims?|bill\w*|cost\w*|price\w*|pricing|charged?|paid|pay|how much",
+    'Condition': r"conditions?|diagnos[ie]s\w*|diagnosed|disease\w*|disorders?|illness\w*|"
+                 r"diabetes|hypertension|cancer|asthma|molars?|sinusitis|obes\w*|suffer\w*",
+    # Only unambiguous date words: "may", "when", "first", "last", "before", "after" and "years"
+    # are as likely to be ordinary English, so they count only in phrases like "last year"
+    'Date': r"\d{1,2}/\d{1,2}/\d{2,4}|\d{4}-\d{2}-\d{2}|(?:19|20)\d{2}|"
+            r"jan(?:uary)?|feb(?:ruary)?|mar(?:ch)?|apr(?:il)?|june?|july?|aug(?:ust)?|sept?(?:ember)?|"
+            r"oct(?:ober)?|nov(?:ember)?|dec(?:ember)?|may \d{1,2}|\d{1,2} may|"
+            r"(?:last|past|next|this|previous) (?:years?|months?|weeks?|days?|decades?)|"
+            r"\d+ (?:years?|months?|weeks?|days?)|years? ago|"
+            r"dates?|months?|weeks?|days?|recent\w*|latest|since|during|ages?|old|born|birth\w*|dobs?",
+    'Device': r"devices?|pacemakers?|implants?|glucometers?|monitors?|inhalers?",
+    'DiagnosticReport': r"diagnostic reports?|lab(?:oratory)? reports?|reports?|panels?",
+    'DocumentReference': r"notes?|documents?|clinical notes?|documentation",
+    'Encounter': r"encounters?|visits?|visited|admi(?:tted|ssions?)|appointments?|checkups?|er\b|emergency",
+    'ExplanationOfBenefit': r"medicaid|medicare|payors?|payers?|insur\w*|benefits?|coverage|covered",
+    'ImagingStudy': r"imaging|x-?rays?|radiolog\w*|mri|ct scans?|scans?|ultrasound",
+    'Immunization': r"immuni[sz]\w*|vaccin\w*|innocul\w*|inocul\w*|shots?|flu shot|boosters?",
+    'Location': r"locations?|address\w*|hospitals?|clinics?|facilit\w*|where",
+    'Medication': r"medications?|medicines?|drugs?|dosages?|doses?|prescri\w*|pills?|tablets?|mg\b",
+    'MedicationAdministration': r"administ\w*|doses? given|took",
+    'MedicationRequest': r"prescri\w*|medication requests?|requested|ordered",
+    'Observation': r"observations?|measure\w*|vitals?|vital signs?|bmi|body mass|weight|height|heart rate|pulse|"
+                   r"blood pressure|temperature|respirat\w*|glucose|cholesterol|a1c|hemoglobin|oxygen|"
+                   r"body weight|levels?",
+    'Organization': r"organi[sz]ations?|hospitals?|providers?|phone numbers?|companies|company|businesses",
+    # Names like Arlette667 are the only case-sensitive part of any rule
+    'Patient': r"(?i:patients?|people|persons?|individuals?|marital|gender|sex|race|ethnic\w*|deceased)|"
+               r"[A-Z][a-z]+\d{2,4}",
+    'Practitioner': r"practitioners?|doctors?|physicians?|nurses?|providers?|dr\.?",
+    'PractionerRole': r"roles?|specialt\w*|speciali[sz]\w*",
+    'Procedure': r"procedures?|surger\w*|operations?|performed|colonoscop\w*|biops\w*|screening|"
+                 r"appendectom\w*|removal",
+    'SupplyDelivery': r"supply|supplies|deliver\w*|shipp\w*|shipments?|equipment",
+}
+
+LLM_TEMPLATE = """
+    Task: The user input will concern a question related to a graph database, which contains many node types. Your job is to determine what node types are relevant
+    to this particular user question. Your response should be a comma separated list of node types, if there are more than one, with no additional text.
+
+    Here are the node types and when they are relevant:
+    """ + "\n    ".join(f"{label}: {description}" for label, description in NODE_TYPES.items()) + """
+
+    Question: {question}"""
+
+DEFAULT_DIMENSIONS = 4096
+# Any keyword match is confident, description similarity alone rarely is
+DEFAULT_CONFIDENCE = 0.5
+# Without keyword matches, labels within this fraction of the best similarity are kept
+DEFAULT_RELATIVE_SIMILARITY = 0.9
+RULE_WEIGHT = 1.0
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+def split_label(label):
+    """CarePlan -> care plan"""
+    return re.sub(r'(?<=[a-z])(?=[A-Z])', ' ', label).lower()
+
+
+class HashingEmbedder:
+    """
+    Local bag of words and character 4-grams, hashed into a fixed number of dimensions.
+
+    Good enough to compare a short question against a couple of dozen descriptions,
+    and takes microseconds instead of an embedding API round trip.
+    """
+
+    def __init__(self, dimensions=DEFAULT_DIMENSIONS):
+        self.dimensions = dimensions
+
+    def features(self, text):
+        for word in TOKEN_PATTERN.findall(text.lower()):
+            yield word
+            padded = f" {word} "
+            for i in range(len(padded) - 3):
+                yield padded[i:i + 4]
+
+    def embed_documents(self, texts):
+        vectors = np.zeros((len(texts), self.dimensions), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature in self.features(text):
+                vectors[row, zlib.crc32(feature.encode('utf-8')) % self.dimensions] += 1
+        np.log1p(vectors, out=vectors)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.where(norms == 0, 1, norms)
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+class NodeClassifier:
+    """
+    Picks the FHIR node types relevant to a question without an LLM call.
+
+    Each label's description (plus its name and keywords) is embedded once. A question
+    scores RULE_WEIGHT for every label whose keyword pattern it matches, plus its cosine
+    similarity to the label's description. The labels with keyword matches are selected,
+    or if there are none, the labels within `relative_similarity` of the best similarity.
+    When the best score is under `confidence`, `classify` reports the result as
+    unconfident and `relevant_nodes` falls back to the LLM if one is given.
+    """
+
+    def __init__(self, embedder=None, confidence=DEFAULT_CONFIDENCE,
+                 relative_similarity=DEFAULT_RELATIVE_SIMILARITY):
+        self.embedder = embedder or HashingEmbedder()
+        self.confidence = confidence
+        self.relative_similarity = relative_similarity
+        self.labels = list(NODE_TYPES)
+        self.rules = [re.compile(rf"(?<!\w)(?:{KEYWORDS[label]})(?!\w)",
+                                 0 if label == 'Patient' else re.IGNORECASE) for label in self.labels]
+        texts = [f"{split_label(label)}: {NODE_TYPES[label]}. {KEYWORDS[label].replace('|', ' ')}"
+                 for label in self.labels]
+        self.description_vectors = np.asarray(self.embedder.embed_documents(texts), dtype=np.float32)
+
+    def scores(self, question):
+        vector = np.asarray(self.embedder.embed_query(question), dtype=np.float32)
+        similarity = self.description_vectors @ vector
+        matched = np.array([rule.search(question) is not None for rule in self.rules])
+        return similarity, matched
+
+    def classify(self, question):
+        """Return (labels, confident), the labels ordered by score."""
+        similarity, matched = self.scores(question)
+        total = similarity + RULE_WEIGHT * matched
+        if matched.any():
+            selected = matched
+        else:
+            selected = similarity >= max(similarity.max() * self.relative_similarity, 1e-6)
+        order = np.argsort(-total)
+        labels = [self.labels[i] for i in order if selected[i]]
+        return labels, bool(total.max() >= self.confidence)
+
+    def relevant_nodes(self, question, llm=None):
+        """Comma separated relevant labels, in the same form as the LLM answer."""
+        labels, confident = self.classify(question)
+        if not confident and llm is not None:
+            return llm_relevant_nodes(question, llm)
+        return ", ".join(labels)
+
+
+def llm_relevant_nodes(question, llm):
+    """Ask the LLM which node types are relevant, the original path kept as the fallback."""
+    response = (PromptTemplate.from_template(LLM_TEMPLATE) | llm).invoke({'question': question})
+    return response.content
+
+
+def parse_labels(answer):
+    return {label for label in answer.replace(" ", "").split(",") if label}
+
+
+# Hand-labelled questions for `--evaluate`
+EVALUATION_SET = [
+    ("What conditions does patient Arlette667 Kohler843 have?", {'Patient', 'Condition'}),
+    ("How many patients have the condition 'Impacted molars'?", {'Patient', 'Condition'}),
+    ("What is Arlette667 Kohler843's marital status?", {'Patient'}),
+    ("How much did the colonoscopy on Aug. 13, 2021 cost?", {'Procedure', 'Claim', 'Date'}),
+    ("What was the body weight of Adan632 Cassin499 on 10/09/2014.", {'Patient', 'Observation', 'Date'}),
+    ("What is heart rate of Adan632 Cassin499 on their most recent measurement?", {'Patient', 'Observation', 'Date'}),
+    ("How many patients are under the age of 30 by the end of 2021?", {'Patient', 'Date'}),
+    ("Which patients are allergic to peanuts?", {'Patient', 'AllergyIntolerance'}),
+    ("What vaccines did Bradford382 receive?", {'Patient', 'Immunization'}),
+    ("What city is Bradford382 from?", {'Patient'}),
+    ("What medications were prescribed for hypertension?", {'Medication', 'MedicationRequest', 'Condition'}),
+    ("Which devices are implanted in patient Aurelio227 Balistreri607?", {'Patient', 'Device'}),
+    ("What was the reason for Aurelio227 Balistreri607's visit in March 2019?", {'Patient', 'Encounter', 'Date'}),
+    ("Which payors cover the most claims?", {'ExplanationOfBenefit', 'Claim'}),
+    ("What is the address of the hospital?", {'Location', 'Organization'}),
+    ("What is the phone number of the organization that provided care?", {'Organization'}),
+    ("Which practitioners work at Good Samaritan hospital?", {'Practitioner', 'Location', 'Organization'}),
+    ("Show the clinical notes for Bradford382.", {'Patient', 'DocumentReference'}),
+    ("How many X-rays were taken last year?", {'ImagingStudy', 'Date'}),
+    ("What supplies were delivered in 2020?", {'SupplyDelivery', 'Date'}),
+    ("What exercise therapies are in the care plan of Adan632 Cassin499?", {'Patient', 'CarePlan'}),
+    ("Who is on the care team of Adan632 Cassin499?", {'Patient', 'CareTeam'}),
+    ("What does the latest diagnostic report for Arlette667 Kohler843 say?",
+     {'Patient', 'DiagnosticReport', 'Date'}),
+    ("What role does Dr. Smith have at the clinic?", {'Practitioner', 'PractionerRole', 'Location'}),
+    ("Patients with diabetes over 60", {'Patient', 'Condition'}),
+    ("Which medication may cause nausea?", {'Medication'}),
+]
+
+# Labelled questions never used to write the rules, so `--evaluate` can report accuracy
+# on unseen phrasing; adding a rule for one of these means moving it to EVALUATION_SET
+HELD_OUT_SET = [
+    ("List the allergies recorded for Maria45 Lopez12.", {'Patient', 'AllergyIntolerance'}),
+    ("How much was billed for the appendectomy?", {'Claim', 'Procedure'}),
+    ("Which clinics are located in Boston?", {'Location', 'Organization'}),
+    ("What was the blood pressure of Kenton95 Fay398 during the visit on 2019-04-02?",
+     {'Patient', 'Observation', 'Encounter', 'Date'}),
+    ("Which vaccines are given to children?", {'Immunization', 'Patient'}),
+    ("What medication was administered to Lena33 during the encounter?",
+     {'Patient', 'Medication', 'MedicationAdministration', 'Encounter'}),
+    ("Which doctors specialize in cardiology?", {'Practitioner', 'PractionerRole'}),
+    ("What imaging studies were done on the patient's chest?", {'Patient', 'ImagingStudy'}),
+    ("Show all clinical notes written in January 2022.", {'DocumentReference', 'Date'}),
+    ("What devices did Omar12 Reyes77 receive in 2018?", {'Patient', 'Device', 'Date'}),
+    ("What is the self-management plan for people with diabetes?", {'CarePlan', 'Patient', 'Condition'}),
+    ("Which drugs can cause drowsiness?", {'Medication'}),
+    ("How many people died of heart failure?", {'Patient', 'Condition'}),
+    ("Which organization delivered the oxygen equipment?", {'Organization', 'SupplyDelivery'}),
+    ("Which practitioner ordered metformin for Omar12 Reyes77?",
+     {'Patient', 'Practitioner', 'MedicationRequest', 'Medication'}),
+    ("What were the results of the lab panel for Kenton95 Fay398?", {'Patient', 'DiagnosticReport'}),
+]
+
+
+def evaluate(predict, questions=EVALUATION_SET):
+    """Exact-match accuracy, micro precision/recall and latency of `predict(question) -> answer`."""
+    latencies, exact, true_positive, predicted, expected = [], 0, 0, 0, 0
+    for question, labels in questions:
+        start = time.perf_counter()
+        answer = parse_labels(predict(question))
+        latencies.append((time.perf_counter() - start) * 1000)
+        exact += answer == labels
+        true_positive += len(answer & labels)
+        predicted += len(answer)
+        expected += len(labels)
+    latencies.sort()
+    return {
+        'questions': len(questions),
+        'exact_match': exact / len(questions),
+        'precision': true_positive / predicted if predicted else 0,
+        'recall': true_positive / expected if expected else 0,
+        'p50_ms': statistics.median(latencies),
+        'p99_ms': latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Pick the FHIR node types relevant to a question')
+    parser.add_argument('question', nargs='?', help='Question to classify')
+    parser.add_argument('--evaluate', action='store_true',
+                        help='Score the classifier on the built-in tuning and held-out question sets')
+    parser.add_argument('--llm', action='store_true', help='Also evaluate the LLM path for comparison')
+    parser.add_argument('--config', default='config.json', help='Path to config file')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    classifier = NodeClassifier()
+    print(f"Embedded {len(classifier.labels)} node type descriptions in {(time.perf_counter() - start) * 1000:.1f}ms")
+
+    if args.question:
+        labels, confident = classifier.classify(args.question)
+        print(f"{', '.join(labels)}{'' if confident else ' (unconfident, the LLM would be asked)'}")
+
+    if args.evaluate:
+        # The rules were written against EVALUATION_SET, so only the held-out score says how well they generalize
+        sets = {'tuning': EVALUATION_SET, 'held_out': HELD_OUT_SET}
+        print(json.dumps({'local': {name: {
+            **evaluate(classifier.relevant_nodes, questions),
+            'unconfident': sum(not classifier.classify(question)[1] for question, _ in questions)
+        } for name, questions in sets.items()}}, indent=2))
+        if args.llm:
+            from clients import get_llm
+            with open(args.config) as f:
+                llm = get_llm(json.load(f))
+            print(json.dumps({'llm': {name: evaluate(lambda question: llm_relevant_nodes(question, llm), questions)
+                                      for name, questions in sets.items()}}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
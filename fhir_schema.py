@@ -0,0 +1,166 @@
+import argparse
+import hashlib
+import json
+import threading
+import time
+from pathlib import Path
+
+from neo4j import GraphDatabase, READ_ACCESS
+
+
+DEFAULT_CACHE_PATH = 'fhir_schema.json'
+# How often describe() re-checks the graph version in a long-running process
+DEFAULT_REFRESH_SECONDS = 60
+# Vector properties are long and useless to the Cypher prompt
+HIDDEN_PROPERTIES = {'embedding', 'embedding_openai'}
+
+# Every part comes from the count store or the token tables, so this is cheap on any graph size
+GRAPH_VERSION_QUERY = """
+CALL { MATCH (n) RETURN count(n) AS nodes }
+CALL { MATCH ()-[r]->() RETURN count(r) AS relationships }
+CALL { CALL db.labels() YIELD label RETURN collect(label) AS labels }
+CALL { CALL db.relationshipTypes() YIELD relationshipType RETURN collect(relationshipType) AS types }
+RETURN nodes, relationships, labels, types
+"""
+
+
+def quote(name):
+    return '`' + name.replace('`', '``') + '`'
+
+
+def sample_query(labels):
+    """One query returning a single sample node's properties for every label."""
+    return "\nUNION ALL\n".join(
+        f"MATCH (n:{quote(label)}) RETURN {json.dumps(label)} AS label, properties(n) AS properties LIMIT 1"
+        for label in labels
+    )
+
+
+def format_label(label, properties, relationships):
+    """Describe a label the way the Cypher prompt expects: a sample node and its relationship types."""
+    info = label + ": " + str({'n': properties}).replace('{', '(').replace('}', ')')
+    return info + ' Relationship types: ' + str(relationships) + '\n'
+
+
+class FHIRSchema:
+    """
+    Per-label schema of the FHIR graph for the Cypher QA prompt.
+
+    The whole graph is introspected in two queries: one sample node per label and
+    the label/relationship-type pairs from `db.schema.visualization()`. The result
+    is kept in memory and in a JSON file stamped with a graph version (node and
+    relationship counts plus the label and type names). A later load reuses the
+    file while the version matches, so only the version query hits the database.
+    describe() re-runs that query once `refresh_seconds` have passed since the last
+    check (None checks only on first use) and rebuilds the schema if it changed.
+    Edits that keep every count unchanged aren't detected, use `refresh(force=True)`.
+    """
+
+    def __init__(self, driver, cache_path=DEFAULT_CACHE_PATH, refresh_seconds=DEFAULT_REFRESH_SECONDS):
+        self.driver = driver
+        self.cache_path = Path(cache_path) if cache_path else None
+        self.refresh_seconds = refresh_seconds
+        self.version = None
+        # time.monotonic() of the last graph version check
+        self.checked = None
+        self.labels = {}
+        self._lock = threading.Lock()
+
+    def graph_version(self):
+        records, _, _ = self.driver.execute_query(GRAPH_VERSION_QUERY, routing_=READ_ACCESS)
+        record = records[0]
+        payload = json.dumps([record['nodes'], record['relationships'],
+                              sorted(record['labels']), sorted(record['types'])])
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:16], sorted(record['labels'])
+
+    def _relationship_types(self):
+        records, _, _ = self.driver.execute_query("CALL db.schema.visualization()", routing_=READ_ACCESS)
+        relationships = {}
+        for record in records:
+            names = {node.element_id: node['name'] for node in record['nodes']}
+            for rel in record['relationships']:
+                for node in (rel.start_node, rel.end_node):
+                    relationships.setdefault(names[node.element_id], set()).add(rel.type)
+        return {label: sorted(types) for label, types in relationships.items()}
+
+    def introspect(self, labels):
+        samples = {}
+        if labels:
+            records, _, _ = self.driver.execute_query(sample_query(labels), routing_=READ_ACCESS)
+            # Through JSON and back so temporal values read the same whether fresh or from the file
+            samples = {record['label']: json.loads(json.dumps(
+                           {key: value for key, value in record['properties'].items() if key not in HIDDEN_PROPERTIES},
+                           default=str))
+                       for record in records}
+        relationships = self._relationship_types()
+        return {label: {'properties': samples[label], 'relationships': relationships.get(label, [])}
+                for label in labels if label in samples}
+
+    def _read_cache(self):
+        if self.cache_path is None or not self.cache_path.exists():
+            return None
+        with open(self.cache_path) as f:
+            return json.load(f)
+
+    def _write_cache(self):
+        if self.cache_path is None:
+            return
+        with open(self.cache_path, 'w') as f:
+            json.dump({'version': self.version, 'labels': self.labels}, f)
+
+    def refresh(self, force=False):
+        """Reload the schema from the file or, if the graph has changed since, from Neo4j."""
+        version, labels = self.graph_version()
+        self.checked = time.monotonic()
+        with self._lock:
+            if not force and version == self.version:
+                return self
+            cached = None if force else self._read_cache()
+            if cached is not None and cached.get('version') == version:
+                self.labels = cached['labels']
+                self.version = version
+            else:
+                self.labels = self.introspect(labels)
+                self.version = version
+                self._write_cache()
+        return self
+
+    def describe(self, node_labels):
+        """Prompt text for the given labels, labels that aren't in the graph are skipped."""
+        if self.version is None or (self.refresh_seconds is not None
+                                    and time.monotonic() - self.checked >= self.refresh_seconds):
+            self.refresh()
+        return ''.join(format_label(label, self.labels[label]['properties'], self.labels[label]['relationships'])
+                       for label in node_labels if label in self.labels)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Introspect and cache the FHIR graph schema')
+    parser.add_argument('labels', nargs='*', help='Labels to describe (all of them by default)')
+    parser.add_argument('--config', default='config.json', help='Path to config file')
+    parser.add_argument('--cache', default=DEFAULT_CACHE_PATH, help='Schema cache file')
+    parser.add_argument('--refresh', action='store_true', help='Introspect even if the cache is current')
+    args = parser.parse_args()
+
+    with open(args.config) as f:
+        config = json.load(f)
+    driver = GraphDatabase.driver(config['neo4j_uri'], auth=(config['neo4j_username'], config['neo4j_password']))
+
+    try:
+        schema = FHIRSchema(driver, args.cache)
+        start = time.perf_counter()
+        schema.refresh(force=args.refresh)
+        print(f"Loaded schema for {len(schema.labels)} labels in {time.perf_counter() - start:.3f}s "
+              f"(version {schema.version})")
+
+        labels = args.labels or sorted(schema.labels)
+        start = time.perf_counter()
+        description = schema.describe(labels)
+        print(f"Described {len(labels)} labels in {(time.perf_counter() - start) * 1e6:.0f}us\n")
+        print(description)
+    finally:
+        driver.close()
+
+
+if __name__ == "__main__":
+    main()
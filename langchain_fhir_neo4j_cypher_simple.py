@@ -8,6 +8,9 @@ from langchain_community.graphs import Neo4jGraph
 import json
 from neo4j import GraphDatabase
 
+from fhir_node_classifier import NodeClassifier
+from fhir_schema import DEFAULT_REFRESH_SECONDS, FHIRSchema
+
 with open('../config.json') as user_file:
     config = json.load(user_file)
 
@@ -28,73 +31,17 @@ def get_database_localhost():
 
     return graph
 
-def get_relationship_types(tx, node_label):
-    query = f"""
-    MATCH (n:{node_label})-[r]-()
-    RETURN DISTINCT type(r) AS relationship
-    """
-    result = tx.run(query)
-    return [record['relationship'] for record in result]
+# Cached in memory and on disk, re-checking the graph version every `fhir_schema_refresh_seconds` (see fhir_schema.py)
+schema = FHIRSchema(driver, refresh_seconds=config.get('fhir_schema_refresh_seconds', DEFAULT_REFRESH_SECONDS))
 
 def get_schema_for_node_types(node_labels):
-    all_info = ""
-    with driver.session() as session:
-        for label in node_labels:
-            query = f"""MATCH (n:{label})
-                WITH n
-                LIMIT 1 RETURN n"""
-            result = session.run(query)
-            results = [record.data() for record in result]
-            if 'embedding' in results[0]['n'].keys():
-                del results[0]['n']['embedding']
-            if 'embedding_openai' in results[0]['n'].keys():
-                del results[0]['n']['embedding_openai']
-            info = label+": "+str(results[0]).replace('{', '(').replace('}', ')')
-
-            relationships = str(session.read_transaction(get_relationship_types, label))
-
-            all_info = all_info + info + ' Relationship types: '+relationships+ '\n'
-    return all_info
+    return schema.describe(node_labels)
+
+# Picks node types locally, only asking the LLM when no keyword matches (see fhir_node_classifier.py)
+node_classifier = NodeClassifier()
 
 def determine_relevant_nodes(question):
-    template = """
-    Task: The user input will concern a question related to a graph database, which contains many node types. Your job is to determine what node types are relevant
-    to this particular user question. Your response should be a comma separated list of node types, if there are more than one, with no additional text.
-    
-    Here are the node types and when they are relevant:
-    AllergyIntolerance: questions related to allergies or their severity/causes
-    CarePlan: relevant for care plans, self management plans, or exercise therapies
-    CareTeam: relevant for people, practitioners, organizations, and health centers associated with care plans
-    Claim: related to billing, insurance, and pricing for procedures and encounters
-    Condition: relevant for conditions and diagnoses
-    Date: any question involving a date or time period should involve this node type
-    Device: relevant for medical devices
-    DiagnosticReport: relevant for diagnostic reports
-    DocumentReference: relevant for clinical notes
-    Encounter: related to specific patient visits and what a patient was there for
-    ExplanationOfBenefit: relevant for Medicaid and insurance payors
-    ImagingStudy: related to imaging, such as X-rays and radiology
-    Immunization: relevant for vaccines and innoculations
-    Location: relevant for addresses and locations of businesses or hospitals, but not relevant for patients
-    Medication: relevant for medications and dosages
-    MedicationAdministration: relevant for a specific instance of usage of medication
-    MedicationRequest: relevant for practitioner requests for medications for certain conditions
-    Observation: relevant for a particular measurement of a patient at a given time, such as vital signs or BMI
-    Organization: relevant for addresses, phone numbers, and other information for organizations, such as healthcare providers
-    Patient: relevant for questions relating to specific patients, including demographic info such as locations, DOBs, and other statuses
-    Practitioner: related to specific practictioners and their location, name, and contact info
-    PractionerRole: related to roles of practitioners at their given hospitals
-    Procedure: relevant for specific procedures and when they were performed
-    SupplyDelivery: relevant for the shipping of specific items and equipment
-    
-    Question: {question}"""
-
-    prompt = PromptTemplate.from_template(template)
-
-    llm_chain = prompt | llm
-
-    response = llm_chain.invoke({'question': question})
-    return response.content
+    return node_classifier.relevant_nodes(question, llm)
 
 
 if __name__ == '__main__':
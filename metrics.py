@@ -0,0 +1,179 @@
+import cProfile
+import math
+import os
+import threading
+import time
+from typing import Dict, Iterable, Optional, Sequence
+
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+ROW_BUCKETS = (0, 1, 5, 10, 20, 50, 100, 500, 1000)
+DEFAULT_PROFILE_DIR = 'profiles'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in list(zip(names, values)) + list(extra)]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} counter"
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            yield f"{self.name}{_labels(self.labelnames, key)} {_number(value)}"
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        # labels -> [per-bucket counts, sum]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            series = self._series.setdefault(key, [[0] * len(self.buckets), 0.0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += value
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            series = sorted((key, list(counts), total) for key, (counts, total) in self._series.items())
+        for key, counts, total in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                yield f"{self.name}_bucket{_labels(self.labelnames, key, [('le', _number(bound))])} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labelnames, key)} {_number(total)}"
+            yield f"{self.name}_count{_labels(self.labelnames, key)} {cumulative}"
+
+
+class Registry:
+    """
+    The metrics of one process, rendered in the Prometheus text format.
+
+    Each worker process keeps its own, so with several workers every one of them
+    has to be scraped (or the requests pinned) to see the whole picture.
+    """
+
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name, documentation, labelnames=()):
+        metric = Counter(name, documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return '\n'.join(line for metric in self._metrics for line in metric.render()) + '\n'
+
+
+REGISTRY = Registry()
+REQUEST_SECONDS = REGISTRY.histogram('pubmed_request_duration_seconds', 'Time to serve a request', ['endpoint'])
+STAGE_SECONDS = REGISTRY.histogram('pubmed_stage_duration_seconds', 'Time spent in each request stage', ['stage'])
+REQUEST_ERRORS = REGISTRY.counter('pubmed_request_errors_total', 'Requests that failed, by exception type',
+                                  ['endpoint', 'error'])
+LLM_TOKENS = REGISTRY.counter('pubmed_llm_tokens_total', 'LLM tokens used, by prompt or completion', ['kind'])
+VECTOR_SEARCH_SKIPPED = REGISTRY.counter('pubmed_vector_search_skipped_total',
+                                         'Searches answered by keyword alone, by reason', ['reason'])
+NEO4J_ROWS = REGISTRY.histogram('pubmed_neo4j_result_rows', 'Rows returned per Neo4j query', ['query'],
+                                buckets=ROW_BUCKETS)
+
+
+def record_timings(timings: Dict[str, float]):
+    """Observe a request's StageTimer timings (in ms) in the stage histogram."""
+    for stage, ms in timings.items():
+        STAGE_SECONDS.observe(ms / 1000, stage=stage)
+
+
+def server_timing(timings: Dict[str, float]) -> str:
+    """Format StageTimer timings as a Server-Timing header value."""
+    return ', '.join(f"{stage};dur={ms}" for stage, ms in timings.items())
+
+
+def record_llm_usage(message):
+    """Count the prompt and completion tokens reported on an LLM response or stream chunk, if any."""
+    usage = getattr(message, 'usage_metadata', None)
+    if usage:
+        LLM_TOKENS.inc(usage.get('input_tokens', 0), kind='prompt')
+        LLM_TOKENS.inc(usage.get('output_tokens', 0), kind='completion')
+        return
+    usage = (getattr(message, 'response_metadata', None) or {}).get('token_usage')
+    if usage:
+        LLM_TOKENS.inc(usage.get('prompt_tokens', 0), kind='prompt')
+        LLM_TOKENS.inc(usage.get('completion_tokens', 0), kind='completion')
+
+
+class SlowRequestProfiler:
+    """
+    cProfile one request, keeping the profile only if it took at least `threshold_ms`.
+
+    Only the thread that started it is profiled, so work handed to the retrieval pool
+    shows up as waiting. Profiles are written to `directory` as .prof files for pstats
+    or snakeviz.
+    """
+
+    def __init__(self, threshold_ms: float, directory: str = DEFAULT_PROFILE_DIR):
+        self.threshold_ms = threshold_ms
+        self.directory = directory
+        self._profiler = cProfile.Profile()
+        self._start = time.perf_counter()
+        try:
+            self._profiler.enable()
+        except ValueError:
+            # Another request is already being profiled and the interpreter allows only one profiler
+            self._profiler = None
+
+    def finish(self, name: str) -> Optional[str]:
+        """Stop profiling and return the path of the dump, if the request was slow enough to keep."""
+        if self._profiler is None:
+            return None
+        self._profiler.disable()
+        elapsed_ms = (time.perf_counter() - self._start) * 1000
+        if elapsed_ms < self.threshold_ms:
+            return None
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"{time.strftime('%Y%m%d-%H%M%S')}-{name}-{elapsed_ms:.0f}ms.prof")
+        self._profiler.dump_stats(path)
+        return path
@@ -1,19 +1,223 @@
-from lxml import etree
-
-# Parse the XML file
-with open('pubmed24n0001.xml', 'rb') as f:
-    tree = etree.parse(f)
-
-# Get the root element
-root = tree.getroot()
-
-# Example: iterate through PubMed articles
-for article in root.xpath('//PubmedArticle'):
-    title = article.xpath('.//ArticleTitle')[0].text
-    pmid = article.xpath('.//PMID')[0].text
-    print(f"Title: {title}, PMID: {pmid}")
-    authors = article.xpath('.//AuthorList/Author')
-    for author in authors:
-        last_name = author.xpath('.//LastName')[0].text
-        first_name = author.xpath('.//ForeName')[0].text
-        print(f"Author: {first_name} {last_name}, Article PMID: {pmid}")
+import argparse
+import csv
+import gzip
+import os
+import shlex
+import time
+from array import array
+
+from create_neo4j import (DEFAULT_CHUNK_SIZE, PROGRESS_INTERVAL, extract_article, extract_citations,
+                          parse_in_pool, resolve_inputs)
+
+
+DEFAULT_OUTPUT_DIR = 'import'
+DEFAULT_DATABASE = 'neo4j'
+
+# file stem -> header, in the neo4j-admin import format. Author and Keyword ids only link the
+# files together (no property name, so they aren't stored); pmid is both the id and a property.
+HEADERS = {
+    'articles': ['pmid:ID(Article)', 'title', 'abstract', 'source_file'],
+    'authors': [':ID(Author)', 'first_name', 'last_name'],
+    'keywords': [':ID(Keyword)', 'name'],
+    'authored': [':START_ID(Author)', ':END_ID(Article)'],
+    'has_keyword': [':START_ID(Article)', ':END_ID(Keyword)'],
+    'cites': [':START_ID(Article)', ':END_ID(Article)'],
+}
+NODES = {'Article': 'articles', 'Author': 'authors', 'Keyword': 'keywords'}
+RELATIONSHIPS = {'AUTHORED': 'authored', 'HAS_KEYWORD': 'has_keyword', 'CITES': 'cites'}
+# file stem -> column holding the Article pmid, for the rows a pmid's older versions wrote
+PMID_COLUMNS = {'articles': 0, 'authored': 1, 'has_keyword': 0, 'cites': 0}
+
+
+def extract_record(article):
+    """The extract_article row of a PubmedArticle element plus the pmids it cites."""
+    record = extract_article(article)
+    record['cited'] = list(dict.fromkeys(extract_citations(article)[1]))
+    return [record]
+
+
+class BulkImportWriter:
+    """
+    Streams extract_record rows into node and relationship CSVs for `neo4j-admin database import`.
+
+    Authors (by first and last name) and Keywords (by name) are deduplicated in hash maps as
+    they are first seen, the same keys the transactional ingest MERGEs on, so each one gets a
+    single node. Citations of articles outside the import are left for neo4j-admin to skip (see
+    import_command).
+
+    A pmid can appear more than once when PubMed revises a citation; the version from the latest
+    file (in `files` order, and the latest within a file) is kept. Files are parsed in parallel, so
+    an older version is skipped if it arrives after a newer one, and otherwise its rows are counted
+    and dropped from the CSVs by close(). Authors and Keywords only the older version named are
+    left as unconnected nodes.
+    """
+
+    def __init__(self, directory=DEFAULT_OUTPUT_DIR, compress=False):
+        self.directory = directory
+        self.compress = compress
+        os.makedirs(directory, exist_ok=True)
+        self.paths = {stem: os.path.join(directory, f"{stem}.csv.gz" if compress else f"{stem}.csv")
+                      for stem in HEADERS}
+        self._files = {}
+        self._writers = {}
+        for stem, header in HEADERS.items():
+            f = self._open(self.paths[stem], 'w')
+            self._files[stem] = f
+            self._writers[stem] = csv.writer(f)
+            self._writers[stem].writerow(header)
+        self.authors = {}
+        self.keywords = {}
+        self.counts = dict.fromkeys(HEADERS, 0)
+        # pmid -> 1 + index of the file whose version was written (0 when not seen yet), compact
+        # enough for every pmid in the baseline
+        self._versions = array('H')
+        # pmid written more than once -> {file stem: rows of the newest version}
+        self._repeated = {}
+
+    def _open(self, path, mode):
+        return gzip.open(path, mode + 't', newline='', encoding='utf-8') if self.compress \
+            else open(path, mode, newline='', encoding='utf-8')
+
+    def _write(self, stem, row):
+        self._writers[stem].writerow(row)
+        self.counts[stem] += 1
+
+    def add(self, record, file_index=0):
+        """Write a record from the `file_index`th input file, unless a newer version of its pmid was."""
+        pmid = record['pmid']
+        position = int(pmid)
+        if position >= len(self._versions):
+            self._versions.extend(bytes(self._versions.itemsize * (position + 1 - len(self._versions))))
+        written = self._versions[position]
+        if file_index + 1 < written:
+            return
+        if written:
+            # The older version's rows come before these and are dropped by close()
+            self._repeated[pmid] = {'articles': 1, 'authored': len(record['authors']),
+                                    'has_keyword': len(record['keywords']), 'cites': len(record['cited'])}
+        self._versions[position] = file_index + 1
+        self._write('articles', (pmid, record['title'], record['abstract'], record.get('source_file')))
+
+        for author in record['authors']:
+            key = (author['first_name'], author['last_name'])
+            author_id = self.authors.get(key)
+            if author_id is None:
+                author_id = self.authors[key] = len(self.authors)
+                self._write('authors', (author_id, *key))
+            self._write('authored', (author_id, pmid))
+
+        for keyword in record['keywords']:
+            keyword_id = self.keywords.get(keyword)
+            if keyword_id is None:
+                keyword_id = self.keywords[keyword] = len(self.keywords)
+                self._write('keywords', (keyword_id, keyword))
+            self._write('has_keyword', (pmid, keyword_id))
+
+        for cited_pmid in record['cited']:
+            self._write('cites', (pmid, cited_pmid))
+
+    def close(self):
+        for f in self._files.values():
+            f.close()
+        if self._repeated:
+            self._drop_older_versions()
+
+    def _drop_older_versions(self):
+        """Rewrite the files with Article rows, keeping only the newest version's rows of each repeated pmid."""
+        print(f"Dropping the older versions of {len(self._repeated)} repeated pmids")
+        for stem, column in PMID_COLUMNS.items():
+            path = self.paths[stem]
+            # The newest version's rows are the last ones, so count them all first
+            with self._open(path, 'r') as f:
+                reader = csv.reader(f)
+                next(reader)
+                written = {}
+                for row in reader:
+                    if row[column] in self._repeated:
+                        written[row[column]] = written.get(row[column], 0) + 1
+            older = {pmid: count - self._repeated[pmid][stem] for pmid, count in written.items()}
+
+            with self._open(path, 'r') as f, self._open(path + '.tmp', 'w') as out:
+                reader = csv.reader(f)
+                writer = csv.writer(out)
+                writer.writerow(next(reader))
+                for row in reader:
+                    pmid = row[column]
+                    if older.get(pmid, 0) > 0:
+                        older[pmid] -= 1
+                        self.counts[stem] -= 1
+                        continue
+                    writer.writerow(row)
+            os.replace(path + '.tmp', path)
+
+    def import_command(self, database=DEFAULT_DATABASE):
+        """The neo4j-admin command loading these files into a new (empty) database."""
+        args = ['neo4j-admin', 'database', 'import', 'full', database, '--overwrite-destination',
+                '--skip-duplicate-nodes', '--skip-bad-relationships']
+        args += [f"--nodes={label}={self.paths[stem]}" for label, stem in NODES.items()]
+        args += [f"--relationships={rel_type}={self.paths[stem]}" for rel_type, stem in RELATIONSHIPS.items()]
+        return ' '.join(shlex.quote(arg) for arg in args)
+
+
+def convert(files, writer, workers=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Parse `files` in parallel and stream every article into `writer`, returning the files that failed."""
+    start = last_report = time.perf_counter()
+    # Later files hold the newer version of a repeated pmid
+    file_indexes = {file_path: index for index, file_path in enumerate(files)}
+    finished = articles = 0
+    failed = []
+    for kind, file_path, payload in parse_in_pool(files, extract_record, workers, chunk_size):
+        if kind == 'rows':
+            # Stored like the transactional ingest does, so later runs of it keep the newest version too
+            source_file = os.path.basename(file_path)
+            for record in payload:
+                record['source_file'] = source_file
+                writer.add(record, file_indexes[file_path])
+            articles += len(payload)
+        elif kind == 'done':
+            finished += 1
+        elif kind == 'error':
+            print(f"Could not parse {file_path}: {payload}")
+            finished += 1
+            failed.append(file_path)
+
+        now = time.perf_counter()
+        if now - last_report >= PROGRESS_INTERVAL or finished == len(files):
+            last_report = now
+            print(f"{finished}/{len(files)} files, {articles} articles, {len(writer.authors)} authors, "
+                  f"{len(writer.keywords)} keywords ({articles / (now - start):.0f} articles/sec)")
+    return sorted(failed)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Convert PubMed baseline XML into CSVs for neo4j-admin database import')
+    parser.add_argument('paths', nargs='*', default=['pubmed24n0001.xml'],
+                        help='PubMed baseline .xml/.xml.gz files, directories of them, or glob patterns')
+    parser.add_argument('--output-dir', default=DEFAULT_OUTPUT_DIR, help='Where the CSVs are written')
+    parser.add_argument('--gzip', action='store_true', help='Write .csv.gz files (neo4j-admin reads them as is)')
+    parser.add_argument('--workers', type=int, help='Parse processes (default one per CPU)')
+    parser.add_argument('--database', default=DEFAULT_DATABASE, help='Database named in the printed import command')
+    args = parser.parse_args()
+
+    files = resolve_inputs(args.paths)
+    if not files:
+        parser.error('No .xml or .xml.gz files found')
+
+    writer = BulkImportWriter(args.output_dir, args.gzip)
+    try:
+        failed = convert(files, writer, args.workers)
+    finally:
+        writer.close()
+
+    print(', '.join(f"{count} {stem}" for stem, count in writer.counts.items()))
+    if failed:
+        print(f"{len(failed)} files could not be parsed and are missing from the CSVs: "
+              f"{', '.join(os.path.basename(f) for f in failed)}")
+    print(f"Stop Neo4j, then load the CSVs into a new database with:\n  {writer.import_command(args.database)}\n"
+          f"and once it's started, create the indexes and citation counts with:\n"
+          f"  python create_neo4j.py --after-bulk-import")
+
+
+if __name__ == "__main__":
+    main()
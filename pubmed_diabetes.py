@@ -0,0 +1,212 @@
+import argparse
+import time
+from pathlib import Path
+from typing import List, Tuple
+
+import numpy as np
+from scipy import sparse
+
+
+DEFAULT_DATA_DIR = 'pubmed-diabetes/data'
+NODE_FILE = 'Pubmed-Diabetes.NODE.paper.tab'
+CITES_FILE = 'Pubmed-Diabetes.DIRECTED.cites.tab'
+DEFAULT_CACHE_DIR = 'pubmed-diabetes/cache'
+CACHE_ARRAYS = ['data', 'indices', 'indptr', 'shape', 'pmids', 'labels', 'vocab']
+DEFAULT_BLOCK_SIZE = 2048
+
+
+def parse_node_file(path: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray, sparse.csr_matrix]:
+    """
+    Parse a `NODE paper` feature file into (pmids, labels, vocab, tfidf).
+
+    The second header line lists the features as `numeric:<word>:0.0`; every paper row
+    is `<pmid> label=<n> <word>=<weight> ... summary=...`, with only non-zero words listed.
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        f.readline()
+        vocab = [field.split(':')[1] for field in f.readline().rstrip('\n').split('\t')
+                 if field.startswith('numeric:')]
+        columns = {word: i for i, word in enumerate(vocab)}
+
+        pmids, labels, data, indices, indptr = [], [], [], [], [0]
+        for line in f:
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) < 2:
+                continue
+            pmids.append(fields[0])
+            for field in fields[1:]:
+                name, _, value = field.partition('=')
+                if name == 'label':
+                    labels.append(int(value))
+                elif name in columns:
+                    indices.append(columns[name])
+                    data.append(float(value))
+            indptr.append(len(indices))
+
+    matrix = sparse.csr_matrix((np.array(data, dtype=np.float32), np.array(indices, dtype=np.int32),
+                                np.array(indptr, dtype=np.int64)), shape=(len(pmids), len(vocab)))
+    matrix.sort_indices()
+    return np.array(pmids), np.array(labels, dtype=np.int8), np.array(vocab), matrix
+
+
+def iter_citations(path: str):
+    """Yield (citing_pmid, cited_pmid) from a `DIRECTED cites` file (`<id> paper:<citing> | paper:<cited>`)."""
+    with open(path, 'r', encoding='utf-8') as f:
+        f.readline()
+        f.readline()
+        for line in f:
+            fields = line.split()
+            if len(fields) == 4:
+                yield fields[1].split(':', 1)[1], fields[3].split(':', 1)[1]
+
+
+def save_cache(cache_dir: str, pmids, labels, vocab, matrix: sparse.csr_matrix):
+    """Write the matrix parts as plain .npy files, which np.load can memory-map."""
+    path = Path(cache_dir)
+    path.mkdir(parents=True, exist_ok=True)
+    arrays = {'data': matrix.data, 'indices': matrix.indices, 'indptr': matrix.indptr,
+              'shape': np.array(matrix.shape), 'pmids': pmids, 'labels': labels, 'vocab': vocab}
+    for name, array in arrays.items():
+        np.save(path / f"{name}.npy", array)
+
+
+def load_cache(cache_dir: str, mmap: bool = True):
+    """Load (pmids, labels, vocab, tfidf) from a cache written by save_cache."""
+    path = Path(cache_dir)
+    arrays = {name: np.load(path / f"{name}.npy", mmap_mode='r' if mmap else None)
+              for name in CACHE_ARRAYS}
+    matrix = sparse.csr_matrix((arrays['data'], arrays['indices'], arrays['indptr']),
+                               shape=tuple(int(n) for n in arrays['shape']))
+    return np.asarray(arrays['pmids']), arrays['labels'], np.asarray(arrays['vocab']), matrix
+
+
+def load_features(data_dir: str = DEFAULT_DATA_DIR, cache_dir: str = DEFAULT_CACHE_DIR):
+    """Load the TF-IDF features, parsing the node file only when the cache is missing or older."""
+    node_path = Path(data_dir) / NODE_FILE
+    marker = Path(cache_dir) / 'data.npy'
+    if not marker.exists() or (node_path.exists() and node_path.stat().st_mtime > marker.stat().st_mtime):
+        save_cache(cache_dir, *parse_node_file(str(node_path)))
+    return load_cache(cache_dir)
+
+
+def l2_normalize(matrix: sparse.csr_matrix) -> sparse.csr_matrix:
+    """Scale every row to unit length so dot products are cosine similarities."""
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    norms[norms == 0] = 1
+    return sparse.diags(1 / norms).astype(np.float32) @ matrix
+
+
+def _top_k(scores: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Row-wise indices and values of the k highest scores, best first."""
+    k = min(k, scores.shape[1])
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    top_scores = np.take_along_axis(scores, top, axis=1)
+    order = np.argsort(-top_scores, axis=1)
+    return np.take_along_axis(top, order, axis=1), np.take_along_axis(top_scores, order, axis=1)
+
+
+class RelatedPapers:
+    """
+    Cosine "related papers" lookups over the TF-IDF vectors.
+
+    Rows are L2-normalized once and the transpose is also kept densely (papers x 500
+    float32, ~40MB for the full dataset), so scoring one paper is a product of its few
+    non-zero weights with the matching rows. If a neighbour table from `all_top_k` has
+    been saved next to the cache, lookups within its k are served from it instead.
+    """
+
+    def __init__(self, pmids, matrix: sparse.csr_matrix, neighbours=None, neighbour_scores=None):
+        self.pmids = np.asarray(pmids)
+        self.position = {pmid: i for i, pmid in enumerate(self.pmids.tolist())}
+        self.normalized = l2_normalize(sparse.csr_matrix(matrix, dtype=np.float32))
+        self.by_word = np.ascontiguousarray(self.normalized.T.toarray())
+        self.neighbours = neighbours
+        self.neighbour_scores = neighbour_scores
+
+    @classmethod
+    def load(cls, data_dir: str = DEFAULT_DATA_DIR, cache_dir: str = DEFAULT_CACHE_DIR) -> 'RelatedPapers':
+        pmids, _, _, matrix = load_features(data_dir, cache_dir)
+        path = Path(cache_dir)
+        neighbours = neighbour_scores = None
+        if (path / 'neighbours.npy').exists():
+            neighbours = np.load(path / 'neighbours.npy', mmap_mode='r')
+            neighbour_scores = np.load(path / 'neighbour_scores.npy', mmap_mode='r')
+        return cls(pmids, matrix, neighbours, neighbour_scores)
+
+    def __contains__(self, pmid):
+        return str(pmid) in self.position
+
+    def scores(self, row: int) -> np.ndarray:
+        """Cosine similarity of the paper at `row` to every paper."""
+        start, stop = self.normalized.indptr[row], self.normalized.indptr[row + 1]
+        return self.normalized.data[start:stop] @ self.by_word[self.normalized.indices[start:stop]]
+
+    def related(self, pmid: str, k: int = 10) -> List[Tuple[str, float]]:
+        """The k papers most similar to `pmid` as (pmid, cosine) pairs, excluding itself."""
+        if k < 1:
+            raise ValueError(f"k must be at least 1, got {k}")
+        row = self.position[str(pmid)]
+        if self.neighbours is not None and k <= self.neighbours.shape[1]:
+            top, top_scores = self.neighbours[row, :k], self.neighbour_scores[row, :k]
+        else:
+            scores = self.scores(row)
+            scores[row] = -np.inf
+            top, top_scores = (result[0] for result in _top_k(scores[None, :], k))
+        return [(str(self.pmids[i]), float(s)) for i, s in zip(top, top_scores) if s > 0]
+
+    def all_top_k(self, k: int = 10, block_size: int = DEFAULT_BLOCK_SIZE) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Top-k neighbours of every paper, scored `block_size` rows at a time.
+
+        Returns (indices, scores) arrays of shape (papers, k); indices are row positions
+        into `pmids`.
+        """
+        n = self.normalized.shape[0]
+        k = min(k, n - 1)
+        indices = np.empty((n, k), dtype=np.int64)
+        scores = np.empty((n, k), dtype=np.float32)
+        for start in range(0, n, block_size):
+            stop = min(start + block_size, n)
+            block = self.normalized[start:stop].toarray() @ self.by_word
+            block[np.arange(stop - start), np.arange(start, stop)] = -np.inf
+            indices[start:stop], scores[start:stop] = _top_k(block, k)
+        return indices, scores
+
+    def save_neighbours(self, cache_dir: str = DEFAULT_CACHE_DIR, k: int = 10):
+        """Compute the all-pairs top-k table and save it for `load` to pick up."""
+        self.neighbours, self.neighbour_scores = self.all_top_k(k)
+        np.save(Path(cache_dir) / 'neighbours.npy', self.neighbours)
+        np.save(Path(cache_dir) / 'neighbour_scores.npy', self.neighbour_scores)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build the Pubmed-Diabetes feature cache and query related papers')
+    parser.add_argument('pmid', nargs='?', help='Show the papers related to this PMID')
+    parser.add_argument('--data-dir', default=DEFAULT_DATA_DIR)
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR)
+    parser.add_argument('-k', type=int, default=10)
+    parser.add_argument('--precompute', type=int, metavar='K',
+                        help='Compute and save the top-K related papers of every paper')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    papers = RelatedPapers.load(args.data_dir, args.cache_dir)
+    print(f"Loaded {len(papers.pmids)} papers in {time.perf_counter() - start:.2f}s")
+
+    if args.precompute:
+        start = time.perf_counter()
+        papers.save_neighbours(args.cache_dir, args.precompute)
+        print(f"Saved top-{args.precompute} neighbours in {time.perf_counter() - start:.2f}s")
+
+    if args.pmid:
+        if args.k < 1:
+            parser.error('-k must be at least 1')
+        start = time.perf_counter()
+        related = papers.related(args.pmid, args.k)
+        print(f"Scored in {(time.perf_counter() - start) * 1000:.2f}ms")
+        for pmid, score in related:
+            print(f"{pmid}\t{score:.4f}")
+
+
+if __name__ == "__main__":
+    main()
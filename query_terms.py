@@ -0,0 +1,89 @@
+import argparse
+import re
+import time
+
+
+# NLTK's English stopword list, minus the contractions the tokenizer can never produce
+STOP_WORDS = frozenset("""
+i me my myself we our ours ourselves you your yours yourself yourselves he him his himself she her hers herself
+it its itself they them their theirs themselves what which who whom this that these those am is are was were be
+been being have has had having do does did doing a an the and but if or because as until while of at by for with
+about against between into through during before after above below to from up down in out on off over under
+again further then once here there when where why how all any both each few more most other some such no nor not
+only own same so than too very s t can will just don should now d ll m o re ve y ain aren couldn didn doesn hadn
+hasn haven isn ma mightn mustn needn shan shouldn wasn weren won wouldn
+""".split())
+
+# Multi-word biomedical terms kept whole, so they can be searched as phrases
+BIOMEDICAL_PHRASES = (
+    'type 1 diabetes', 'type 2 diabetes', 'gestational diabetes', 'diabetes mellitus', 'diabetic retinopathy',
+    'diabetic nephropathy', 'diabetic neuropathy', 'insulin resistance', 'blood glucose', 'blood pressure',
+    'heart failure', 'heart attack', 'myocardial infarction', 'coronary artery disease', 'chronic kidney disease',
+    'non-small cell', 'small cell', 'breast cancer', 'prostate cancer', 'lung cancer', 'colorectal cancer',
+    'multiple sclerosis', 'alzheimer disease', 'parkinson disease', 'body mass index', 'clinical trial',
+    'randomized controlled trial', 'machine learning', 'deep learning', 'natural language processing',
+)
+
+# Runs of letters and digits, the same tokens NLTK's isalnum() filter would keep
+TOKEN_PATTERN = re.compile(r"[^\W_]+")
+MIN_TERM_LENGTH = 4
+
+
+def compile_phrases(phrases):
+    """One alternation matching any phrase, with spaces or hyphens between its words, longest first."""
+    alternatives = sorted(phrases, key=len, reverse=True)
+    return re.compile(r"(?<!\w)(?:" + "|".join(
+        r"[\s-]+".join(re.escape(word) for word in re.split(r"[\s-]+", phrase)) for phrase in alternatives
+    ) + r")(?!\w)")
+
+
+PHRASE_PATTERN = compile_phrases(BIOMEDICAL_PHRASES)
+
+
+def extract_terms(question, phrases=False):
+    """
+    Extract search terms from the question: lowercase alphanumeric tokens longer than
+    three characters that aren't stopwords. With `phrases`, known biomedical phrases
+    are kept as single terms (e.g. "type 2 diabetes") in place of their words.
+    """
+    text = question.lower()
+    terms = []
+    if phrases:
+        position = 0
+        for match in PHRASE_PATTERN.finditer(text):
+            terms.extend(_words(text[position:match.start()]))
+            terms.append(re.sub(r"[\s-]+", " ", match.group()))
+            position = match.end()
+        terms.extend(_words(text[position:]))
+        return terms
+    return _words(text)
+
+
+def _words(text):
+    return [word for word in TOKEN_PATTERN.findall(text)
+            if len(word) >= MIN_TERM_LENGTH and word not in STOP_WORDS]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Extract search terms from questions and time it')
+    parser.add_argument('questions', nargs='*', default=[
+        "What are the latest treatments for type 2 diabetes in elderly patients?",
+        "How does insulin resistance relate to non-small cell lung cancer outcomes?",
+    ])
+    parser.add_argument('--phrases', action='store_true', help='Keep biomedical phrases as single terms')
+    parser.add_argument('--repeat', type=int, default=10000, help='Timed extractions per question')
+    args = parser.parse_args()
+
+    for question in args.questions:
+        print(f"{question}\n  {extract_terms(question, args.phrases)}")
+
+    start = time.perf_counter()
+    for _ in range(args.repeat):
+        for question in args.questions:
+            extract_terms(question, args.phrases)
+    elapsed = time.perf_counter() - start
+    print(f"{elapsed / (args.repeat * len(args.questions)) * 1e6:.1f}us per question")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+import heapq
+import math
+import time
+from contextlib import contextmanager
+
+
+# Rank offset in reciprocal-rank fusion, damps the gap between the first few ranks
+RRF_K = 60
+DEFAULT_FUSION_WEIGHTS = {
+    'keyword': 1.0,
+    'vector': 1.0,
+    'prior': 0.5,
+}
+DEFAULT_CANDIDATES = 20
+# Threads running the keyword and vector stages, two per request in flight
+DEFAULT_WORKERS = 8
+
+
+class StageTimer:
+    """Collects wall-clock milliseconds per named retrieval stage."""
+
+    def __init__(self):
+        self.timings = {}
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = round((time.perf_counter() - start) * 1000, 2)
+
+
+def fusion_weights(config):
+    """Fusion weights from the config's `fusion_weights`, falling back to the defaults."""
+    return {**DEFAULT_FUSION_WEIGHTS, **config.get('fusion_weights', {})}
+
+
+def paper_priors(papers):
+    """
+    Query-independent importance of each paper in [0, 1].
+
+    Uses the precomputed citation centrality where there is one, otherwise the
+    citation count on a log scale relative to the most cited candidate.
+    """
+    max_citations = max((paper.get('citation_count') or 0 for paper in papers), default=0)
+    priors = {}
+    for paper in papers:
+        if paper.get('centrality') is not None:
+            priors[paper['pmid']] = paper['centrality']
+        elif max_citations:
+            priors[paper['pmid']] = math.log1p(paper.get('citation_count') or 0) / math.log1p(max_citations)
+        else:
+            priors[paper['pmid']] = 0.0
+    return priors
+
+
+def fuse(rankings, weights, k=5):
+    """
+    Merge ranked candidate lists with weighted reciprocal-rank fusion plus a prior.
+
+    `rankings` maps a source name to its papers, best first. A paper scores
+    weight / (RRF_K + rank) for every source it appears in, plus
+    weights['prior'] * prior / (RRF_K + 1), so a prior weight of 1 is worth a
+    first place in one source. Returns the k best papers, each with a
+    `fused_score` and its per-source `ranks`.
+    """
+    papers, ranks = {}, {}
+    for source, results in rankings.items():
+        for rank, paper in enumerate(results, 1):
+            papers.setdefault(paper['pmid'], paper)
+            ranks.setdefault(paper['pmid'], {})[source] = rank
+
+    priors = paper_priors(papers.values())
+    scored = []
+    for pmid, paper_ranks in ranks.items():
+        score = sum(weights.get(source, 0) / (RRF_K + rank) for source, rank in paper_ranks.items())
+        score += weights.get('prior', 0) * priors[pmid] / (RRF_K + 1)
+        scored.append((score, pmid))
+
+    return [{**papers[pmid], 'fused_score': score, 'ranks': ranks[pmid]}
+            for score, pmid in heapq.nlargest(k, scored)]
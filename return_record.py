@@ -1,11 +1,45 @@
-from neo4j import GraphDatabase
+from neo4j import GraphDatabase, READ_ACCESS
 import argparse
 import json
+import sys
 from tabulate import tabulate
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterable, Iterator, Optional, Tuple
 import textwrap
 
 
+DEFAULT_CHUNK_SIZE = 1000
+
+# One row per PMID that exists; the per-article expansions run as subqueries so the
+# author and keyword collections don't multiply each other
+ARTICLES_BY_PMID_QUERY = """
+    UNWIND $pmids AS pmid
+    MATCH (a:Article {pmid: pmid})
+    CALL {
+        WITH a
+        OPTIONAL MATCH (auth:Author)-[:AUTHORED]->(a)
+        RETURN collect(DISTINCT auth.first_name + ' ' + auth.last_name) as authors
+    }
+    CALL {
+        WITH a
+        OPTIONAL MATCH (a)-[:HAS_KEYWORD]->(k:Keyword)
+        RETURN collect(DISTINCT k.name) as keywords
+    }
+    RETURN
+        a.title as title,
+        a.pmid as pmid,
+        a.abstract as abstract,
+        authors,
+        keywords
+    """
+
+
+def read_pmids(source) -> Iterator[str]:
+    """Yield PMIDs from a file-like object, one per line or separated by whitespace/commas."""
+    for line in source:
+        for pmid in line.replace(',', ' ').split():
+            yield pmid
+
+
 class PubMedVerifier:
     def __init__(self, uri: str, user: str, password: str):
         self.driver = GraphDatabase.driver(uri, auth=(user, password))
@@ -37,13 +71,46 @@ class PubMedVerifier:
                 }
             return None
 
-    def get_multiple_articles(self, pmids: List[str]) -> List[Dict[str, Any]]:
-        results = []
+    def iter_articles(self, pmids: Iterable[str],
+                      chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[Tuple[str, Optional[Dict[str, Any]]]]:
+        """
+        Yield (pmid, article) for every input PMID in input order, with None for PMIDs
+        that aren't in the database.
+
+        PMIDs are looked up `chunk_size` at a time with one UNWIND query per chunk, all
+        over a single session, so only one chunk of articles is held in memory.
+        """
+        with self.driver.session(default_access_mode=READ_ACCESS) as session:
+            chunk = []
+            for pmid in pmids:
+                chunk.append(str(pmid))
+                if len(chunk) >= chunk_size:
+                    yield from self._lookup_chunk(session, chunk)
+                    chunk = []
+            if chunk:
+                yield from self._lookup_chunk(session, chunk)
+
+    @staticmethod
+    def _lookup_chunk(session, pmids: List[str]) -> Iterator[Tuple[str, Optional[Dict[str, Any]]]]:
+        found = {}
+        for record in session.run(ARTICLES_BY_PMID_QUERY, pmids=list(dict.fromkeys(pmids))):
+            found[record['pmid']] = record.data()
         for pmid in pmids:
-            article = self.get_article_by_pmid(pmid)
+            yield pmid, found.get(pmid)
+
+    def get_articles(self, pmids: Iterable[str],
+                     chunk_size: int = DEFAULT_CHUNK_SIZE) -> Tuple[List[Dict[str, Any]], List[str]]:
+        """Look up PMIDs in bulk, returning the found articles in input order and the missing PMIDs."""
+        articles, missing = [], []
+        for pmid, article in self.iter_articles(pmids, chunk_size):
             if article:
-                results.append(article)
-        return results
+                articles.append(article)
+            else:
+                missing.append(pmid)
+        return articles, missing
+
+    def get_multiple_articles(self, pmids: List[str]) -> List[Dict[str, Any]]:
+        return self.get_articles(pmids)[0]
 
     def print_article_details(self, article: Dict[str, Any], detailed: bool = False):
         if not article:
@@ -95,12 +162,17 @@ class PubMedVerifier:
 
 def main():
     parser = argparse.ArgumentParser(description='Verify PubMed records in Neo4j database')
-    parser.add_argument('pmids', nargs='+', help='One or more PMIDs to look up')
+    parser.add_argument('pmids', nargs='*', help='One or more PMIDs to look up')
+    parser.add_argument('--file', help='Read PMIDs from this file, or - for stdin')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                        help='Number of PMIDs looked up per query')
     parser.add_argument('--config', default='config.json', help='Path to config file')
     parser.add_argument('--detailed', action='store_true', help='Show detailed output including abstracts')
     parser.add_argument('--compare', action='store_true', help='Compare multiple PMIDs')
 
     args = parser.parse_args()
+    if not args.pmids and not args.file:
+        parser.error('provide PMIDs as arguments or with --file')
 
     # Load configuration
     try:
@@ -121,13 +193,27 @@ def main():
     )
 
     try:
-        if args.compare and len(args.pmids) > 1:
-            verifier.compare_articles(args.pmids)
+        if args.file:
+            source = sys.stdin if args.file == '-' else open(args.file)
+            try:
+                pmids = [*args.pmids, *read_pmids(source)]
+            finally:
+                if source is not sys.stdin:
+                    source.close()
+        else:
+            pmids = args.pmids
+
+        if args.compare and len(pmids) > 1:
+            verifier.compare_articles(pmids)
         else:
-            for pmid in args.pmids:
-                article = verifier.get_article_by_pmid(pmid)
+            missing = []
+            for pmid, article in verifier.iter_articles(pmids, chunk_size=args.chunk_size):
                 print(f"\nArticle Details for PMID: {pmid}")
                 verifier.print_article_details(article, detailed=args.detailed)
+                if not article:
+                    missing.append(pmid)
+            if missing:
+                print(f"\n{len(missing)} of {len(pmids)} PMIDs not found: {', '.join(missing)}")
     finally:
         verifier.close()
 
@@ -1,154 +1,351 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify, stream_with_context
 from flask_cors import CORS
-from langchain_core.prompts import PromptTemplate
-from langchain_openai import ChatOpenAI
-from langchain.chains import GraphCypherQAChain
-from langchain_community.graphs import Neo4jGraph
-from neo4j import GraphDatabase
+import hashlib
 import json
-import nltk
-from nltk.corpus import stopwords
-from nltk.tokenize import word_tokenize
-from langchain_caai.caai_emb_client import caai_emb_client
-from langchain_community.document_loaders import TextLoader
-from langchain_text_splitters import CharacterTextSplitter
-from langchain_community.vectorstores import FAISS
-
-from langchain_openai import OpenAIEmbeddings
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import requests
+from neo4j.exceptions import ClientError
+
+import metrics
+import query_terms
+import retrieval
+from clients import ClientRegistry, get_embeddings
+from create_neo4j import ARTICLE_FULLTEXT_INDEX, ARTICLE_VECTOR_INDEX
+from explanation_cache import ExplanationCache
 
 app = Flask(__name__)
 CORS(app)
 
+# Shared config, Neo4j driver and LLM client for every request
+clients = ClientRegistry('config.json')
 
-def get_database_connection(config):
-    """Establish database connection using config parameters."""
-    return Neo4jGraph(
-        url=config['neo4j_uri'],
-        username=config['neo4j_username'],
-        password=config['neo4j_password']
-    )
+# Prebuilt clinical trials index, loaded once at startup (see trials_index.py)
+trials_db = None
 
+# Pubmed-Diabetes TF-IDF vectors for /related, loaded once at startup (see pubmed_diabetes.py)
+related_papers = None
 
-def get_llm(config):
-    """Initialize the LLM with configuration."""
-    return ChatOpenAI(
-        model_name='',
-        openai_api_key=config['llm_api_key'],
-        openai_api_base=config.get('llm_api_base'),
-        temperature=0.2
-    )
+# Cache of LLM result explanations, set up at startup (see explanation_cache.py)
+explanation_cache = None
 
+# Runs the keyword and vector retrieval stages side by side, sized by `retrieval_workers` on first use
+retrieval_pool = None
+retrieval_pool_lock = threading.Lock()
 
-def embedding_client(config):
-    return caai_emb_client(
-        model="",
-        api_key=llm_api_key,
-        api_url=llm_api_base,
-        max_batch_size=100,
-        num_workers=10
-    )
+# Embedding API failures (the client talks to it with requests) that leave a search to the keyword stage
+EMBEDDING_API_ERRORS = (requests.RequestException,)
 
 
-def embeddings_api(config):
-    return OpenAIEmbeddings(
-        openai_api_key=llm_api_key,
-        openai_api_base=llm_api_base,
-    )
+def get_retrieval_pool():
+    """The retrieval thread pool. Its size is read from the config once, a reload doesn't resize it."""
+    global retrieval_pool
+    if retrieval_pool is None:
+        with retrieval_pool_lock:
+            if retrieval_pool is None:
+                retrieval_pool = ThreadPoolExecutor(
+                    max_workers=clients.config.get('retrieval_workers', retrieval.DEFAULT_WORKERS),
+                    thread_name_prefix='retrieval')
+    return retrieval_pool
+
+
+def load_trials_index(config):
+    """Load the prebuilt clinical trials index, if one has been built."""
+    # Pulls in FAISS and langchain, so only imported when the index is loaded
+    import trials_index
+
+    index_dir = config.get('trials_index_dir', trials_index.DEFAULT_INDEX_DIR)
+    if not (Path(index_dir) / 'index.faiss').exists():
+        print(f"No trials index found in {index_dir}, run `python trials_index.py build` to create one")
+        return None
+    return trials_index.load_index(index_dir, get_embeddings(config))
+
+
+def load_related_papers(config):
+    """Load the Pubmed-Diabetes related papers model, if its data is available."""
+    import pubmed_diabetes
+
+    data_dir = config.get('pubmed_diabetes_dir', pubmed_diabetes.DEFAULT_DATA_DIR)
+    cache_dir = config.get('pubmed_diabetes_cache_dir', pubmed_diabetes.DEFAULT_CACHE_DIR)
+    if not (Path(data_dir) / pubmed_diabetes.NODE_FILE).exists() and not (Path(cache_dir) / 'data.npy').exists():
+        print(f"No {pubmed_diabetes.NODE_FILE} found in {data_dir}, /related will be unavailable")
+        return None
+    return pubmed_diabetes.RelatedPapers.load(data_dir, cache_dir)
+
+
+def load_explanation_cache(config):
+    """Build the explanation cache from the config, comparing question embeddings if a threshold is set."""
+    return ExplanationCache.from_config(config, EXPLANATION_PROMPT_VERSION,
+                                        embed=lambda text: clients.embeddings.embed_query(text),
+                                        embed_errors=EMBEDDING_API_ERRORS)
+
+
+def find_related_papers(pmid, k=10):
+    """Return the response body and HTTP status for /related/<pmid>."""
+    if k < 1:
+        return {'status': "error", 'response': "k must be at least 1"}, 400
+    if related_papers is None:
+        return {'status': "error", 'response': "Related papers are not available"}, 503
+    if pmid not in related_papers:
+        return {'status': "error", 'response': f"Unknown PMID: {pmid}"}, 404
+    return {
+        'status': "success",
+        'response': [{'pmid': related, 'score': score} for related, score in related_papers.related(pmid, k)]
+    }, 200
+
+
+def process_query(query, k=4):
+    """Return the k trial chunks most similar to the query from the prebuilt index."""
+    if trials_db is None:
+        return []
 
+    # One query embedding plus an ANN lookup against the loaded index
+    embedding_vector = trials_db.embedding_function.embed_query(query)
+    return trials_db.similarity_search_by_vector(embedding_vector, k=k)
 
-def process_query(query):
-    data = load_json("clinical_trials_results.json")
-    text_splitter = CharacterTextSplitter(chunk_size=200, chunk_overlap=10)
-    documents = text_splitter.split_documents(data)
-    db = FAISS.from_documents(documents, embeddings)
 
-    #Similarity search
-    docs = db.similarity_search(query)
-    ss = docs[0].page_content
+def search_trials(question):
+    """The clinical trials related to the question, if a trials index is loaded."""
+    return [{'nct_id': doc.metadata['nct_id'], 'title': doc.metadata.get('title'), 'text': doc.page_content}
+            for doc in process_query(question)]
 
-    #Similarity search by vector
-    embedding_vector = embeddings.embed_query(query)
-    docs = db.similarity_search_by_vector(embedding_vector)
-    ssv = docs[0].page_content
 
-    return ss, ssv
+LUCENE_SPECIAL_CHARS = re.compile(r'([+\-&|!(){}\[\]^"~*?:\\/])')
 
 
-def generate_search_query(search_terms):
-    """Generate a Cypher query based on search terms."""
-    query = """
-    MATCH (a:Article)
-    WHERE toLower(a.abstract) CONTAINS toLower($search_term)
-        OR toLower(a.title) CONTAINS toLower($search_term)
-    WITH a
+def build_fulltext_query(search_terms):
+    """
+    Combine every search term into one Lucene query, escaping reserved characters.
+    Multi-word terms are quoted so they match as phrases.
+    """
+    escaped = [LUCENE_SPECIAL_CHARS.sub(r'\\\1', term) for term in search_terms]
+    return ' OR '.join(f'"{term}"' if ' ' in term else term for term in escaped if term)
+
+
+# Shared tail of the article searches: expects `a` and `score` bound, returns one row per article
+ARTICLE_DETAILS = """
     MATCH (auth:Author)-[:AUTHORED]->(a)
     OPTIONAL MATCH (a)-[:HAS_KEYWORD]->(k:Keyword)
-    RETURN DISTINCT 
+    WITH a, score,
+        collect(DISTINCT auth.first_name + ' ' + auth.last_name) as authors,
+        collect(DISTINCT k.name) as keywords
+    RETURN
         a.title as title,
         a.pmid as pmid,
         a.abstract as abstract,
-        collect(DISTINCT auth.first_name + ' ' + auth.last_name) as authors,
-        collect(DISTINCT k.name) as keywords
-    LIMIT 5
+        authors,
+        keywords,
+        score,
+        a.centrality as centrality,
+        a.citation_count as citation_count
+"""
+
+
+def generate_search_query(search_terms, limit=5):
+    """
+    Generate a full-text Cypher query based on search terms, ranked on text score alone.
+    Citation centrality is added afterwards as the fusion prior (see retrieval.fuse).
+    """
+    query = f"""
+    CALL db.index.fulltext.queryNodes('{ARTICLE_FULLTEXT_INDEX}', $search_query, {{limit: $candidates}})
+    YIELD node AS a, score
+    {ARTICLE_DETAILS}
+    ORDER BY score DESC
+    LIMIT $limit
+    """
+    # Over-fetch candidates since articles without authors are dropped by the MATCH
+    return query, {
+        "search_query": build_fulltext_query(search_terms),
+        "candidates": limit * 4,
+        "limit": limit
+    }
+
+
+def generate_vector_query(vector, limit=5):
+    """Generate a Cypher query for the articles whose embeddings are nearest to `vector`."""
+    query = f"""
+    CALL db.index.vector.queryNodes('{ARTICLE_VECTOR_INDEX}', $candidates, $vector)
+    YIELD node AS a, score
+    {ARTICLE_DETAILS}
+    ORDER BY score DESC
+    LIMIT $limit
     """
-    return query, {"search_term": search_terms[0]}
+    return query, {"vector": vector, "candidates": limit * 2, "limit": limit}
 
 
 def extract_search_terms(question):
-    """Extract relevant search terms from the question."""
-    tokens = word_tokenize(question.lower())
-    stop_words = set(stopwords.words('english'))
-    search_terms = [word for word in tokens
-                    if word.isalnum()
-                    and word not in stop_words
-                    and len(word) > 3]
-    return search_terms
-
-
-def generate_result_explanation(question, results, llm):
-    """Generate an LLM explanation of the search results."""
-    if not results:
-        return "No relevant papers were found matching your query."
+    """Extract relevant search terms from the question (see query_terms.py)."""
+    return query_terms.extract_terms(question, phrases=clients.config.get('search_phrases', False))
 
-    explanation_prompt = PromptTemplate(
-        template="""You are a helpful research assistant explaining PubMed search results. 
-        The user asked: {question}
 
-        Based on this question, I found {num_results} papers. Here are the key details about what I found:
+# Plain str.format template, formatting it doesn't need langchain
+EXPLANATION_PROMPT = """You are a helpful research assistant explaining PubMed search results. 
+    The user asked: {question}
 
-        {result_details}
+    Based on this question, I found {num_results} papers. Here are the key details about what I found:
 
-        Please provide a concise but informative explanation of:
-        1. Why these papers were selected and how they relate to the user's question
-        2. The main themes or findings across the papers
-        3. Any particularly noteworthy papers from the set
+    {result_details}
 
-        Keep your response conversational but professional, and highlight the most relevant aspects for the user's query.
-        """,
-        input_variables=["question", "num_results", "result_details"]
-    )
+    Please provide a concise but informative explanation of:
+    1. Why these papers were selected and how they relate to the user's question
+    2. The main themes or findings across the papers
+    3. Any particularly noteworthy papers from the set
 
+    Keep your response conversational but professional, and highlight the most relevant aspects for the user's query.
+    """
+
+# Part of every explanation cache key, so editing the prompt invalidates old explanations
+EXPLANATION_PROMPT_VERSION = hashlib.sha256(EXPLANATION_PROMPT.encode('utf-8')).hexdigest()[:12]
+
+
+def format_explanation_prompt(question, results):
+    """Fill the explanation prompt with the question and paper details."""
     # Format paper details for the LLM
     result_details = []
     for i, paper in enumerate(results, 1):
         paper_detail = f"""Paper {i}:
         Title: {paper['title']}
         Keywords: {', '.join(paper['keywords'])}
-        Key points from abstract: {paper['abstract'][:200]}...
+        Key points from abstract: {(paper['abstract'] or '')[:200]}...
         Authors: {', '.join(paper['authors'])}
         """
         result_details.append(paper_detail)
 
-    # Generate explanation
-    explanation = llm.invoke(
-        explanation_prompt.format(
-            question=question,
-            num_results=len(results),
-            result_details="\n\n".join(result_details)
-        )
+    return EXPLANATION_PROMPT.format(
+        question=question,
+        num_results=len(results),
+        result_details="\n\n".join(result_details)
     )
 
-    return explanation.content
+
+def generate_result_explanation(question, results, llm, cache=None):
+    """Generate an LLM explanation of the search results, reusing a cached one if there is one."""
+    if not results:
+        return "No relevant papers were found matching your query."
+
+    pmids = [paper['pmid'] for paper in results]
+    if cache is not None:
+        cached = cache.get(question, pmids)
+        if cached is not None:
+            return cached
+
+    response = llm.invoke(format_explanation_prompt(question, results))
+    metrics.record_llm_usage(response)
+    explanation = response.content
+    if cache is not None:
+        cache.put(question, pmids, explanation)
+    return explanation
+
+
+def stream_result_explanation(question, results, llm, cache=None):
+    """
+    Yield the LLM explanation of the search results token by token. A cached
+    explanation is yielded whole, and a streamed one is cached once complete.
+    """
+    if not results:
+        yield "No relevant papers were found matching your query."
+        return
+
+    pmids = [paper['pmid'] for paper in results]
+    if cache is not None:
+        cached = cache.get(question, pmids)
+        if cached is not None:
+            yield cached
+            return
+
+    tokens = []
+    for chunk in llm.stream(format_explanation_prompt(question, results)):
+        # Only reported on the last chunk, and only by servers that send stream usage
+        metrics.record_llm_usage(chunk)
+        if chunk.content:
+            tokens.append(chunk.content)
+            yield chunk.content
+    if cache is not None:
+        cache.put(question, pmids, ''.join(tokens))
+
+
+def format_paper(result):
+    """Shape a search result record into the paper dict returned to the frontend."""
+    return {
+        'title': result['title'],
+        'pmid': result['pmid'],
+        'abstract': result['abstract'],
+        'authors': result['authors'],
+        'keywords': result['keywords'],
+        'score': result.get('fused_score', result['score']),
+        'centrality': result['centrality'],
+        'ranks': result.get('ranks', {})
+    }
+
+
+def keyword_search(search_terms, candidates, timer):
+    with timer.stage('keyword'):
+        query, params = generate_search_query(search_terms, limit=candidates)
+        rows = clients.query(query, params)
+    metrics.NEO4J_ROWS.observe(len(rows), query='keyword')
+    return rows
+
+
+def missing_vector_index(error):
+    """Whether a Neo4j error is the article vector index not existing yet (see embed_articles.py)."""
+    return isinstance(error, ClientError) and ARTICLE_VECTOR_INDEX in (error.message or '')
+
+
+def skip_vector_search(reason, error):
+    """Log and count a vector stage that can't run, returning its (empty) results."""
+    app.logger.warning("Vector search skipped (%s), using keyword results only: %s", reason, error)
+    metrics.VECTOR_SEARCH_SKIPPED.inc(reason=reason)
+    return []
+
+
+def vector_search(question, candidates, timer):
+    """
+    Embedding similarity stage. Skipped, leaving the keyword results, when the embedding API
+    is unreachable or there's no vector index yet; any other failure fails the request.
+    """
+    with timer.stage('vector'):
+        try:
+            vector = clients.embeddings.embed_query(question)
+        except EMBEDDING_API_ERRORS as e:
+            return skip_vector_search('embedding_api', e)
+        if vector is None:
+            # The embedding client prints and returns None when the API gives back nothing
+            return skip_vector_search('embedding_api', 'no embedding returned')
+
+        query, params = generate_vector_query(vector, limit=candidates)
+        try:
+            rows = clients.query(query, params)
+        except ClientError as e:
+            if not missing_vector_index(e):
+                raise
+            return skip_vector_search('no_vector_index', e.message)
+    metrics.NEO4J_ROWS.observe(len(rows), query='vector')
+    return rows
+
+
+def search_papers(search_terms, question, k=5):
+    """
+    Retrieve candidates by keyword and by embedding similarity in parallel, fuse them
+    and return the top k formatted papers along with per-stage timings in ms.
+    """
+    config = clients.config
+    candidates = config.get('retrieval_candidates', retrieval.DEFAULT_CANDIDATES)
+    timer = retrieval.StageTimer()
+
+    with timer.stage('retrieval'):
+        pool = get_retrieval_pool()
+        keyword = pool.submit(keyword_search, search_terms, candidates, timer)
+        vector = pool.submit(vector_search, question, candidates, timer)
+        rankings = {'keyword': keyword.result(), 'vector': vector.result()}
+
+    with timer.stage('fusion'):
+        fused = retrieval.fuse(rankings, retrieval.fusion_weights(config), k)
+
+    return [format_paper(result) for result in fused], timer.timings
 
 
 def load_json(file_path):
@@ -157,6 +354,52 @@ def load_json(file_path):
         return json.load(f)
 
 
+def request_endpoint():
+    """The route pattern rather than the path, so /related/<pmid> is one metrics series."""
+    return request.url_rule.rule if request.url_rule else 'unmatched'
+
+
+@app.before_request
+def start_request():
+    g.start = time.perf_counter()
+    # Keeps this request's clients open if a config reload replaces them mid-request
+    g.clients_generation = clients.acquire()
+    threshold = clients.config.get('profile_slow_requests_ms')
+    if threshold is not None:
+        g.profiler = metrics.SlowRequestProfiler(threshold, clients.config.get('profile_dir',
+                                                                               metrics.DEFAULT_PROFILE_DIR))
+
+
+@app.after_request
+def finish_request(response):
+    """Record the request's stage timings and duration, and send the timings as Server-Timing."""
+    timings = g.get('timings')
+    if timings:
+        metrics.record_timings(timings)
+        response.headers['Server-Timing'] = metrics.server_timing(timings)
+    # A streamed body is still to come, the stream records its own duration
+    if not response.is_streamed:
+        metrics.REQUEST_SECONDS.observe(time.perf_counter() - g.start, endpoint=request_endpoint())
+    generation = g.get('clients_generation')
+    profiler = g.get('profiler')
+    name = request.endpoint or 'unmatched'
+
+    def finish():
+        if generation is not None:
+            clients.release(generation)
+        if profiler is not None:
+            path = profiler.finish(name)
+            if path:
+                print(f"Slow request profile written to {path}")
+
+    if response.is_streamed:
+        # The body still runs after this, on the clients it started with and under the profiler
+        response.call_on_close(finish)
+    else:
+        finish()
+    return response
+
+
 @app.route('/check-database', methods=['POST'])
 def handle_database_request():
     try:
@@ -168,63 +411,134 @@ def handle_database_request():
         # Get the user's question
         question = params["messages"][-1]['content']
 
-        # Load configuration
-        with open('config.json') as config_file:
-            config = json.load(config_file)
+        # Stage timings in ms, reported in the response, the Server-Timing header and /metrics
+        timer = retrieval.StageTimer()
+        g.timings = timer.timings
 
         # Extract search terms from question
-        search_terms = extract_search_terms(question)
+        with timer.stage('terms'):
+            search_terms = extract_search_terms(question)
         if not search_terms:
             return jsonify({
                 'status': "error",
                 'response': "Could not extract meaningful search terms from the question"
             })
 
-        # Initialize LLM
-        llm = get_llm(config)
-
-        # Generate and execute query
-        graph = get_database_connection(config)
-        query, params = generate_search_query(search_terms)
-        results = graph.query(query, params=params)
+        # Generate and execute query, looking up related trials alongside
+        trials = get_retrieval_pool().submit(search_trials, question)
+        formatted_results, search_timings = search_papers(search_terms, question)
+        timer.timings.update(search_timings)
+        trials = trials.result()
 
-        if not results:
+        if not formatted_results:
             return jsonify({
                 'status': "success",
                 'response': f"No papers found matching the terms: {', '.join(search_terms)}"
             })
 
-        # Format results
-        formatted_results = []
-        for result in results:
-            formatted_results.append({
-                'title': result['title'],
-                'pmid': result['pmid'],
-                'abstract': result['abstract'],
-                'authors': result['authors'],
-                'keywords': result['keywords']
-            })
-
         # Generate explanation of results
-        explanation = generate_result_explanation(question, formatted_results, llm)
+        with timer.stage('explanation'):
+            explanation = generate_result_explanation(question, formatted_results, clients.llm,
+                                                      explanation_cache)
+
+        response = {
+            'explanation': explanation,
+            'papers': formatted_results,
+            'timings': timer.timings
+        }
+        if trials:
+            response['trials'] = trials
 
         return jsonify({
             'status': "success",
-            'response': {
-                'explanation': explanation,
-                'papers': formatted_results
-            }
+            'response': response
         })
 
     except Exception as e:
+        metrics.REQUEST_ERRORS.inc(endpoint=request_endpoint(), error=type(e).__name__)
         return jsonify({
             'status': "error",
             'response': f"An error occurred: {str(e)}"
-        })
+        }), 500
+
+
+def sse_event(event, data):
+    """Format a single Server-Sent Event with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@app.route('/check-database/stream', methods=['POST'])
+def handle_database_stream_request():
+    """
+    Streaming variant of /check-database. Sends a `papers` event as soon as the
+    search returns, then one `token` event per explanation chunk, then `done`.
+    Failures are sent as an `error` event, invalid requests too (with a 400).
+    """
+    params = request.get_json(silent=True)
+    if not params or not params.get("messages"):
+        # As an event, so the client's stream parser shows it
+        return Response(sse_event('error', {'response': "Must include messages in request"}), status=400,
+                        mimetype='text/event-stream')
+
+    question = params["messages"][-1]['content']
+    endpoint = request_endpoint()
+    start = g.start
+
+    def generate():
+        timer = retrieval.StageTimer()
+        try:
+            with timer.stage('terms'):
+                search_terms = extract_search_terms(question)
+            if not search_terms:
+                yield sse_event('error', {'response': "Could not extract meaningful search terms from the question"})
+                return
+
+            formatted_results, search_timings = search_papers(search_terms, question)
+            timer.timings.update(search_timings)
+            yield sse_event('papers', {'papers': formatted_results, 'timings': timer.timings})
+
+            if not formatted_results:
+                yield sse_event('token', {'content': f"No papers found matching the terms: {', '.join(search_terms)}"})
+            else:
+                with timer.stage('explanation'):
+                    for token in stream_result_explanation(question, formatted_results, clients.llm,
+                                                           explanation_cache):
+                        yield sse_event('token', {'content': token})
+
+            yield sse_event('done', {})
+        except Exception as e:
+            metrics.REQUEST_ERRORS.inc(endpoint=endpoint, error=type(e).__name__)
+            yield sse_event('error', {'response': f"An error occurred: {str(e)}"})
+        finally:
+            metrics.record_timings(timer.timings)
+            metrics.REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint=endpoint)
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@app.route('/related/<pmid>', methods=['GET'])
+def handle_related_request(pmid):
+    body, status = find_related_papers(pmid, request.args.get('k', default=10, type=int))
+    return jsonify(body), status
+
+
+@app.route('/metrics', methods=['GET'])
+def handle_metrics_request():
+    return Response(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
+
+
+@app.route('/health', methods=['GET'])
+def health():
+    report = clients.health()
+    if explanation_cache is not None:
+        report['explanation_cache'] = explanation_cache.stats()
+    return jsonify(report)
 
 
 if __name__ == '__main__':
-    # Initialize NLTK downloads
-    nltk.download('punkt')
-    nltk.download('stopwords')
-    app.run(debug=True)
\ No newline at end of file
+    trials_db = load_trials_index(clients.config)
+    related_papers = load_related_papers(clients.config)
+    explanation_cache = load_explanation_cache(clients.config)
+
+    app.run(debug=True)
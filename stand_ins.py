@@ -0,0 +1,394 @@
+import argparse
+import asyncio
+import hashlib
+import heapq
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from urllib.parse import parse_qs, urlparse
+from xml.sax.saxutils import escape
+
+import numpy as np
+
+
+DEFAULT_DIMENSIONS = 384
+DEFAULT_STUDIES = 10000
+CANNED_EXPLANATION = ("These papers were selected because they match the key terms of your question. "
+                      "Together they cover its main themes, and the first paper is the most relevant.")
+
+# Vocabulary for the synthetic articles and questions
+WORDS = ('diabetes insulin glucose obesity retinopathy nephropathy metformin cardiovascular hypertension '
+         'pancreatic islet beta cell resistance glycemic adipose inflammation mortality cohort randomized '
+         'trial outcome therapy screening biomarker pediatric elderly pregnancy gestational neuropathy '
+         'kidney hepatic lipid cholesterol exercise dietary lifestyle genetic variant expression receptor').split()
+CONDITIONS = ('Type 2 Diabetes', 'Type 1 Diabetes', 'Obesity', 'Hypertension', 'Heart Failure',
+              'Breast Cancer', 'Asthma', 'Chronic Kidney Disease')
+
+
+def fake_embedding(text, dimensions=DEFAULT_DIMENSIONS):
+    """Deterministic unit vector derived from the text, so equal inputs embed equally."""
+    seed = int.from_bytes(hashlib.sha256(text.encode('utf-8')).digest()[:8], 'little')
+    vector = np.random.default_rng(seed).standard_normal(dimensions)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+
+class StandInServer(ThreadingHTTPServer):
+    """
+    Local HTTP server standing in for an external API in tests and benchmarks.
+
+    Subclasses provide a handler class; `start()` serves on a background thread and
+    returns the base URL. Requests served are counted in `requests_served`.
+    """
+
+    daemon_threads = True
+    handler_class = None
+
+    def __init__(self, host='127.0.0.1', port=0):
+        super().__init__((host, port), self.handler_class)
+        self.requests_served = 0
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self.base_url
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class JSONHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def read_json(self):
+        length = int(self.headers.get('Content-Length', 0))
+        return json.loads(self.rfile.read(length) or b'{}')
+
+    def send_json(self, body, status=200):
+        payload = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+        self.server.requests_served += 1
+
+
+class EmbeddingHandler(JSONHandler):
+    """OpenAI-compatible POST /embeddings, accepting strings or token id lists as input."""
+
+    def do_POST(self):
+        if not self.path.rstrip('/').endswith('/embeddings'):
+            self.send_json({'error': {'message': f"Unknown path {self.path}"}}, status=404)
+            return
+        body = self.read_json()
+        inputs = body.get('input', [])
+        if isinstance(inputs, str) or (inputs and isinstance(inputs[0], int)):
+            inputs = [inputs]
+        dimensions = body.get('dimensions') or self.server.dimensions
+        data = [{'object': 'embedding', 'index': i,
+                 'embedding': fake_embedding(item if isinstance(item, str) else json.dumps(item), dimensions)}
+                for i, item in enumerate(inputs)]
+        self.send_json({'object': 'list', 'data': data, 'model': body.get('model', 'stand-in'),
+                        'usage': {'prompt_tokens': 0, 'total_tokens': 0}})
+
+
+class EmbeddingStandIn(StandInServer):
+    """Stand-in for the embedding API, serving deterministic vectors at <base_url>/embeddings."""
+
+    handler_class = EmbeddingHandler
+
+    def __init__(self, host='127.0.0.1', port=0, dimensions=DEFAULT_DIMENSIONS):
+        super().__init__(host, port)
+        self.dimensions = dimensions
+
+
+def synthetic_study(i):
+    """The i-th synthetic study in the ClinicalTrials.gov v2 shape, the same every time."""
+    return {'protocolSection': {
+        'identificationModule': {'nctId': f"NCT{i:08d}", 'briefTitle': f"Study {i} of {CONDITIONS[i % 8]}"},
+        'descriptionModule': {'briefSummary': f"A study of {WORDS[i % len(WORDS)]} in {CONDITIONS[i % 8]}.",
+                              'detailedDescription': ' '.join(WORDS[(i + j) % len(WORDS)] for j in range(40))},
+        'conditionsModule': {'conditions': [CONDITIONS[i % 8], CONDITIONS[(i * 7 + 3) % 8]]},
+        'eligibilityModule': {'eligibilityCriteria': "Inclusion Criteria: adults",
+                              'healthyVolunteers': i % 5 == 0,
+                              'sex': ('ALL', 'ALL', 'ALL', 'FEMALE', 'MALE')[i % 5],
+                              'minimumAge': (None, '18 Years', '6 Months', '40 Years', '65 Years')[i % 5],
+                              'maximumAge': (None, '75 Years', '17 Years', '99 Years', None)[(i // 5) % 5],
+                              'stdAges': ['ADULT']},
+        'statusModule': {'overallStatus': 'RECRUITING', 'phase': ('PHASE1', 'PHASE2', 'PHASE3')[i % 3]},
+        'contactsLocationsModule': {'locations': [{
+            'facility': f"Hospital {i % 100}", 'city': ('Boston', 'Lexington', 'Chicago', 'Houston')[i % 4],
+            'state': ('Massachusetts', 'Kentucky', 'Illinois', 'Texas')[i % 4], 'zip': f"{i % 100000:05d}",
+            'country': 'United States'}]},
+    }}
+
+
+def synthetic_articles(n, seed=0):
+    """n articles shaped like the rows of the article search queries, pmids '1' to str(n)."""
+    rng = np.random.default_rng(seed)
+    words = np.array(WORDS, dtype=object)
+    return [{
+        'pmid': str(i + 1),
+        'title': ' '.join(words[rng.integers(0, len(words), 8)]).capitalize(),
+        'abstract': ' '.join(words[rng.integers(0, len(words), 120)]),
+        'authors': [f"Author{j} Name{j}" for j in rng.integers(0, max(n // 3, 1), 3)],
+        'keywords': list(words[rng.integers(0, len(words), 4)]),
+        'centrality': float(rng.random()),
+        'citation_count': int(rng.integers(0, 200)),
+    } for i in range(n)]
+
+
+def synthetic_questions(n, seed=0):
+    rng = np.random.default_rng(seed)
+    words = np.array(WORDS, dtype=object)
+    return [f"What is known about {' and '.join(words[rng.integers(0, len(words), 3)])} in type 2 diabetes?"
+            for _ in range(n)]
+
+
+def write_pubmed_xml(path, n_articles, references=10, first_pmid=1, seed=0):
+    """Write a PubMed baseline-style XML file of n_articles, each citing `references` other articles."""
+    rng = np.random.default_rng(seed)
+    last_pmid = first_pmid + n_articles - 1
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('<?xml version="1.0" encoding="utf-8"?>\n<PubmedArticleSet>\n')
+        for pmid in range(first_pmid, last_pmid + 1):
+            title = escape(' '.join(rng.choice(WORDS, 8)).capitalize())
+            abstract = escape(' '.join(rng.choice(WORDS, 120)))
+            authors = ''.join(f"<Author><LastName>Name{a}</LastName><ForeName>Author{a}</ForeName></Author>"
+                              for a in rng.integers(0, max(n_articles // 3, 1), 3))
+            keywords = ''.join(f"<Keyword>{k}</Keyword>" for k in rng.choice(WORDS, 4, replace=False))
+            cited = rng.integers(first_pmid, last_pmid + 1, references)
+            refs = ''.join(f'<Reference><ArticleIdList><ArticleId IdType="pubmed">{c}</ArticleId>'
+                           f'</ArticleIdList></Reference>' for c in cited)
+            f.write(f"<PubmedArticle><MedlineCitation><PMID>{pmid}</PMID><Article>"
+                    f"<ArticleTitle>{title}</ArticleTitle><Abstract><AbstractText>{abstract}</AbstractText>"
+                    f"</Abstract><AuthorList>{authors}</AuthorList></Article>"
+                    f"<KeywordList>{keywords}</KeywordList></MedlineCitation>"
+                    f"<PubmedData><ReferenceList>{refs}</ReferenceList></PubmedData></PubmedArticle>\n")
+        f.write('</PubmedArticleSet>\n')
+    return path
+
+
+class FakeRecord(dict):
+    def data(self):
+        return dict(self)
+
+
+class FakeResult(list):
+    def single(self):
+        return self[0] if self else None
+
+    def data(self):
+        return [record.data() for record in self]
+
+
+class FakeGraphDriver:
+    """
+    In-memory stand-in for a neo4j Driver, enough for the queries this repo sends.
+
+    Full-text searches (a `search_query` parameter) rank the articles by how often the
+    query's words occur in their title and abstract, looked up in an inverted index. Vector searches return the
+    first articles, lookups by `pmids` return those articles, article writes add or
+    update articles unless they come from an older source file, and citation writes (`rows` of citing/cited) create edges between known articles. Every query is
+    counted in `queries`.
+    """
+
+    def __init__(self, articles=()):
+        self.articles = {article['pmid']: article for article in articles}
+        self._postings = {}
+        for pmid, article in self.articles.items():
+            for word in re.findall(r"\w+", f"{article['title']} {article['abstract']}".lower()):
+                postings = self._postings.setdefault(word, {})
+                postings[pmid] = postings.get(pmid, 0) + 1
+        self.citations = set()
+        self.queries = 0
+        self._lock = threading.Lock()
+
+    def run(self, query, params=None, **kwargs):
+        params = {**(params or {}), **kwargs}
+        with self._lock:
+            self.queries += 1
+        if 'search_query' in params:
+            scores = {}
+            for word in re.findall(r"\w+", params['search_query'].lower()):
+                for pmid, count in self._postings.get(word, {}).items():
+                    scores[pmid] = scores.get(pmid, 0) + count
+            best = heapq.nlargest(params.get('limit', 5), scores.items(), key=lambda item: (item[1], item[0]))
+            return FakeResult(FakeRecord(self.articles[pmid], score=float(score)) for pmid, score in best)
+        if 'vector' in params:
+            return FakeResult(FakeRecord(article, score=1.0)
+                              for article in list(self.articles.values())[:params.get('limit', 5)])
+        if 'pmids' in params:
+            return FakeResult(FakeRecord(pmid=pmid, article=self.articles.get(pmid)) for pmid in params['pmids'])
+        if 'rows' in params and 'MERGE (a:Article' in query:
+            with self._lock:
+                written = 0
+                for row in params['rows']:
+                    article = self.articles.get(row['pmid'], {})
+                    # Rows from an older source file than the article's are skipped, as in create_articles
+                    if (article.get('source_file') or '') <= (row.get('source_file') or ''):
+                        if article.get('source_file') and article['source_file'] < row['source_file']:
+                            # Replaced by a newer version, whose citations stage adds its own
+                            self.citations = {edge for edge in self.citations if edge[0] != row['pmid']}
+                        self.articles[row['pmid']] = {**article, **row}
+                        written += 1
+            return FakeResult([FakeRecord(written=written)])
+        if 'rows' in params and 'CITES' in query:
+            created = 0
+            with self._lock:
+                for row in params['rows']:
+                    edge = (row['citing'], row['cited'])
+                    citing = self.articles.get(row['citing'])
+                    if citing is not None and row['cited'] in self.articles and edge not in self.citations \
+                            and (citing.get('source_file') or '') <= (row.get('source_file') or ''):
+                        self.citations.add(edge)
+                        created += 1
+            return FakeResult([FakeRecord(created=created)])
+        return FakeResult()
+
+    def execute_query(self, query, parameters_=None, routing_=None, **kwargs):
+        records = self.run(query, parameters_, **kwargs)
+        return list(records), None, list(records[0].keys()) if records else []
+
+    def session(self, **kwargs):
+        return FakeSession(self)
+
+    def verify_connectivity(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class FakeSession:
+    def __init__(self, driver):
+        self.driver = driver
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def run(self, query, parameters=None, **kwargs):
+        return self.driver.run(query, parameters, **kwargs)
+
+    def execute_write(self, work, *args, **kwargs):
+        return work(self, *args, **kwargs)
+
+    execute_read = execute_write
+
+    def close(self):
+        pass
+
+
+class CannedLLM:
+    """Stand-in chat model answering every prompt with the same text after `latency` seconds."""
+
+    def __init__(self, response=CANNED_EXPLANATION, latency=0.0):
+        self.response = response
+        self.latency = latency
+        self.calls = 0
+
+    def invoke(self, prompt):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return SimpleNamespace(content=self.response)
+
+    async def ainvoke(self, prompt):
+        self.calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return SimpleNamespace(content=self.response)
+
+    def stream(self, prompt):
+        self.calls += 1
+        for token in re.findall(r"\S+\s*", self.response):
+            yield SimpleNamespace(content=token)
+
+    async def astream(self, prompt):
+        self.calls += 1
+        for token in re.findall(r"\S+\s*", self.response):
+            yield SimpleNamespace(content=token)
+
+
+class FakeEmbeddings:
+    """In-process stand-in for an embedding client, with the same vectors as EmbeddingStandIn."""
+
+    def __init__(self, dimensions=DEFAULT_DIMENSIONS):
+        self.dimensions = dimensions
+
+    def embed_query(self, text):
+        return fake_embedding(text, self.dimensions)
+
+    def embed_documents(self, texts):
+        return [fake_embedding(text, self.dimensions) for text in texts]
+
+
+class StudiesHandler(JSONHandler):
+    """GET /api/v2/studies, paging through the server's synthetic studies with pageSize and pageToken."""
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path.rstrip('/') != '/api/v2/studies':
+            self.send_json({'error': f"Unknown path {url.path}"}, status=404)
+            return
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        start = int(query.get('pageToken', 0))
+        size = min(int(query.get('pageSize', 10)), 1000)
+        end = min(start + size, self.server.studies)
+        body = {'studies': [synthetic_study(i) for i in range(start, end)]}
+        if end < self.server.studies:
+            body['nextPageToken'] = str(end)
+        self.send_json(body)
+
+
+class ClinicalTrialsStandIn(StandInServer):
+    """Stand-in for the ClinicalTrials.gov v2 API, serving `studies` synthetic studies."""
+
+    handler_class = StudiesHandler
+
+    def __init__(self, host='127.0.0.1', port=0, studies=DEFAULT_STUDIES):
+        super().__init__(host, port)
+        self.studies = studies
+
+    @property
+    def studies_url(self):
+        return f"{self.base_url}/api/v2/studies"
+
+
+STAND_INS = {
+    'embeddings': EmbeddingStandIn,
+    'clinicaltrials': ClinicalTrialsStandIn,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve a local stand-in for an external API')
+    parser.add_argument('service', choices=sorted(STAND_INS))
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8099)
+    args = parser.parse_args()
+
+    server = STAND_INS[args.service](args.host, args.port)
+    print(f"Serving {args.service} stand-in on {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
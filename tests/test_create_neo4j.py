@@ -0,0 +1,23 @@
+from lxml import etree
+
+import server
+from create_neo4j import extract_article
+
+
+ARTICLE_WITHOUT_ABSTRACT = """
+<PubmedArticle><MedlineCitation><PMID Version="1">1</PMID><Article>
+<ArticleTitle>Formate assay in body fluids: application in methanol poisoning.</ArticleTitle>
+<AuthorList><Author><LastName>Makar</LastName><ForeName>A B</ForeName></Author></AuthorList>
+</Article></MedlineCitation></PubmedArticle>
+"""
+
+
+def test_article_without_abstract():
+    article = extract_article(etree.fromstring(ARTICLE_WITHOUT_ABSTRACT))
+    assert article['abstract'] == ''
+
+    paper = dict(article, authors=['A B Makar'], keywords=[])
+    prompt = server.format_explanation_prompt('methanol poisoning', [paper])
+    assert 'Formate assay in body fluids' in prompt
+    # Rows already stored with a null abstract still format
+    assert 'Formate assay' in server.format_explanation_prompt('methanol', [dict(paper, abstract=None)])
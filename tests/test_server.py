@@ -0,0 +1,52 @@
+import pytest
+from scipy import sparse
+
+import server
+from pubmed_diabetes import RelatedPapers
+
+
+@pytest.fixture
+def related_papers(monkeypatch):
+    papers = RelatedPapers(['1', '2', '3'], sparse.csr_matrix([[1.0, 0.0], [0.9, 0.1], [0.0, 1.0]]))
+    monkeypatch.setattr(server, 'related_papers', papers)
+    return papers
+
+
+def get_related(path):
+    response = server.app.test_client().get(path)
+    return response.status_code, response.json
+
+
+def test_related(related_papers):
+    status, body = get_related('/related/1?k=1')
+    assert status == 200
+    assert [paper['pmid'] for paper in body['response']] == ['2']
+
+
+def test_related_k_below_one(related_papers):
+    status, body = get_related('/related/1?k=0')
+    assert status == 400 and body['status'] == 'error'
+
+
+def test_related_unknown_pmid(related_papers):
+    status, body = get_related('/related/999')
+    assert status == 404 and body['response'] == 'Unknown PMID: 999'
+
+
+def test_related_not_loaded(monkeypatch):
+    monkeypatch.setattr(server, 'related_papers', None)
+    status, body = get_related('/related/1')
+    assert status == 503 and body['status'] == 'error'
+
+
+@pytest.mark.parametrize('body', [{}, {'messages': []}, None])
+def test_stream_invalid_request_is_an_error_event(body):
+    client = server.app.test_client()
+    if body is None:
+        response = client.post('/check-database/stream', data='not json', content_type='application/json')
+    else:
+        response = client.post('/check-database/stream', json=body)
+    assert response.status_code == 400
+    assert response.mimetype == 'text/event-stream'
+    assert response.get_data(as_text=True) == \
+        'event: error\ndata: {"response": "Must include messages in request"}\n\n'
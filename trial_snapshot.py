@@ -0,0 +1,111 @@
+import argparse
+import json
+from typing import Dict, List, Optional
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from ClinicalTrialsTool import SEX_DTYPE
+
+
+DEFAULT_SNAPSHOT_PATH = 'clinical_trials_results.parquet'
+DEFAULT_ROW_GROUP_SIZE = 10000
+# Low-cardinality columns stored as dictionary indexes instead of repeated strings
+DICTIONARY_COLUMNS = ['status', 'phase', 'sex', 'country']
+
+
+def _column_array(values: pd.Series, dictionary: bool) -> pa.Array:
+    if values.name == 'conditions':
+        return pa.array([list(v) if isinstance(v, (list, tuple)) else [] for v in values],
+                        type=pa.list_(pa.string()))
+    # Missing values become nulls; text columns are stored as strings
+    objects = values.astype(object)
+    array = pa.array(objects.where(objects.notna(), None).tolist(), from_pandas=True)
+    if pa.types.is_null(array.type) or pa.types.is_string(array.type):
+        array = array.cast(pa.string())
+        if dictionary:
+            array = array.dictionary_encode()
+    return array
+
+
+def write_snapshot(trials: pd.DataFrame, path: str = DEFAULT_SNAPSHOT_PATH,
+                   row_group_size: int = DEFAULT_ROW_GROUP_SIZE):
+    """
+    Write a trial frame (as returned by ClinicalTrialsFilterV2) to a zstd-compressed
+    Parquet file, one column per field.
+
+    Row groups keep per-column min/max statistics, so filtered reads can skip groups.
+    """
+    arrays = [_column_array(trials[column], column in DICTIONARY_COLUMNS) for column in trials.columns]
+    table = pa.Table.from_arrays(arrays, names=[str(column) for column in trials.columns])
+    pq.write_table(table, path, compression='zstd', row_group_size=row_group_size)
+
+
+def read_table(path: str = DEFAULT_SNAPSHOT_PATH,
+               columns: Optional[List[str]] = None,
+               filters: Optional[List] = None) -> pa.Table:
+    """
+    Memory-map a snapshot and read only `columns`, pushing `filters` down to the row groups.
+
+    `filters` uses the pyarrow form, e.g. [('status', '=', 'RECRUITING'), ('country', 'in', {...})].
+    """
+    return pq.read_table(path, columns=columns, filters=filters, memory_map=True)
+
+
+def read_snapshot(path: str = DEFAULT_SNAPSHOT_PATH,
+                  columns: Optional[List[str]] = None,
+                  filters: Optional[List] = None) -> pd.DataFrame:
+    """Read a snapshot into a trial frame, with the dictionary columns as categoricals."""
+    df = read_table(path, columns, filters).to_pandas()
+    if 'sex' in df:
+        # Keep the category order the matching code relies on
+        df['sex'] = df['sex'].astype(object).astype(SEX_DTYPE)
+    if 'conditions' in df:
+        df['conditions'] = [list(v) if v is not None else [] for v in df['conditions']]
+    return df
+
+
+def read_snapshot_records(path: str = DEFAULT_SNAPSHOT_PATH,
+                          columns: Optional[List[str]] = None,
+                          filters: Optional[List] = None) -> List[Dict]:
+    """Read a snapshot as a list of plain per-trial dicts."""
+    return read_table(path, columns, filters).to_pylist()
+
+
+def details_to_frame(details: List[Dict]) -> pd.DataFrame:
+    """Flatten trial detail dicts from the legacy JSON export back into a trial frame."""
+    return pd.DataFrame([{
+        'nct_id': trial['nct_id'],
+        'title': trial['title'],
+        'detailed_description': trial['detailed_description'],
+        'brief_summary': trial['brief_summary'],
+        'conditions': trial['conditions'],
+        'eligibility_criteria': trial['eligibility_criteria'],
+        'healthy_volunteers': trial['additional_info']['accepts_healthy_volunteers'],
+        'sex': trial['sex'],
+        'minimum_age': trial['age_range']['minimum_age'],
+        'maximum_age': trial['age_range']['maximum_age'],
+        'phase': trial['additional_info']['phase'],
+        'status': trial['additional_info']['status'],
+        'facility': trial['additional_info']['facility'],
+        'city': trial['location']['city'],
+        'state': trial['location']['state'],
+        'country': trial['location']['country'],
+    } for trial in details])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert a legacy JSON trials export to a columnar snapshot')
+    parser.add_argument('source', help='Trial details JSON written by ClinicalTrialsTool.py')
+    parser.add_argument('target', nargs='?', default=DEFAULT_SNAPSHOT_PATH)
+    args = parser.parse_args()
+
+    with open(args.source, 'r', encoding='utf-8') as f:
+        trials = details_to_frame(json.load(f))
+    write_snapshot(trials, args.target)
+    print(f"Wrote {len(trials)} trials to {args.target}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+import argparse
+import hashlib
+import json
+import pickle
+from pathlib import Path
+
+import faiss
+from langchain_core.documents import Document
+from langchain_community.vectorstores import FAISS
+from langchain_text_splitters import CharacterTextSplitter
+
+
+DEFAULT_TRIALS_PATH = 'clinical_trials_results.json'
+DEFAULT_INDEX_DIR = 'trials_index'
+MANIFEST_NAME = 'manifest.json'
+TEXT_COLUMNS = ['nct_id', 'title', 'conditions', 'brief_summary', 'detailed_description', 'eligibility_criteria']
+
+text_splitter = CharacterTextSplitter(chunk_size=200, chunk_overlap=10)
+
+
+def trial_text(trial):
+    """Flatten the searchable fields of a trial record into one block of text."""
+    parts = [
+        trial.get('title') or '',
+        'Conditions: ' + ', '.join(trial.get('conditions') or []),
+        trial.get('brief_summary') or '',
+        trial.get('detailed_description') or '',
+        trial.get('eligibility_criteria') or '',
+    ]
+    return '\n\n'.join(part for part in parts if part)
+
+
+def trial_hash(trial):
+    """Content hash used to detect trials that changed between snapshots."""
+    return hashlib.sha256(trial_text(trial).encode('utf-8')).hexdigest()
+
+
+def trial_documents(trial):
+    """Chunk a trial into Documents with stable ids of the form '<nct_id>:<chunk>'."""
+    nct_id = trial['nct_id']
+    chunks = text_splitter.split_text(trial_text(trial))
+    documents = [Document(page_content=chunk, metadata={'nct_id': nct_id, 'title': trial.get('title')})
+                 for chunk in chunks]
+    ids = [f"{nct_id}:{i}" for i in range(len(chunks))]
+    return documents, ids
+
+
+def load_trials(trials_path):
+    """Load the trial snapshot (Parquet or legacy JSON) and key it by nct_id."""
+    if Path(trials_path).suffix == '.parquet':
+        from trial_snapshot import read_snapshot_records
+
+        # Only the columns that are embedded
+        trials = read_snapshot_records(trials_path, columns=TEXT_COLUMNS)
+    else:
+        with open(trials_path, 'r', encoding='utf-8') as f:
+            trials = json.load(f)
+    return {trial['nct_id']: trial for trial in trials}
+
+
+def _read_manifest(index_dir):
+    with open(Path(index_dir) / MANIFEST_NAME, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _write_manifest(index_dir, manifest):
+    with open(Path(index_dir) / MANIFEST_NAME, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f)
+
+
+def build_index(trials_path, index_dir, embeddings):
+    """Embed every trial once and save the FAISS index, docstore and manifest to `index_dir`."""
+    trials = load_trials(trials_path)
+    documents, ids, manifest = [], [], {}
+    for nct_id, trial in trials.items():
+        trial_docs, trial_ids = trial_documents(trial)
+        documents.extend(trial_docs)
+        ids.extend(trial_ids)
+        manifest[nct_id] = {'hash': trial_hash(trial), 'ids': trial_ids}
+
+    db = FAISS.from_documents(documents, embeddings, ids=ids)
+    db.save_local(index_dir)
+    _write_manifest(index_dir, manifest)
+    print(f"Built index for {len(trials)} trials ({len(documents)} chunks) in {index_dir}")
+    return db
+
+
+def load_index(index_dir, embeddings, mmap=True):
+    """
+    Load a prebuilt index from disk.
+
+    With `mmap=True` the vectors are memory-mapped instead of read into RAM. A
+    memory-mapped index is read-only, so use `mmap=False` when the index is
+    going to be updated.
+    """
+    path = Path(index_dir)
+    index_file = str(path / 'index.faiss')
+    if mmap:
+        try:
+            index = faiss.read_index(index_file, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+        except RuntimeError:
+            # Not every index type supports mmap, fall back to a regular read
+            index = faiss.read_index(index_file)
+    else:
+        index = faiss.read_index(index_file)
+
+    with open(path / 'index.pkl', 'rb') as f:
+        docstore, index_to_docstore_id = pickle.load(f)
+
+    return FAISS(embeddings, index, docstore, index_to_docstore_id)
+
+
+def update_index(trials_path, index_dir, embeddings):
+    """
+    Bring an existing index in line with the trials file, embedding only what changed.
+
+    Trials that are new or whose content hash changed are (re-)embedded; trials that
+    disappeared from the file or changed are removed by their nct_id chunk ids.
+    """
+    trials = load_trials(trials_path)
+    manifest = _read_manifest(index_dir)
+    db = load_index(index_dir, embeddings, mmap=False)
+
+    removed = [nct_id for nct_id, entry in manifest.items()
+               if nct_id not in trials or entry['hash'] != trial_hash(trials[nct_id])]
+    added = [nct_id for nct_id, trial in trials.items()
+             if nct_id not in manifest or manifest[nct_id]['hash'] != trial_hash(trial)]
+
+    stale_ids = [doc_id for nct_id in removed for doc_id in manifest.pop(nct_id)['ids']]
+    if stale_ids:
+        db.delete(stale_ids)
+
+    documents, ids = [], []
+    for nct_id in added:
+        trial_docs, trial_ids = trial_documents(trials[nct_id])
+        documents.extend(trial_docs)
+        ids.extend(trial_ids)
+        manifest[nct_id] = {'hash': trial_hash(trials[nct_id]), 'ids': trial_ids}
+    if documents:
+        db.add_documents(documents, ids=ids)
+
+    db.save_local(index_dir)
+    _write_manifest(index_dir, manifest)
+    print(f"Updated {index_dir}: {len(added)} trials embedded, "
+          f"{len(set(removed) - set(added))} removed, {len(trials) - len(added)} unchanged")
+    return db
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build or update the clinical trials FAISS index')
+    parser.add_argument('command', choices=['build', 'update'])
+    parser.add_argument('--trials', default=DEFAULT_TRIALS_PATH, help='Trials snapshot (.parquet) or JSON file to index')
+    parser.add_argument('--index-dir', default=DEFAULT_INDEX_DIR, help='Directory the index is saved to')
+    parser.add_argument('--config', default='config.json', help='Path to config file')
+    args = parser.parse_args()
+
+    from clients import get_embeddings
+
+    with open(args.config) as f:
+        config = json.load(f)
+    embeddings = get_embeddings(config)
+
+    if args.command == 'build' or not (Path(args.index_dir) / MANIFEST_NAME).exists():
+        build_index(args.trials, args.index_dir, embeddings)
+    else:
+        update_index(args.trials, args.index_dir, embeddings)
+
+
+if __name__ == "__main__":
+    main()